@@ -0,0 +1,112 @@
+"""
+Benchmark for spswarehouse.canvas_async.AsyncCanvasClient.
+
+Starts a mock Canvas API on localhost that adds a fixed latency to every response,
+paginates each course's endpoint with Link headers and reports X-Rate-Limit-Remaining.
+Then it fetches the same endpoint for every course twice: once with CanvasClient, one
+course after another (the usual ETL loop), and once with AsyncCanvasClient.fetch_all.
+
+Usage:
+    python benchmarks/canvas_async_benchmark.py --courses 200 --pages 3 --latency-ms 50
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from spswarehouse.canvas import CanvasClient
+from spswarehouse.canvas_async import AsyncCanvasClient
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real Canvas API, without Nagle delays between header and body writes
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    # Set by start_mock_canvas
+    latency_seconds = 0
+    pages_per_course = 1
+    records_per_page = 10
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency_seconds)
+
+        url = urlsplit(self.path)
+        page = int(parse_qs(url.query).get('page', ['1'])[0])
+        base_url = f'http://{self.headers["Host"]}{url.path}'
+
+        # Canvas sends next links but, like many real endpoints, no last link
+        links = [f'<{base_url}?page={page}>; rel="current"']
+        if page < self.pages_per_course:
+            links.append(f'<{base_url}?page={page + 1}>; rel="next"')
+
+        body = json.dumps([
+            {'id': page * 1000 + i, 'path': url.path, 'submission': {'score': i}}
+            for i in range(self.records_per_page)
+        ]).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Link', ','.join(links))
+        self.send_header('X-Rate-Limit-Remaining', '700')
+        self.send_header('X-Request-Cost', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_mock_canvas(latency_seconds, pages_per_course):
+    MockCanvasHandler.latency_seconds = latency_seconds
+    MockCanvasHandler.pages_per_course = pages_per_course
+
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockCanvasHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--courses', type=int, default=200)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    server = start_mock_canvas(args.latency_ms / 1000, args.pages)
+    config = {'host': f'http://127.0.0.1:{server.server_port}', 'api_token': 'benchmark'}
+    paths = [f'/api/v1/courses/{course_id}/submissions' for course_id in range(args.courses)]
+
+    print(f'{args.courses} courses x {args.pages} pages, {args.latency_ms:.0f} ms latency per request')
+
+    sync_client = CanvasClient(config)
+    start = time.perf_counter()
+    sync_results = {path: sync_client.get_paginated_json(path) for path in paths}
+    sync_seconds = time.perf_counter() - start
+
+    async_client = AsyncCanvasClient(config, max_concurrency=args.concurrency)
+    start = time.perf_counter()
+    async_results = async_client.fetch_all_sync(paths)
+    async_seconds = time.perf_counter() - start
+
+    server.shutdown()
+
+    assert async_results == sync_results, 'AsyncCanvasClient returned different data than CanvasClient'
+
+    total_requests = args.courses * args.pages
+    print(f'CanvasClient loop:            {sync_seconds:.2f}s ({total_requests / sync_seconds:.0f} requests/s)')
+    print(f'AsyncCanvasClient.fetch_all:  {async_seconds:.2f}s ({total_requests / async_seconds:.0f} requests/s)')
+    print(f'speedup:                      {sync_seconds / async_seconds:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark for spswarehouse.magic_spreadsheet_matching.reconcile_manual_values.
+
+Builds a synthetic Magic Spreadsheet (query columns plus manual columns) and new
+query output where some students left, some joined, and some only match on the
+secondary identifier. Then it times the hash-based reconciliation against the
+merge-based approach it replaced.
+
+Usage:
+    python benchmarks/magic_spreadsheet_matching_benchmark.py --rows 100000 --manual-columns 60
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from spswarehouse.magic_spreadsheet_matching import reconcile_manual_values
+
+PRIMARY_IDENTIFIER = 'student_id'
+SECONDARY_IDENTIFIER = 'ssid'
+
+def build_synthetic_sheets(num_rows, num_query_columns, num_manual_columns, seed=0):
+    """
+    Returns (df_query_output, df_existing_values) shaped like a real refresh: 5% of
+    existing students left, 5% are new, and 2% lost their primary identifier but
+    still have an SSID.
+    """
+    rng = np.random.default_rng(seed)
+
+    student_ids = np.arange(100000, 100000 + num_rows)
+    ssids = np.arange(5000000000, 5000000000 + num_rows)
+
+    df_existing_values = pd.DataFrame({
+        PRIMARY_IDENTIFIER: student_ids.astype(str),
+        SECONDARY_IDENTIFIER: ssids.astype(str),
+    })
+    for i in range(num_manual_columns):
+        df_existing_values[f'manual_{i}'] = rng.choice(['', 'Yes', 'No', 'Called home'], size=num_rows)
+
+    num_changes = num_rows // 20
+    kept_rows = np.sort(rng.choice(num_rows, size=num_rows - num_changes, replace=False))
+    new_ids = np.arange(900000, 900000 + num_changes)
+    new_ssids = np.arange(6000000000, 6000000000 + num_changes)
+
+    query_student_ids = np.concatenate([student_ids[kept_rows], new_ids]).astype(str)
+    query_ssids = np.concatenate([ssids[kept_rows], new_ssids]).astype(str)
+
+    # Some existing rows only have an SSID on the sheet
+    secondary_only_rows = rng.choice(num_rows, size=num_rows // 50, replace=False)
+    df_existing_values.loc[secondary_only_rows, PRIMARY_IDENTIFIER] = 'Not Assigned Yet'
+
+    df_query_output = pd.DataFrame({
+        PRIMARY_IDENTIFIER: query_student_ids,
+        SECONDARY_IDENTIFIER: query_ssids,
+    })
+    for i in range(num_query_columns - 2):
+        df_query_output[f'query_{i}'] = rng.integers(0, 1000, size=len(df_query_output)).astype(str)
+
+    return df_query_output, df_existing_values
+
+def merge_based_reconciliation(df_query_output, df_existing_values, num_query_columns):
+    """
+    The primary merge / secondary merge / drop_duplicates sequence that
+    reconcile_manual_values replaced, kept here for comparison.
+    """
+    df_existing_values = df_existing_values.copy()
+    df_existing_values[PRIMARY_IDENTIFIER] = df_existing_values[PRIMARY_IDENTIFIER].apply(
+        lambda x: '' if x == 'Not Assigned Yet' else x)
+
+    df_primary = df_query_output.merge(df_existing_values, on=PRIMARY_IDENTIFIER, how='left', indicator='match')
+    df_primary = df_primary.rename(columns={f'{SECONDARY_IDENTIFIER}_x': SECONDARY_IDENTIFIER}).drop(
+        f'{SECONDARY_IDENTIFIER}_y', axis=1)
+
+    df_primary_matches = df_primary[df_primary['match'] == 'both'].drop('match', axis=1)
+    df_failed = df_primary[df_primary['match'] != 'both'].drop('match', axis=1).iloc[:, :num_query_columns]
+
+    df_new = df_failed[pd.to_numeric(df_failed[PRIMARY_IDENTIFIER], errors='coerce').notnull()
+        & (df_failed[SECONDARY_IDENTIFIER] == 'N/A')]
+    df_failed = df_failed.drop(df_new.index)
+
+    df_existing_values = df_existing_values[df_existing_values[SECONDARY_IDENTIFIER] != 'N/A']
+    df_existing_values[SECONDARY_IDENTIFIER] = pd.to_numeric(df_existing_values[SECONDARY_IDENTIFIER])
+    df_failed[SECONDARY_IDENTIFIER] = pd.to_numeric(df_failed[SECONDARY_IDENTIFIER])
+
+    df_secondary = df_failed.merge(df_existing_values, on=SECONDARY_IDENTIFIER, how='left')
+    df_secondary = df_secondary.drop(f'{PRIMARY_IDENTIFIER}_y', axis=1).rename(
+        columns={f'{PRIMARY_IDENTIFIER}_x': PRIMARY_IDENTIFIER})
+
+    df_combined = pd.concat([df_primary_matches, df_new, df_secondary], axis=0)
+    df_combined.fillna('', inplace=True)
+    return df_combined.drop_duplicates()
+
+def time_call(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--query-columns', type=int, default=20)
+    parser.add_argument('--manual-columns', type=int, default=60)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    df_query_output, df_existing_values = build_synthetic_sheets(args.rows, args.query_columns, args.manual_columns)
+    print(f'{len(df_query_output):,} query rows, {len(df_existing_values):,} existing rows, '
+        f'{args.manual_columns} manual columns')
+
+    hash_seconds, reconciliation = time_call(
+        lambda: reconcile_manual_values(df_query_output, df_existing_values, PRIMARY_IDENTIFIER, SECONDARY_IDENTIFIER),
+        args.repeats,
+    )
+    merge_seconds, df_merged = time_call(
+        lambda: merge_based_reconciliation(df_query_output, df_existing_values, args.query_columns),
+        args.repeats,
+    )
+
+    print(f'reconcile_manual_values: {hash_seconds:.3f}s '
+        f'({len(reconciliation.matched):,} matched, {len(reconciliation.new):,} new, '
+        f'{len(reconciliation.orphaned):,} orphaned)')
+    print(f'merge-based:             {merge_seconds:.3f}s ({len(df_merged):,} rows)')
+    print(f'speedup:                 {merge_seconds / hash_seconds:.1f}x')
+
+if __name__ == '__main__':
+    main()
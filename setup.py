@@ -36,4 +36,13 @@ setuptools.setup(
         'requests>=2.32.5,<3.0.0',
         'selenium>=4.40.0,<5.0.0',
     ],
+    # Optional features: pip install "spswarehouse[canvas-async,downloads,snapshots]"
+    extras_require={
+        # canvas_async.AsyncCanvasClient
+        'canvas-async': ['httpx>=0.27.0,<1.0.0'],
+        # File system events for general.download_watcher.DownloadWatcher (it polls without them)
+        'downloads': ['watchdog>=4.0.0,<7.0.0'],
+        # Manual values snapshots in magic_spreadsheet_snapshot
+        'snapshots': ['pyarrow>=14.0.0,<27.0.0'],
+    },
 )
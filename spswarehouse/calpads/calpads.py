@@ -3,13 +3,17 @@
 # Author: Howard Shen
 # Last Edited 4/22/2026
 
+import json
 import logging
 import os
 import pandas as pd
+import re
+import requests
 import tempfile
 import time
 
 from datetime import date, datetime
+from urllib.parse import urljoin
 
 from selenium.webdriver.support.ui import Select, WebDriverWait
 from selenium.webdriver.common.by import By
@@ -21,11 +25,7 @@ from selenium.common.exceptions import (
     ElementNotInteractableException
 )
 
-from ducttape.utils import (
-    DriverBuilder,
-    get_most_recent_file_in_dir,
-    wait_for_any_file_in_folder
-)
+from ducttape.utils import DriverBuilder
     
 try:
     from spswarehouse.credentials import calpads_config
@@ -39,11 +39,31 @@ from spswarehouse.calpads.calpads_config import (
     snapshot_links,
 )
 
+from spswarehouse.config import (
+    DEFAULT_BROWSER_POOL_MAX_ATTEMPTS,
+    DEFAULT_BROWSER_POOL_SESSIONS,
+)
+from spswarehouse.general.browser_pool import BrowserPool
+from spswarehouse.general.browser_session import BrowserSessionStore
+from spswarehouse.general.download_watcher import DownloadWatcher
 from spswarehouse.general.selenium import (
     click_element_by_id,
     click_element_by_xpath,
+    create_requests_session_from_driver,
+    download_file_with_requests_session,
     type_in_element_by_name
 )
+
+# Window to give download_calpads_reports for monitoring (Accountability) reports,
+# which aren't tied to a certification window
+MONITORING_REPORT_WINDOW = 'Monitoring'
+
+# Items of the report viewer's export menu, by download_type
+REPORT_EXPORT_MENU_ITEM_XPATHS = {
+    'csv': '//*[@id="ReportViewer1_ctl09_ctl04_ctl00_Menu"]/div[7]/a',
+    'pdf': '//*[@id="ReportViewer1_ctl09_ctl04_ctl00_Menu"]/div[4]/a',
+    'excel': '//*[@id="ReportViewer1_ctl09_ctl04_ctl00_Menu"]/div[2]/a'
+}
     
 class CALPADS():
     
@@ -55,6 +75,8 @@ class CALPADS():
         host=None,
         download_location=None,
         headless=True,
+        session_cookies_path=None,
+        use_report_export_urls=False,
     ):
         """
         By default, the class will pull the username and password from the
@@ -77,6 +99,15 @@ class CALPADS():
             folder path passed, creates a temporary directory for this object.
         headless: Selenium headless value. Default to True. If using this in a notebook,
             recommend setting to False.
+        session_cookies_path: Optional file where the login cookies are saved (see
+            spswarehouse.general.browser_session.BrowserSessionStore). If the cookies saved
+            there are still logged in, they are reused instead of going through the login again.
+        use_report_export_urls: If True, once the report viewer has run a snapshot or monitoring
+            report, the file is fetched from the viewer's own export link with the browser's login
+            cookies and streamed to the download folder, instead of going through the export menu
+            and the browser's download. The report is the one the viewer ran, with the parameters
+            chosen in it. If the export link can't be found or doesn't return a file, the export
+            menu is used as before.
         """
         
         self.host = None
@@ -103,12 +134,21 @@ class CALPADS():
             self.download_location = tempfile.mkdtemp()
         else:
             self.download_location = download_location
+
+        self.use_report_export_urls = use_report_export_urls
     
         self.driver = DriverBuilder().get_driver(
             download_location=self.download_location,
             headless=headless
         )
-        self._login_to_calpads(username, password)
+
+        if session_cookies_path is None:
+            self._login_to_calpads(username, password)
+        else:
+            session_store = BrowserSessionStore(session_cookies_path)
+            if not session_store.restore(self.driver, self.host, self._is_logged_into_calpads):
+                if self._login_to_calpads(username, password):
+                    session_store.save(self.driver)
 
     def quit(self):
         self.driver.quit()
@@ -600,7 +640,8 @@ class CALPADS():
         """
         Download a CALPADS snapshot report.
         
-        Known issue: The download folder needs to be empty when this function is called.
+        Files already in the download folder are ignored; the path of the newly
+        downloaded file is returned.
         
         Parameters:
         lea: The numerical value of the LEA on the CALPADS site. Find by inspecting the
@@ -652,7 +693,8 @@ class CALPADS():
         """
         Download a CALPADS snapshot report.
         
-        Known issue: The download folder needs to be empty when this function is called.
+        Files already in the download folder are ignored; the path of the newly
+        downloaded file is returned.
         
         Parameters:
         lea: The numerical value of the LEA on the CALPADS site. Find by inspecting the
@@ -741,6 +783,17 @@ class CALPADS():
 
         return True
     
+    def _is_logged_into_calpads(self):
+        """
+        Checks whether the page that was just loaded is logged into CALPADS, i.e., has the
+        LEA dropdown.
+        """
+        try:
+            WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.ID, 'org-select')))
+            return True
+        except TimeoutException:
+            return False
+
     def _select_lea(self, lea):
         """
         Factored out common process for switching to a different LEA in the dropdown
@@ -784,6 +837,7 @@ class CALPADS():
             logging.info("Failed to load report page.")
             raise
         
+        report_viewer_url = iframe.get_attribute('src')
         self.driver.switch_to.frame(iframe)
         self._select_report_academic_year(academic_year)
         
@@ -824,9 +878,51 @@ class CALPADS():
         submit_button.click()
         
         self._wait_for_view_report_clickable(max_wait_time)
+
+        if self.use_report_export_urls:
+            filepath = self._download_loaded_report_from_export_url(report_viewer_url, download_type)
+            if filepath is not None:
+                return filepath
+
         filepath = self._download_loaded_report(download_type, max_wait_time)
         return filepath
         
+    def _download_loaded_report_from_export_url(self, report_viewer_url, download_type):
+        """
+        Downloads the report that is already loaded in the report viewer from the viewer's
+        export link (its ExportUrlBase plus the format of the export menu item), the same
+        request the export menu makes. Assumes the driver is still clicked into the iframe,
+        so the viewer's cookies can be copied.
+
+        Return:
+        string: The filepath to the downloaded file, or None if the export link couldn't be
+            found or didn't return a file, and the export menu should be used instead.
+        """
+        export_url_base = re.search(r'"ExportUrlBase":"((?:[^"\\]|\\.)*)"', self.driver.page_source)
+        menu_item_onclick = self.driver.find_element(
+            By.XPATH,
+            REPORT_EXPORT_MENU_ITEM_XPATHS[download_type]
+        ).get_attribute('onclick') or ''
+        export_format = re.search(r"exportReport\('([^']+)'\)", menu_item_onclick)
+
+        if export_url_base is None or export_format is None:
+            logging.info("Could not find the report viewer's export link. Using the export menu.")
+            return None
+
+        # ExportUrlBase is a JSON string in the page's script
+        export_url = urljoin(report_viewer_url, json.loads(f'"{export_url_base.group(1)}"') + export_format.group(1))
+
+        session = create_requests_session_from_driver(self.driver)
+        try:
+            filepath = download_file_with_requests_session(session, export_url, self.download_location,
+                rejected_content_types=['text/html'])
+        except (requests.RequestException, ValueError) as e:
+            logging.info(f"Could not download the report from its export link: {e!r}. Using the export menu.")
+            return None
+
+        logging.info(f"File found: {filepath}")
+        return filepath
+
     def _select_report_academic_year(self, academic_year):
         """
         Select the given academic_year for the the reports module. Assumes the driver
@@ -869,16 +965,14 @@ class CALPADS():
         """
         Downloads the report that is already loaded on the page. Assumes the driver
         is still clicked into the iframe with the report controls.
+
+        The download counts as finished once the new file is no longer a partial
+        (.crdownload) file and its size has stopped changing.
         
         Return:
-        string: The filepath to the downloaded file.
+        string: The filepath to the downloaded file, or None if no download finished
+            within max_wait_time minutes.
         """
-        dl_types = {
-            'csv': '//*[@id="ReportViewer1_ctl09_ctl04_ctl00_Menu"]/div[7]/a',
-            'pdf': '//*[@id="ReportViewer1_ctl09_ctl04_ctl00_Menu"]/div[4]/a',
-            'excel': '//*[@id="ReportViewer1_ctl09_ctl04_ctl00_Menu"]/div[2]/a'
-        }
-        
         dropdown_btn = self.driver.find_element(
             By.XPATH,
             '//*[@id="ReportViewer1_ctl09_ctl04_ctl00"]'
@@ -888,17 +982,100 @@ class CALPADS():
             dl_button = WebDriverWait(self.driver, 10).until(
                 EC.visibility_of_element_located((
                     By.XPATH,
-                    dl_types[download_type]
+                    REPORT_EXPORT_MENU_ITEM_XPATHS[download_type]
                 ))
             )
         except TimeoutException:
             logging.info("Dropdown menu for download not loading")
             raise
+        download_watcher = DownloadWatcher(self.download_location)
         dl_button.send_keys(Keys.ENTER)
-        if wait_for_any_file_in_folder(self.download_location, timeout=max_wait_time*60):
-            file_path = get_most_recent_file_in_dir(self.download_location)
+        try:
+            file_path = download_watcher.wait_for_download(timeout_seconds=max_wait_time*60)
             logging.info(f"File found: {file_path}")
             return file_path
-        else:
+        except TimeoutError:
             logging.info("No file found")
-            return None
\ No newline at end of file
+            return None
+
+
+# Downloading Many Reports #################
+
+def download_calpads_reports(report_requests, destination_directory_path, config=None,
+    num_sessions=DEFAULT_BROWSER_POOL_SESSIONS, max_attempts=DEFAULT_BROWSER_POOL_MAX_ATTEMPTS,
+    headless=True, session_cookies_path=None, download_type='csv', max_wait_time=10, use_report_export_urls=False,
+    manifest_path=None):
+    """
+    Downloads many CALPADS snapshot and monitoring reports (e.g., every report of a
+    certification window for every LEA) using several logged-in CALPADS sessions at once,
+    each downloading into its own folder, and returns a manifest DataFrame with one row per
+    report: lea, academic_year, window, report_code, status ('downloaded', 'no_file' if no
+    download finished in time, or 'failed'), file_path, attempts, seconds and error.
+
+    Each file is renamed to end with _<lea>_<academic_year>_<window>, so the same report
+    for different LEAs, years or windows doesn't collide.
+
+    Parameters:
+    report_requests: A list of (lea, academic_year, window, report_code) tuples. window is
+        a certification window in calpads_config.snapshot_links (e.g., 'EOY1'), or
+        MONITORING_REPORT_WINDOW ('Monitoring') for calpads_config.monitoring_links.
+        See download_snapshot_report for the other values.
+    destination_directory_path: Where the renamed files are collected. Each session
+        downloads into its own session_<index> subfolder first.
+    config: A CALPADS config dict (see CALPADS), or a list of them to log each session in
+        with a different account. Defaults to the credentials file.
+    num_sessions: How many browser sessions run at once. Ignored if config is a list.
+    max_attempts: How many times a report is tried, on a fresh session after a failure.
+    session_cookies_path: Optional file to save the login cookies to (see CALPADS). Each
+        session gets its own file, with _session_<index> added to the name, because the
+        selected LEA is kept per login session.
+    download_type, max_wait_time: See download_snapshot_report.
+    use_report_export_urls: See CALPADS.
+    manifest_path: Optional path to also save the manifest to as a CSV.
+
+    Returns:
+    pandas.DataFrame: The manifest
+    """
+    report_jobs = []
+    for lea, academic_year, window, report_code in report_requests:
+        # Check every report exists before any browser is started
+        if window == MONITORING_REPORT_WINDOW:
+            if report_code not in monitoring_links:
+                raise KeyError(f"Monitoring report {report_code} not found in calpads_config.monitoring_links")
+        elif report_code not in snapshot_links.get(window, {}):
+            raise KeyError(f"Snapshot report {report_code} for {window} not found in calpads_config.snapshot_links")
+
+        report_jobs.append({'lea': lea, 'academic_year': academic_year, 'window': window, 'report_code': report_code})
+
+    configs = config if isinstance(config, list) else [config] * num_sessions
+
+    def create_session(session_index, download_directory):
+        cookies_path = None
+        if session_cookies_path is not None:
+            path_root, path_ext = os.path.splitext(session_cookies_path)
+            cookies_path = f'{path_root}_session_{session_index}{path_ext}'
+
+        return CALPADS(config=configs[session_index], download_location=download_directory, headless=headless,
+            session_cookies_path=cookies_path, use_report_export_urls=use_report_export_urls)
+
+    def run_job(session, report_job, download_directory):
+        if report_job['window'] == MONITORING_REPORT_WINDOW:
+            file_path = session.download_monitoring_report(report_job['lea'], report_job['academic_year'],
+                report_job['report_code'], download_type=download_type, max_wait_time=max_wait_time)
+        else:
+            file_path = session.download_snapshot_report(report_job['lea'], report_job['academic_year'],
+                report_job['window'], report_job['report_code'], download_type=download_type,
+                max_wait_time=max_wait_time)
+
+        if file_path is None:
+            return None
+
+        file_name, file_ext = os.path.splitext(file_path)
+        new_file_path = f"{file_name}_{report_job['lea']}_{report_job['academic_year']}_{report_job['window']}{file_ext}"
+        os.replace(file_path, new_file_path)
+
+        return new_file_path
+
+    pool = BrowserPool(create_session, len(configs), destination_directory_path, max_attempts)
+
+    return pool.run(report_jobs, run_job, manifest_path)
@@ -1,5 +1,28 @@
 import requests
 import json
+import os
+import pandas as pd
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+from .config import (
+    DEFAULT_CANVAS_BACKOFF_SECONDS,
+    DEFAULT_CANVAS_DATAFRAME_BATCH_ROWS,
+    DEFAULT_CANVAS_MAX_BACKOFF_SECONDS,
+    DEFAULT_CANVAS_MAX_RETRIES,
+    DEFAULT_CANVAS_MAX_WORKERS,
+    DEFAULT_CANVAS_POOL_SIZE,
+    DEFAULT_CANVAS_RATE_LIMIT_LEAK_PER_SECOND,
+    DEFAULT_CANVAS_RATE_LIMIT_LOW_REMAINING,
+    DEFAULT_CANVAS_RATE_LIMIT_MAX_PAUSE_SECONDS,
+    DEFAULT_CANVAS_SYNC_OVERLAP_SECONDS,
+)
 
 try:
     from .credentials import canvas_config
@@ -7,8 +30,139 @@ except:
     print("No canvas credentials file found in spswarehouse. This could cause issues.")
     canvas_config = None
 
+class CanvasRateGovernor():
+    """
+    Keeps requests to Canvas at the rate its leaky bucket can sustain, across threads.
+
+    Canvas reports the bucket's remaining quota in X-Rate-Limit-Remaining and the cost of
+    each request in X-Request-Cost. The governor tracks both and:
+    - limits how many requests are in flight: the limit goes up by 1 while quota is
+      plentiful and is halved when it runs low or a request is throttled
+    - delays new requests when the quota left, minus the expected cost of the requests
+      in flight, is below low_remaining, for as long as the bucket takes to drain that much
+    - gives the backoff before retrying a request throttled with 403 "Rate Limit Exceeded"
+
+    acquire()/release() are for threads. try_acquire(), compute_delay() and backoff_delay()
+    don't block, so an asyncio client can use the same governor.
+    """
+    def __init__(self, max_concurrency=DEFAULT_CANVAS_MAX_WORKERS,
+        low_remaining=DEFAULT_CANVAS_RATE_LIMIT_LOW_REMAINING,
+        leak_per_second=DEFAULT_CANVAS_RATE_LIMIT_LEAK_PER_SECOND,
+        max_delay_seconds=DEFAULT_CANVAS_RATE_LIMIT_MAX_PAUSE_SECONDS,
+        backoff_seconds=DEFAULT_CANVAS_BACKOFF_SECONDS,
+        max_backoff_seconds=DEFAULT_CANVAS_MAX_BACKOFF_SECONDS):
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.low_remaining = low_remaining
+        self.leak_per_second = leak_per_second
+        self.max_delay_seconds = max_delay_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.allowed_concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.remaining = None
+        # Moving average of X-Request-Cost
+        self.request_cost = 1.0
+        self.throttled_count = 0
+
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until another request may start, waits out any delay, and counts the request
+        as in flight. Every acquire() must be followed by a release().
+        """
+        with self._condition:
+            while self.in_flight >= self.allowed_concurrency:
+                self._condition.wait()
+            self.in_flight += 1
+            delay = self.compute_delay()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def try_acquire(self):
+        """
+        Counts a request as in flight and returns True if the concurrency limit allows
+        another one right now; otherwise returns False. Doesn't wait or apply delays.
+        """
+        with self._condition:
+            if self.in_flight >= self.allowed_concurrency:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, status_code=None, headers=None, body_text=''):
+        """
+        Marks a request as done and updates the quota, cost and concurrency limit from its
+        response. Pass no response if the request failed. Returns True if Canvas throttled it.
+        """
+        throttled = self.is_throttled(status_code, body_text)
+
+        with self._condition:
+            self.in_flight = max(0, self.in_flight - 1)
+
+            if headers is not None:
+                remaining = _header_float(headers, "X-Rate-Limit-Remaining")
+                if remaining is not None:
+                    self.remaining = remaining
+
+                cost = _header_float(headers, "X-Request-Cost")
+                if cost is not None:
+                    self.request_cost = 0.8 * self.request_cost + 0.2 * cost
+
+            if throttled:
+                self.throttled_count += 1
+                self.allowed_concurrency = max(1, self.allowed_concurrency // 2)
+            elif self.remaining is not None and self.remaining < self.low_remaining:
+                self.allowed_concurrency = max(1, self.allowed_concurrency // 2)
+            elif self.remaining is None or self.remaining >= 2 * self.low_remaining:
+                self.allowed_concurrency = min(self.max_concurrency, self.allowed_concurrency + 1)
+
+            self._condition.notify_all()
+
+        return throttled
+
+    def compute_delay(self):
+        """
+        Returns how long to wait (in seconds) before starting a request, based on the last
+        reported quota and the expected cost of the requests already in flight.
+        """
+        if self.remaining is None:
+            return 0
+
+        projected_remaining = self.remaining - self.in_flight * self.request_cost
+        if projected_remaining >= self.low_remaining:
+            return 0
+
+        return min(self.max_delay_seconds, (self.low_remaining - projected_remaining) / self.leak_per_second)
+
+    def backoff_delay(self, attempt):
+        """
+        Returns how long to wait before retry number `attempt` (starting at 0) of a
+        throttled request: exponential backoff with jitter, capped at max_backoff_seconds.
+        """
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** attempt))
+        return delay * random.uniform(0.5, 1)
+
+    @staticmethod
+    def is_throttled(status_code, body_text=''):
+        return status_code == 403 and "Rate Limit Exceeded" in (body_text or '')
+
+def _header_float(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
 class CanvasClient():
-    def __init__(self, config=None):
+    def __init__(self, config=None, pool_size=DEFAULT_CANVAS_POOL_SIZE, max_workers=DEFAULT_CANVAS_MAX_WORKERS,
+        max_retries=DEFAULT_CANVAS_MAX_RETRIES, governor=None):
         if config is None:
             self.config = canvas_config
         else:
@@ -16,6 +170,18 @@ class CanvasClient():
 
         self.HOST = self.config["host"]
         self.TOKEN = self.config["api_token"]
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+        # Shared by all threads using this client, so they stay under Canvas's rate limit together
+        self.governor = CanvasRateGovernor(max_concurrency=max_workers) if governor is None else governor
+
+        # One Session for all requests, so connections are kept alive and reused,
+        # with enough pooled connections for concurrent page fetches
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def request(self, method, path, **kwargs):
         """
@@ -24,6 +190,9 @@ class CanvasClient():
 
         If `path` starts with a "/", it is assumed to be a relative path and the base
         Canvas URL (config["host"]) is prepended
+
+        Requests go through the client's rate governor, and requests that Canvas throttles
+        (403 "Rate Limit Exceeded") are retried up to max_retries times with backoff.
         """
         if path.startswith("/"):
             path = f'{self.HOST}{path}'
@@ -31,11 +200,27 @@ class CanvasClient():
         headers = kwargs.setdefault("headers", {})
         kwargs["headers"]["Authorization"] = f"Bearer {self.TOKEN}"
 
-        r = requests.request(method, path, **kwargs)
-            
-        return r
+        attempt = 0
+        while True:
+            self.governor.acquire()
+            r = None
+            try:
+                r = self.session.request(method, path, **kwargs)
+            finally:
+                throttled = self.governor.release(
+                    status_code=None if r is None else r.status_code,
+                    headers=None if r is None else r.headers,
+                    body_text='' if r is None or r.status_code != 403 else r.text,
+                )
 
-    def _link_header_to_dict(self, link_header):
+            if not throttled or attempt >= self.max_retries:
+                return r
+
+            time.sleep(self.governor.backoff_delay(attempt))
+            attempt += 1
+
+    @staticmethod
+    def _link_header_to_dict(link_header):
         # Turning pagination headers into a dictionary
         # Example:
         #"""
@@ -45,27 +230,79 @@ class CanvasClient():
         #<https://summitps.instructure.com/api/v1/courses/2809/modules?page=2&per_page=10>; rel="last"
         #"""
         split_header_list = [l.partition("; rel=") for l in link_header.split(",") ]
-        link_header_dict = { type.strip('"') : url.strip("<>") for (url, _, type) in split_header_list }
+        link_header_dict = { type.strip().strip('"') : url.strip().strip("<>") for (url, _, type) in split_header_list }
         
         return link_header_dict
 
-    def get_paginated_json(self, path, **kwargs):
+    @staticmethod
+    def _predictable_page_urls(link_header_dict):
+        # If the "next" and "last" links only differ by a numeric page parameter, the URLs
+        # of all the remaining pages are known up front. Returns them, or None if not
+        # (e.g., Canvas uses opaque bookmarks instead of page numbers, or no "last" link).
+        if "next" not in link_header_dict or "last" not in link_header_dict:
+            return None
+
+        next_url = urlsplit(link_header_dict["next"])
+        last_url = urlsplit(link_header_dict["last"])
+        next_query = parse_qsl(next_url.query, keep_blank_values=True)
+        last_query = parse_qsl(last_url.query, keep_blank_values=True)
+
+        next_page = dict(next_query).get("page", "")
+        last_page = dict(last_query).get("page", "")
+        if not (next_page.isdigit() and last_page.isdigit()):
+            return None
+
+        without_page = lambda query: [(key, value) for (key, value) in query if key != "page"]
+        if next_url[:3] != last_url[:3] or without_page(next_query) != without_page(last_query):
+            return None
+
+        page_urls = []
+        for page in range(int(next_page), int(last_page) + 1):
+            page_query = [(key, str(page) if key == "page" else value) for (key, value) in next_query]
+            page_urls.append(urlunsplit(next_url._replace(query=urlencode(page_query))))
+
+        return page_urls
+
+    def _get_response_json(self, url, **kwargs):
+        r = self.request("GET", url, **kwargs)
+
+        if r.status_code != 200:
+            raise CanvasAPIError(url, r)
+
+        return r
+
+    def iter_paginated_json(self, path, yield_pages=False, concurrent=True, max_workers=None, **kwargs):
         """
-        Helper function for a very common type of API request: a GET request
-        where the data to be returned is JSON and may be paginated.
+        Generator version of get_paginated_json: yields the records of a paginated
+        GET endpoint one at a time (or each page's JSON, if yield_pages is True) as
+        pages arrive, so the whole result never has to be held in memory.
 
-        This function handles following pagination links and returns
-        all the data at once. It may make multiple requests to the Canvas
-        API.
+        Raises CanvasAPIError if any page comes back with a non-200 status code.
+
+        Pages are fetched as in get_paginated_json. When page URLs are predictable,
+        at most max_workers pages are fetched ahead of the one being yielded.
         """
-        r = self.request("GET", path, **kwargs)
-        
-        if r.status_code != 200:
-            print("Received a non-200 status code:", r)
-            return None
-        
-        data = r.json()
-        
+        r = self._get_response_json(path, **kwargs)
+        yield from self._page_items(r.json(), yield_pages)
+
+        if concurrent and "LINK" in r.headers:
+            page_urls = self._predictable_page_urls(self._link_header_to_dict(r.headers["LINK"]))
+
+            if page_urls is not None:
+                window_size = max_workers or self.max_workers
+                with ThreadPoolExecutor(max_workers=window_size) as executor:
+                    # Keep a bounded window of pages in flight and yield them in page order
+                    pending_pages = []
+                    for page_url in page_urls:
+                        pending_pages.append(executor.submit(self._get_response_json, page_url, **kwargs))
+                        if len(pending_pages) >= window_size:
+                            yield from self._page_items(pending_pages.pop(0).result().json(), yield_pages)
+
+                    for pending_page in pending_pages:
+                        yield from self._page_items(pending_page.result().json(), yield_pages)
+
+                return
+
         # Handling pagination: continue to make
         # requests until Canvas doesn't give us any more pages to follow
         while "LINK" in r.headers:
@@ -73,11 +310,257 @@ class CanvasClient():
             if "next" not in link_header_dict:
                 # We're done! No more pages
                 break
-            
+
             # Still need to fetch more...
-            r = self.request("GET", link_header_dict["next"], **kwargs)
-            data.extend(r.json())
-            
+            r = self._get_response_json(link_header_dict["next"], **kwargs)
+            yield from self._page_items(r.json(), yield_pages)
+
+    def _page_items(self, page_data, yield_pages):
+        if yield_pages or not isinstance(page_data, list):
+            return [page_data]
+        return page_data
+
+    def get_paginated_json(self, path, concurrent=True, max_workers=None, **kwargs):
+        """
+        Helper function for a very common type of API request: a GET request
+        where the data to be returned is JSON and may be paginated.
+
+        This function handles following pagination links and returns
+        all the data at once. It may make multiple requests to the Canvas
+        API. For very large endpoints, use iter_paginated_json or
+        iter_paginated_dataframes instead.
+
+        If concurrent is True and Canvas's Link header has a "last" link with
+        a page number, the remaining pages are fetched in parallel (at most
+        max_workers at a time, default self.max_workers) and combined in page
+        order. Otherwise, "next" links are followed one page at a time.
+
+        Returns None if the first request gets a non-200 status code; raises
+        CanvasAPIError if a later page does.
+        """
+        pages = self.iter_paginated_json(path, yield_pages=True, concurrent=concurrent,
+            max_workers=max_workers, **kwargs)
+
+        try:
+            data = next(pages)
+        except CanvasAPIError as e:
+            print("Received a non-200 status code:", e.response)
+            return None
+
+        for page_data in pages:
+            data.extend(page_data)
+
         return data
 
+    def iter_paginated_dataframes(self, path, batch_size=DEFAULT_CANVAS_DATAFRAME_BATCH_ROWS, **kwargs):
+        """
+        Yields the records of a paginated GET endpoint as DataFrames of up to
+        batch_size rows, ready for Warehouse.upload_df.
+
+        Nested objects are flattened into columns with dotted names (e.g.,
+        'user.name'). Lists, and dicts left inside lists, are stored as JSON strings.
+        Takes the same keyword arguments as iter_paginated_json.
+        """
+        records = []
+        for record in self.iter_paginated_json(path, **kwargs):
+            records.append(record)
+            if len(records) >= batch_size:
+                yield _records_to_dataframe(records)
+                records = []
+
+        if len(records) > 0:
+            yield _records_to_dataframe(records)
+
+    def iter_incremental_json(self, path, sync_state, since_param=None,
+        overlap_seconds=DEFAULT_CANVAS_SYNC_OVERLAP_SECONDS, yield_pages=False, autosave=True, **kwargs):
+        """
+        Like iter_paginated_json (following "next" links one page at a time), but only
+        fetches what changed since the last completed run recorded in sync_state (a
+        CanvasSyncState):
+
+        - If since_param is given (e.g., 'updated_since' or 'start_time', whichever the
+          endpoint supports), it is set to the start of the last completed run, minus
+          overlap_seconds to allow for clock differences.
+        - Otherwise, pages are requested with If-None-Match and the ETag Canvas sent for
+          the same URL last time. A 304 Not Modified page is skipped; its "next" link is
+          taken from the state. ETags aren't used with since_param, because its value, and
+          so every page URL, changes from run to run.
+        - The URL of the page being processed is kept in the state, so an interrupted
+          run resumes from there with the same time window.
+
+        With autosave=True, the state is written after every page and the run is marked
+        complete when the last page has been yielded. With autosave=False, the caller
+        calls sync_state.save() once it has safely stored what was yielded so far, and
+        sync_state.complete_run() at the end (see sync_endpoint_to_warehouse).
+
+        Raises CanvasAPIError if a page comes back with any other non-200 status code.
+        """
+        in_progress = sync_state.start_run(since_param, overlap_seconds)
+        if autosave:
+            sync_state.save()
+
+        params = dict(kwargs.pop("params", None) or {})
+        if since_param is not None and in_progress["since"] is not None:
+            params[since_param] = in_progress["since"]
+
+        url = in_progress["next_url"] or path
+        # Only the first request needs params; "next" links already include them
+        request_params = params if in_progress["next_url"] is None else None
+
+        while url is not None:
+            etag_key = None
+            cached_page = None
+            if since_param is None:
+                etag_key = f"{url}?{urlencode(sorted(request_params.items()))}" if request_params else url
+                cached_page = sync_state.etags.get(etag_key)
+                sync_state.seen_etag_keys.add(etag_key)
+
+            headers = dict(kwargs.get("headers", {}))
+            if cached_page is not None:
+                headers["If-None-Match"] = cached_page["etag"]
+
+            r = self.request("GET", url, **{**kwargs, "headers": headers, "params": request_params})
+
+            if r.status_code == 304 and cached_page is not None:
+                next_url = cached_page.get("next")
+            elif r.status_code == 200:
+                next_url = self._link_header_to_dict(r.headers["LINK"]).get("next") if "LINK" in r.headers else None
+                if etag_key is not None and r.headers.get("ETag"):
+                    sync_state.etags[etag_key] = {"etag": r.headers["ETag"], "next": next_url}
+                yield from self._page_items(r.json(), yield_pages)
+            else:
+                raise CanvasAPIError(url, r)
+
+            in_progress["next_url"] = next_url
+            if autosave:
+                sync_state.save()
+
+            url = next_url
+            request_params = None
+
+        if autosave:
+            sync_state.complete_run()
+
+    def sync_endpoint_to_warehouse(self, path, warehouse, table, schema, key_columns, sync_state,
+        since_param=None, batch_size=DEFAULT_CANVAS_DATAFRAME_BATCH_ROWS, **kwargs):
+        """
+        Incrementally syncs a paginated endpoint into schema.table: records changed since
+        the last run (see iter_incremental_json) are flattened like in
+        iter_paginated_dataframes and upserted on key_columns with warehouse.upsert_df,
+        in batches of about batch_size records.
+
+        The sync state is only saved after a batch is in the warehouse, so a failed run
+        is retried from the last stored batch. Returns the number of records synced.
+        """
+        records = []
+        num_records_synced = 0
+
+        def upsert_records():
+            warehouse.upsert_df(table, schema, _records_to_dataframe(records), key_columns)
+            sync_state.save()
+
+        pages = self.iter_incremental_json(path, sync_state, since_param=since_param, yield_pages=True,
+            autosave=False, **kwargs)
+        for page_data in pages:
+            records.extend(self._page_items(page_data, yield_pages=False))
+            if len(records) >= batch_size:
+                upsert_records()
+                num_records_synced += len(records)
+                records = []
+
+        if len(records) > 0:
+            upsert_records()
+            num_records_synced += len(records)
+
+        sync_state.complete_run()
+        print(f"Synced {num_records_synced} records from {path} to {schema}.{table}")
+
+        return num_records_synced
+
+class CanvasSyncState():
+    """
+    State of incremental syncs of one Canvas endpoint, kept in a JSON file in
+    state_directory (one file per endpoint_key, e.g., the endpoint path):
+    - last_run_started_at: when the last completed run started (UTC, ISO 8601)
+    - etags: {page URL: {'etag', 'next'}} from the last run (none with a since_param)
+    - in_progress: {'started_at', 'since', 'next_url'} while a run hasn't completed
+    """
+    def __init__(self, state_directory, endpoint_key):
+        self.path = os.path.join(state_directory, quote(endpoint_key, safe='') + '.json')
+        self.seen_etag_keys = set()
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as state_file:
+                self.data = json.load(state_file)
+        else:
+            self.data = {}
+
+        self.data.setdefault('last_run_started_at', None)
+        self.data.setdefault('etags', {})
+        self.data.setdefault('in_progress', None)
+
+    @property
+    def etags(self):
+        return self.data['etags']
+
+    def start_run(self, since_param=None, overlap_seconds=DEFAULT_CANVAS_SYNC_OVERLAP_SECONDS):
+        """
+        Returns the in-progress run, starting a new one unless an interrupted run can be resumed.
+        """
+        if self.data['in_progress'] is None:
+            since = None
+            if since_param is not None and self.data['last_run_started_at'] is not None:
+                last_run_started_at = datetime.fromisoformat(self.data['last_run_started_at'])
+                since = (last_run_started_at - timedelta(seconds=overlap_seconds)).isoformat()
+
+            self.data['in_progress'] = {
+                'started_at': datetime.now(timezone.utc).isoformat(),
+                'since': since,
+                'next_url': None,
+            }
+
+        return self.data['in_progress']
+
+    def complete_run(self):
+        """
+        Records the in-progress run as completed, keeps only the ETags it used, and saves.
+        """
+        if self.data['in_progress'] is not None:
+            self.data['last_run_started_at'] = self.data['in_progress']['started_at']
+            self.data['in_progress'] = None
+
+        self.data['etags'] = {key: value for key, value in self.data['etags'].items() if key in self.seen_etag_keys}
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        # Write to a temporary file first, so an interrupted save can't corrupt the state
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as state_file:
+            json.dump(self.data, state_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+class CanvasAPIError(Exception):
+    """
+    Raised when a Canvas API request returns a non-200 status code.
+    """
+    def __init__(self, url, response):
+        super().__init__(f"Received a non-200 status code for {url}: {response}")
+        self.url = url
+        self.response = response
+        self.status_code = response.status_code
+
+def _records_to_dataframe(records):
+    df = pd.json_normalize(records)
+
+    # Lists and dicts can't be uploaded as they are
+    for column in df.columns:
+        if df[column].dtype == object:
+            is_nested = df[column].map(lambda value: isinstance(value, (list, dict)))
+            if is_nested.any():
+                df.loc[is_nested, column] = df.loc[is_nested, column].map(json.dumps)
+
+    return df
+
 Canvas = None if canvas_config is None else CanvasClient()
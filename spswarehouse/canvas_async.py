@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import threading
+
+from .canvas import CanvasAPIError, CanvasClient, CanvasRateGovernor
+from .config import (
+    DEFAULT_CANVAS_MAX_RETRIES,
+    DEFAULT_CANVAS_MAX_WORKERS,
+)
+
+try:
+    import httpx
+except ModuleNotFoundError:
+    httpx = None
+
+try:
+    from .credentials import canvas_config
+except:
+    canvas_config = None
+
+# How often a request waiting on the rate governor checks again
+GOVERNOR_POLL_SECONDS = 0.05
+
+class AsyncCanvasClient():
+    """
+    asyncio version of CanvasClient for pulling many endpoints at once, e.g., the same
+    endpoint for thousands of courses:
+
+        results = AsyncCanvasClient().fetch_all_sync([f'/api/v1/courses/{id}/assignments' for id in course_ids])
+
+    Requests are authenticated, and pages are followed through the Link header, the same
+    way CanvasClient does it. All requests share one connection pool, at most
+    max_concurrency are in flight at once, and a CanvasRateGovernor (the same class
+    CanvasClient uses) slows them down as Canvas's rate limit quota runs low. Throttled
+    requests are retried with backoff.
+    """
+    def __init__(self, config=None, max_concurrency=DEFAULT_CANVAS_MAX_WORKERS,
+        max_retries=DEFAULT_CANVAS_MAX_RETRIES, governor=None, timeout=60):
+
+        if httpx is None:
+            raise ImportError("httpx is not installed. AsyncCanvasClient needs it: pip install httpx")
+
+        if config is None:
+            self.config = canvas_config
+        else:
+            self.config = config
+
+        self.HOST = self.config["host"]
+        self.TOKEN = self.config["api_token"]
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.governor = CanvasRateGovernor(max_concurrency=max_concurrency) if governor is None else governor
+
+    async def request(self, client, method, path, **kwargs):
+        """
+        Makes an authenticated request to the Canvas API with an httpx.AsyncClient.
+        Returns an httpx.Response.
+
+        If `path` starts with a "/", it is assumed to be a relative path and the base
+        Canvas URL (config["host"]) is prepended
+        """
+        if path.startswith("/"):
+            path = f'{self.HOST}{path}'
+
+        headers = dict(kwargs.pop("headers", {}))
+        headers["Authorization"] = f"Bearer {self.TOKEN}"
+
+        attempt = 0
+        while True:
+            while not self.governor.try_acquire():
+                await asyncio.sleep(GOVERNOR_POLL_SECONDS)
+
+            r = None
+            try:
+                delay = self.governor.compute_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                r = await client.request(method, path, headers=headers, **kwargs)
+            finally:
+                throttled = self.governor.release(
+                    status_code=None if r is None else r.status_code,
+                    headers=None if r is None else r.headers,
+                    body_text='' if r is None or r.status_code != 403 else r.text,
+                )
+
+            if not throttled or attempt >= self.max_retries:
+                return r
+
+            await asyncio.sleep(self.governor.backoff_delay(attempt))
+            attempt += 1
+
+    async def get_paginated_json(self, client, path, **kwargs):
+        """
+        Async version of CanvasClient.get_paginated_json: follows the Link header's
+        "next" links and returns all the data at once.
+
+        Returns None if the first request gets a non-200 status code; raises
+        CanvasAPIError if a later page does.
+        """
+        r = await self.request(client, "GET", path, **kwargs)
+
+        if r.status_code != 200:
+            logging.warning(f"Received a non-200 status code for {path}: {r.status_code}")
+            return None
+
+        data = r.json()
+
+        while "link" in r.headers:
+            link_header_dict = CanvasClient._link_header_to_dict(r.headers["link"])
+            if "next" not in link_header_dict:
+                break
+
+            next_url = link_header_dict["next"]
+            r = await self.request(client, "GET", next_url, **kwargs)
+            if r.status_code != 200:
+                raise CanvasAPIError(next_url, r)
+            data.extend(r.json())
+
+        return data
+
+    async def fetch_all(self, paths, return_exceptions=False, **kwargs):
+        """
+        Fetches every path in `paths` with get_paginated_json, concurrently, and returns
+        {path: data}. Keyword arguments (e.g., params) are passed to every request.
+
+        If return_exceptions is True, a path whose request raised maps to the exception
+        instead of stopping the whole fetch.
+        """
+        paths = list(dict.fromkeys(paths))
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_one(client, path):
+            async with semaphore:
+                return await self.get_paginated_json(client, path, **kwargs)
+
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            results = await asyncio.gather(*[fetch_one(client, path) for path in paths],
+                return_exceptions=return_exceptions)
+
+        return dict(zip(paths, results))
+
+    def fetch_all_sync(self, paths, return_exceptions=False, **kwargs):
+        """
+        Runs fetch_all from regular (non-async) code and returns its result.
+
+        If an event loop is already running in this thread (e.g., in a Jupyter notebook),
+        fetch_all is run on its own loop in a separate thread; in a notebook you can also
+        `await client.fetch_all(paths)` directly.
+        """
+        coroutine = self.fetch_all(paths, return_exceptions=return_exceptions, **kwargs)
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        logging.warning("An event loop is already running; running fetch_all in a separate thread. "
+            "Use `await client.fetch_all(...)` instead to avoid this.")
+
+        outcome = {}
+        def run_in_thread():
+            try:
+                outcome['result'] = asyncio.run(coroutine)
+            except BaseException as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run_in_thread)
+        thread.start()
+        thread.join()
+
+        if 'error' in outcome:
+            raise outcome['error']
+
+        return outcome['result']
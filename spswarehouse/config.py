@@ -1,2 +1,76 @@
 DEFAULT_BATCH_SIZE=200
-DEFAULT_ENCODING='utf-8'
\ No newline at end of file
+DEFAULT_ENCODING='utf-8'
+
+# Google Sheets rejects very large request bodies, so big writes are split into
+# several values.batchUpdate calls that each stay under these limits
+DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST=2000000
+DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST=100000
+
+# Large worksheets are read in row-range chunks so no single range in a
+# values.batchGet response gets too big
+DEFAULT_SHEETS_READ_CHUNK_ROWS=10000
+DEFAULT_SHEETS_MAX_CELLS_PER_READ=1000000
+
+# Drive downloads are buffered in memory up to this size, then spill to a
+# temporary file; recently downloaded files are cached by ID and md5Checksum
+DEFAULT_DRIVE_SPOOL_MAX_MEMORY_BYTES=50*1024*1024
+DEFAULT_DRIVE_CONTENT_CACHE_MAX_FILES=8
+DEFAULT_CSV_READ_CHUNK_ROWS=10000
+
+# How long Drive folder lookups are trusted before Drive is queried again
+DEFAULT_DRIVE_FOLDER_INDEX_TTL_SECONDS=300
+
+# Google Sheets allows about 60 read and 60 write requests per minute per user;
+# used to estimate how long a Magic Spreadsheet refresh will take
+DEFAULT_SHEETS_REQUESTS_PER_MINUTE=60
+
+# Canvas API: connections kept open per host, pages fetched at once when page
+# numbers are predictable, and the X-Rate-Limit-Remaining level below which
+# requests start pausing
+DEFAULT_CANVAS_POOL_SIZE=16
+DEFAULT_CANVAS_MAX_WORKERS=8
+DEFAULT_CANVAS_RATE_LIMIT_LOW_REMAINING=100
+DEFAULT_CANVAS_RATE_LIMIT_MAX_PAUSE_SECONDS=2
+
+# Canvas's rate limit bucket drains at about this many cost units per second;
+# requests throttled with 403 "Rate Limit Exceeded" are retried with backoff
+DEFAULT_CANVAS_RATE_LIMIT_LEAK_PER_SECOND=10
+DEFAULT_CANVAS_MAX_RETRIES=5
+DEFAULT_CANVAS_BACKOFF_SECONDS=1
+DEFAULT_CANVAS_MAX_BACKOFF_SECONDS=60
+
+# Rows per DataFrame when streaming Canvas records for upload
+DEFAULT_CANVAS_DATAFRAME_BATCH_ROWS=10000
+
+# Incremental Canvas syncs ask for changes since the last run minus this much
+DEFAULT_CANVAS_SYNC_OVERLAP_SECONDS=300
+
+# Browser downloads: how long to wait for one, how long a finished file's size must
+# stay the same before it counts as complete, and how often the folder is checked
+# when watchdog isn't installed
+DEFAULT_DOWNLOAD_TIMEOUT_SECONDS=600
+DEFAULT_DOWNLOAD_STABLE_SECONDS=1
+DEFAULT_DOWNLOAD_POLL_SECONDS=0.5
+
+# Browser pools: logged-in sessions running jobs at once, and how many times a
+# job is tried (on a fresh session after a failure) before it is given up on
+DEFAULT_BROWSER_POOL_SESSIONS=4
+DEFAULT_BROWSER_POOL_MAX_ATTEMPTS=2
+
+# PowerSchool report queue: how long a just-submitted report is given to get into
+# the queue, how long it may take to show up there, and how long to wait for
+# reports to finish
+DEFAULT_REPORT_QUEUE_SETTLE_SECONDS=5
+DEFAULT_REPORT_QUEUE_SUBMIT_TIMEOUT_SECONDS=120
+DEFAULT_REPORT_QUEUE_TIMEOUT_SECONDS=3600
+
+# Polling (e.g., of the report queue) starts with short waits between checks
+# that grow by this factor, up to the maximum
+DEFAULT_POLL_INITIAL_INTERVAL_SECONDS=1
+DEFAULT_POLL_MAX_INTERVAL_SECONDS=15
+DEFAULT_POLL_BACKOFF_FACTOR=2
+
+# Selenium condition waits: how often the page is checked, and how long a list of
+# elements must keep the same length before it counts as loaded
+DEFAULT_SELENIUM_POLL_SECONDS=0.1
+DEFAULT_ELEMENT_COUNT_STABLE_SECONDS=0.5
@@ -0,0 +1,203 @@
+"""
+Runs browser jobs (e.g., report downloads) across several logged-in Selenium sessions
+at once.
+
+Each session runs in its own thread with its own download directory, so sessions
+never see each other's downloads. Jobs are handed out from a queue, and a job that
+raises is retried on a fresh session. Jobs can be grouped (e.g., by school), in which
+case a session keeps taking jobs from the group it is on, so it switches less. Downloaded files are moved into one
+destination directory, and a manifest of every job (status, file path, attempts,
+timing) is returned as a DataFrame.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+from spswarehouse.config import (
+    DEFAULT_BROWSER_POOL_MAX_ATTEMPTS,
+    DEFAULT_BROWSER_POOL_SESSIONS,
+)
+
+MANIFEST_COLUMNS = ['job_index', 'status', 'file_path', 'attempts', 'seconds', 'session_index', 'error']
+
+class BrowserPool():
+    """
+    create_session: function (session_index, download directory) -> session. The
+        session must have a quit() method, e.g., a PowerSchool object.
+    num_sessions: How many sessions run jobs at once.
+    download_directory: Where downloaded files end up. Each session downloads into
+        its own session_<index> subfolder first.
+    max_attempts: How many times a job is tried before it is recorded as failed.
+    """
+    def __init__(self, create_session, num_sessions=DEFAULT_BROWSER_POOL_SESSIONS, download_directory='.',
+        max_attempts=DEFAULT_BROWSER_POOL_MAX_ATTEMPTS):
+
+        self.create_session = create_session
+        self.num_sessions = num_sessions
+        self.download_directory = download_directory
+        self.max_attempts = max_attempts
+
+    def run(self, jobs, run_job, manifest_path=None, group_by=None):
+        """
+        run: [job], function (session, job, session download directory) -> pandas.DataFrame
+
+        Runs run_job for every job and returns the manifest, one row per job in the
+        order given. run_job returns the path of the file it downloaded, or None if
+        there was nothing to download. If jobs are dicts, their keys are included as
+        manifest columns. The status column is 'downloaded', 'no_file' or 'failed'.
+
+        If group_by (function job -> key) is given, each session keeps taking jobs with the
+        same key as its previous job while there are any, and otherwise starts on a group no
+        other session is on.
+
+        If manifest_path is given, the manifest is also saved there as a CSV.
+        """
+        jobs = list(jobs)
+        os.makedirs(self.download_directory, exist_ok=True)
+
+        job_queue = _JobQueue(group_by)
+        for job_index, job in enumerate(jobs):
+            job_queue.put(job_index, job, 1)
+
+        results = {}
+        results_lock = threading.Lock()
+
+        def record_result(job_index, **result):
+            with results_lock:
+                results[job_index] = {'job_index': job_index, **result}
+
+        num_sessions = max(1, min(self.num_sessions, len(jobs)))
+        workers = [
+            threading.Thread(target=self._run_worker, args=(session_index, job_queue, run_job, record_result))
+            for session_index in range(num_sessions)
+        ]
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        manifest = pd.DataFrame(
+            [{**_job_to_dict(jobs[job_index]), **results[job_index]} for job_index in range(len(jobs))],
+            columns=_manifest_columns(jobs),
+        )
+
+        logging.info(f'Browser pool ran {len(jobs)} jobs on {num_sessions} sessions in '
+            f'{time.perf_counter() - start:.0f} seconds: {manifest["status"].value_counts().to_dict()}')
+
+        if manifest_path is not None:
+            manifest.to_csv(manifest_path, index=False)
+
+        return manifest
+
+    def _run_worker(self, session_index, job_queue, run_job, record_result):
+        session_download_directory = os.path.join(self.download_directory, f'session_{session_index}')
+        os.makedirs(session_download_directory, exist_ok=True)
+
+        session = None
+        try:
+            while True:
+                next_job = job_queue.get(session_index)
+                if next_job is None:
+                    return
+                job_index, job, attempt = next_job
+
+                start = time.perf_counter()
+                try:
+                    if session is None:
+                        session = self.create_session(session_index, session_download_directory)
+
+                    downloaded_file_path = run_job(session, job, session_download_directory)
+                    file_path = self._collect_file(downloaded_file_path, session_download_directory)
+
+                    record_result(job_index, status='no_file' if file_path is None else 'downloaded',
+                        file_path=file_path, attempts=attempt, seconds=round(time.perf_counter() - start, 1),
+                        session_index=session_index, error=None)
+                    logging.info(f'Session {session_index} finished job {job_index} in '
+                        f'{time.perf_counter() - start:.0f} seconds: {file_path}')
+                except Exception as e:
+                    logging.warning(f'Session {session_index} failed job {job_index} (attempt {attempt} of '
+                        f'{self.max_attempts}): {e!r}')
+
+                    # The browser may be in an unknown state, so start over with a new session
+                    self._quit_session(session)
+                    session = None
+
+                    if attempt < self.max_attempts:
+                        job_queue.put(job_index, job, attempt + 1)
+                    else:
+                        record_result(job_index, status='failed', file_path=None, attempts=attempt,
+                            seconds=round(time.perf_counter() - start, 1), session_index=session_index,
+                            error=repr(e))
+        finally:
+            self._quit_session(session)
+
+    def _collect_file(self, downloaded_file_path, session_download_directory):
+        # Moves a file the session downloaded into the shared download directory
+        if downloaded_file_path is None:
+            return None
+
+        if os.path.dirname(os.path.abspath(downloaded_file_path)) != os.path.abspath(session_download_directory):
+            return downloaded_file_path
+
+        file_path = os.path.join(self.download_directory, os.path.basename(downloaded_file_path))
+        if os.path.exists(file_path):
+            logging.warning(f'Replacing {file_path} with a newly downloaded file of the same name.')
+        os.replace(downloaded_file_path, file_path)
+
+        return file_path
+
+    def _quit_session(self, session):
+        if session is None:
+            return
+        try:
+            session.quit()
+        except Exception as e:
+            logging.info(f'Could not quit browser session: {e!r}')
+
+class _JobQueue():
+    # Hands out jobs to sessions, keeping each session on one group of jobs when grouped
+    def __init__(self, group_by=None):
+        self.group_by = group_by
+        self._jobs = []
+        self._session_groups = {}
+        self._lock = threading.Lock()
+
+    def put(self, job_index, job, attempt):
+        with self._lock:
+            self._jobs.append((job_index, job, attempt))
+
+    def get(self, session_index):
+        # Returns (job_index, job, attempt), or None when there are no jobs left
+        with self._lock:
+            if len(self._jobs) == 0:
+                return None
+
+            position = 0
+            if self.group_by is not None:
+                groups = [self.group_by(job) for _, job, _ in self._jobs]
+                other_session_groups = [group for other_session_index, group in self._session_groups.items()
+                    if other_session_index != session_index]
+
+                if session_index in self._session_groups and self._session_groups[session_index] in groups:
+                    position = groups.index(self._session_groups[session_index])
+                else:
+                    position = next((i for i, group in enumerate(groups) if group not in other_session_groups), 0)
+                self._session_groups[session_index] = groups[position]
+
+            return self._jobs.pop(position)
+
+def _job_to_dict(job):
+    return job if isinstance(job, dict) else {'job': job}
+
+def _manifest_columns(jobs):
+    job_columns = []
+    for job in jobs:
+        job_columns.extend(column for column in _job_to_dict(job) if column not in job_columns)
+
+    return [column for column in job_columns if column not in MANIFEST_COLUMNS] + MANIFEST_COLUMNS
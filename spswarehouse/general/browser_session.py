@@ -0,0 +1,98 @@
+"""
+Reuses a browser login across runs by saving the session's cookies to a file and
+restoring them into the next browser, so scheduled jobs only go through the full
+interactive login when the saved session has expired:
+
+    store = BrowserSessionStore('~/.spswarehouse/powerschool_cookies.json')
+    if not store.restore(driver, 'https://example.powerschool.com/admin/home.html', is_logged_in):
+        log_in()
+        store.save(driver)
+
+The cookie file holds login credentials in effect, so it is only readable by its owner.
+"""
+
+import json
+import logging
+import os
+import time
+
+from urllib.parse import urlsplit
+
+class BrowserSessionStore():
+    """
+    path: The JSON file the cookies are saved to. It is created with mode 0o600.
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+    def save(self, driver):
+        """
+        Saves the cookies the driver has for the site it is currently on.
+        """
+        directory = os.path.dirname(self.path)
+        if directory != '':
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        saved_session = {
+            'url': driver.current_url,
+            'saved_at': time.time(),
+            'cookies': driver.get_cookies(),
+        }
+
+        # Write to a temporary file that only the owner can read, then move it into place
+        temporary_path = self.path + '.tmp'
+        file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, 'w') as session_file:
+            json.dump(saved_session, session_file)
+        os.replace(temporary_path, self.path)
+
+        logging.info(f'Saved browser session cookies to {self.path}.')
+
+    def restore(self, driver, validation_url, is_logged_in):
+        """
+        restore: WebDriver, URL, function () -> bool -> bool
+
+        Loads the saved cookies into the driver, then loads validation_url (a cheap page
+        that needs a login) and calls is_logged_in() to check the session still works.
+        Returns True if it does; otherwise the saved cookies are deleted and False is
+        returned, and the caller should log in and save again.
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, 'r') as session_file:
+            saved_session = json.load(session_file)
+
+        now = time.time()
+        cookies = [cookie for cookie in saved_session['cookies'] if cookie.get('expiry', now + 1) > now]
+        if len(cookies) == 0:
+            logging.info('The saved browser session has expired.')
+            self.clear()
+            return False
+
+        # Cookies can only be added for the site the browser is on, so open it first
+        site_url = urlsplit(validation_url)
+        driver.get(f'{site_url.scheme}://{site_url.netloc}/')
+        for cookie in cookies:
+            # 'sameSite' values from get_cookies aren't always accepted back by add_cookie
+            cookie = {key: value for key, value in cookie.items() if key != 'sameSite'}
+            try:
+                driver.add_cookie(cookie)
+            except Exception as e:
+                logging.info(f"Could not restore cookie {cookie.get('name')}: {e!r}")
+
+        driver.get(validation_url)
+        if is_logged_in():
+            logging.info(f'Reusing the browser session saved in {self.path}.')
+            return True
+
+        logging.info('The saved browser session is no longer logged in.')
+        self.clear()
+        return False
+
+    def clear(self):
+        """
+        Deletes the saved cookies.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
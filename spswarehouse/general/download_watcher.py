@@ -0,0 +1,168 @@
+"""
+Detects when a browser download into a folder has finished, and returns its path.
+
+Start a DownloadWatcher on the download folder *before* triggering the download, so
+any file that appears afterwards is known to be new:
+
+    watcher = DownloadWatcher(download_folder)
+    download_link.click()
+    file_path = watcher.wait_for_download()
+
+A download counts as finished when a new file with a non-temporary name (not
+.crdownload, .tmp, .part or a dotfile) is in the folder, no new temporary files are
+left, and the file's size hasn't changed for stable_seconds.
+
+With watchdog installed, the folder's file system events (inotify on Linux) wake
+the watcher up; otherwise the folder is polled every poll_seconds.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from spswarehouse.config import (
+    DEFAULT_DOWNLOAD_POLL_SECONDS,
+    DEFAULT_DOWNLOAD_STABLE_SECONDS,
+    DEFAULT_DOWNLOAD_TIMEOUT_SECONDS,
+)
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ModuleNotFoundError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# Extensions browsers use for downloads that are still in progress
+TEMPORARY_DOWNLOAD_EXTENSIONS = ('.crdownload', '.tmp', '.part', '.partial', '.download')
+
+def is_temporary_download_file(file_name):
+    """
+    Returns whether a file name looks like an in-progress download or a hidden file.
+    """
+    return file_name.startswith('.') or file_name.lower().endswith(TEMPORARY_DOWNLOAD_EXTENSIONS)
+
+class DownloadWatcher():
+    """
+    Watches folder_path for a new, completed download. Files already in the folder
+    when the watcher is created (or those in original_files, if given) are ignored.
+    """
+    def __init__(self, folder_path, original_files=None):
+        self.folder_path = folder_path
+        if original_files is None:
+            original_files = os.listdir(folder_path)
+        self.original_files = set(original_files)
+
+        self._folder_changed = threading.Event()
+        self._observer = None
+
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_FolderChangedHandler(self._folder_changed), folder_path, recursive=False)
+            self._observer.start()
+
+    def wait_for_download(self, timeout_seconds=DEFAULT_DOWNLOAD_TIMEOUT_SECONDS,
+        stable_seconds=DEFAULT_DOWNLOAD_STABLE_SECONDS, poll_seconds=DEFAULT_DOWNLOAD_POLL_SECONDS):
+        """
+        wait_for_download: -> str
+
+        Blocks until a new download is complete and returns its full path. If several
+        new files completed, the most recently modified one is returned.
+
+        Raises TimeoutError if no download completed within timeout_seconds.
+        """
+        deadline = time.monotonic() + timeout_seconds
+        candidate_path = None
+        candidate_size = None
+        candidate_stable_since = None
+
+        try:
+            while True:
+                self._folder_changed.clear()
+                now = time.monotonic()
+
+                new_files = self._get_new_files()
+                finished_files = [file_name for file_name in new_files if not is_temporary_download_file(file_name)]
+                downloads_in_progress = len(finished_files) < len(new_files)
+
+                newest_path = None
+                if len(finished_files) > 0 and not downloads_in_progress:
+                    newest_path = max((os.path.join(self.folder_path, file_name) for file_name in finished_files),
+                        key=_get_modified_time)
+
+                newest_size = _get_size(newest_path)
+                if newest_path is None or newest_size is None:
+                    candidate_path = None
+                elif newest_path != candidate_path or newest_size != candidate_size:
+                    candidate_path = newest_path
+                    candidate_size = newest_size
+                    candidate_stable_since = now
+                elif now - candidate_stable_since >= stable_seconds:
+                    logging.info(f'Download complete: {candidate_path}')
+                    return candidate_path
+
+                if now >= deadline:
+                    raise TimeoutError(f'No completed download appeared in {self.folder_path} within '
+                        f'{timeout_seconds} seconds (new files: {sorted(new_files)}).')
+
+                if candidate_path is not None:
+                    wait_seconds = candidate_stable_since + stable_seconds - now
+                elif self._observer is not None:
+                    # Woken up early by file system events; the timeout is only a safety net
+                    wait_seconds = max(stable_seconds, poll_seconds)
+                else:
+                    wait_seconds = poll_seconds
+
+                self._folder_changed.wait(max(0, min(wait_seconds, deadline - now)))
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops watching the folder. Called by wait_for_download once it returns.
+        """
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def _get_new_files(self):
+        return [
+            entry.name for entry in os.scandir(self.folder_path)
+            if entry.name not in self.original_files and entry.is_file()
+        ]
+
+def wait_for_new_file_in_folder(folder_path, original_files, timeout_seconds=DEFAULT_DOWNLOAD_TIMEOUT_SECONDS,
+    stable_seconds=DEFAULT_DOWNLOAD_STABLE_SECONDS):
+    """
+    wait_for_new_file_in_folder: folder path, [file names before the download] -> str
+
+    For when the download was already started: waits until a file that isn't in
+    original_files has finished downloading into folder_path, and returns its full
+    path. Raises TimeoutError if none did within timeout_seconds.
+    """
+    return DownloadWatcher(folder_path, original_files).wait_for_download(timeout_seconds, stable_seconds)
+
+class _FolderChangedHandler(FileSystemEventHandler):
+    def __init__(self, folder_changed):
+        super().__init__()
+        self.folder_changed = folder_changed
+
+    def on_any_event(self, event):
+        self.folder_changed.set()
+
+def _get_modified_time(file_path):
+    try:
+        return os.path.getmtime(file_path)
+    except OSError:
+        # The file was renamed or removed since the folder was listed
+        return 0
+
+def _get_size(file_path):
+    if file_path is None:
+        return None
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return None
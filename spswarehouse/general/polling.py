@@ -0,0 +1,157 @@
+"""
+Bounded polling for things that finish on someone else's schedule, like reports in the
+PowerSchool report queue.
+
+poll_until checks a condition right away (or after an initial delay), then at
+intervals that start short and grow exponentially, and raises a PollingTimeoutError
+once the overall deadline has passed:
+
+    poll_until(report_is_done, timeout_seconds=3600, description='the SENR report')
+
+DurationHistory keeps how long things took (e.g., per report), optionally in a JSON
+file, so that the initial delay can be based on how long they usually take.
+"""
+
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+
+import pandas as pd
+
+from spswarehouse.config import (
+    DEFAULT_POLL_BACKOFF_FACTOR,
+    DEFAULT_POLL_INITIAL_INTERVAL_SECONDS,
+    DEFAULT_POLL_MAX_INTERVAL_SECONDS,
+)
+
+# Most recent durations kept per key in a DurationHistory
+DURATION_HISTORY_MAX_SAMPLES = 50
+
+class PollingTimeoutError(TimeoutError):
+    """
+    Raised by poll_until when the condition wasn't met before the deadline.
+    """
+    def __init__(self, description, timeout_seconds, elapsed_seconds, attempts, last_result=None):
+        self.description = description
+        self.timeout_seconds = timeout_seconds
+        self.elapsed_seconds = elapsed_seconds
+        self.attempts = attempts
+        self.last_result = last_result
+        super().__init__(f'Timed out after {timeout_seconds} seconds waiting for {description} '
+            f'({attempts} checks over {elapsed_seconds:.0f} seconds).')
+
+def poll_until(condition, timeout_seconds, description='condition', initial_delay_seconds=0,
+    initial_interval_seconds=DEFAULT_POLL_INITIAL_INTERVAL_SECONDS,
+    max_interval_seconds=DEFAULT_POLL_MAX_INTERVAL_SECONDS, backoff_factor=DEFAULT_POLL_BACKOFF_FACTOR):
+    """
+    poll_until: function () -> result, timeout in seconds -> result
+
+    Calls condition() until it returns a truthy result, and returns that result. The
+    first call is after initial_delay_seconds; after that, the wait between calls
+    starts at initial_interval_seconds and is multiplied by backoff_factor each time,
+    up to max_interval_seconds. The last wait is shortened to end at the deadline.
+
+    Raises PollingTimeoutError if condition() hasn't returned a truthy result within
+    timeout_seconds. Exceptions raised by condition() are not caught.
+    """
+    start = time.monotonic()
+    deadline = start + timeout_seconds
+    interval = initial_interval_seconds
+    attempts = 0
+
+    if initial_delay_seconds > 0:
+        time.sleep(min(initial_delay_seconds, timeout_seconds))
+
+    while True:
+        result = condition()
+        attempts += 1
+        if result:
+            return result
+
+        now = time.monotonic()
+        if now >= deadline:
+            raise PollingTimeoutError(description, timeout_seconds, now - start, attempts, result)
+
+        logging.info(f'Still waiting for {description}. Checking again in {min(interval, deadline - now):.0f} seconds.')
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * backoff_factor, max_interval_seconds)
+
+class DurationHistory():
+    """
+    Durations, in seconds, of things like report generation, keyed by name (e.g., the
+    report's title). If path is given, the history is loaded from and saved to that
+    JSON file, so it builds up across runs.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.durations = {}
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as history_file:
+                self.durations = json.load(history_file)
+
+    def record(self, key, seconds):
+        """
+        Records a duration for key, and saves the history if it has a path.
+        """
+        with self._lock:
+            self.durations[key] = (self.durations.get(key, []) + [round(seconds, 1)])[-DURATION_HISTORY_MAX_SAMPLES:]
+            self._save()
+
+        logging.info(f'{key} took {seconds:.0f} seconds.')
+
+    def typical_seconds(self, key):
+        """
+        Returns the median recorded duration for key, or None if there is none.
+        """
+        durations = self.durations.get(key, [])
+        return statistics.median(durations) if len(durations) > 0 else None
+
+    def suggested_initial_delay(self, key, minimum_seconds=0, fraction=0.75):
+        """
+        Returns how long to wait before the first check for key: a fraction of its typical
+        duration, but at least minimum_seconds.
+        """
+        typical_seconds = self.typical_seconds(key)
+        if typical_seconds is None:
+            return minimum_seconds
+        return max(minimum_seconds, typical_seconds * fraction)
+
+    def summary(self):
+        """
+        summary: -> pandas.DataFrame
+
+        Returns count, min, median, 90th percentile and max duration per key.
+        """
+        rows = []
+        for key, durations in sorted(self.durations.items()):
+            series = pd.Series(durations)
+            rows.append({
+                'key': key,
+                'count': len(series),
+                'min_seconds': series.min(),
+                'median_seconds': series.median(),
+                'p90_seconds': series.quantile(0.9),
+                'max_seconds': series.max(),
+            })
+
+        return pd.DataFrame(rows, columns=['key', 'count', 'min_seconds', 'median_seconds', 'p90_seconds',
+            'max_seconds'])
+
+    def _save(self):
+        if self.path is None:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, so an interrupted save can't corrupt the history
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as history_file:
+            json.dump(self.durations, history_file, indent=2)
+        os.replace(temporary_path, self.path)
@@ -1,8 +1,30 @@
+import io
+import logging
+import os
+import re
+import threading
 import time
 
+import pandas as pd
+import requests
+
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+
 from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+
+from spswarehouse.config import (
+    DEFAULT_ELEMENT_COUNT_STABLE_SECONDS,
+    DEFAULT_SELENIUM_POLL_SECONDS,
+)
+
+# How long each named wait (see timed_wait) has taken, and how long the fixed sleep it
+# replaced was
+_wait_times = {}
+_wait_times_lock = threading.Lock()
 
 
 ### Click Elements
@@ -118,14 +140,12 @@ def get_element_by_class_name(driver, class_name: str, wait_time_in_seconds=30):
 
 def get_multiple_elements_by_class_name(driver, class_name: str, wait_time_in_seconds=30):
     """
-    Waits for an element by class name, then retrieves the full list of elements with that class name.
+    Waits for an element by class name, then retrieves the full list of elements with that class name
+    once the number of them has stopped changing.
     """
-    _wait_for_element_to_be_present_and_return_it(driver, By.CLASS_NAME, class_name, wait_time_in_seconds)
-
-    # Pause to give all elements with that class_name time to load
-    time.sleep(5)
-
-    elements_list = driver.find_elements(By.CLASS_NAME, class_name)
+    with timed_wait('get_multiple_elements_by_class_name', replaced_sleep_seconds=5):
+        elements_list = wait_for_element_count_to_stabilize(driver, By.CLASS_NAME, class_name,
+            wait_time_in_seconds=wait_time_in_seconds)
 
     return elements_list
 
@@ -186,10 +206,222 @@ def wait_for_element_containing_specific_text(driver, expected_element_text, wai
     xpath_text = f"//*[contains(text(), '{expected_element_text}')]"
     elem = _wait_for_element_to_be_present_and_return_it(driver, By.XPATH, xpath_text, wait_time_in_seconds)
     return elem
-    
+
+
+### Wait for Page Conditions
+# These return as soon as the condition holds, instead of sleeping for a fixed time, and
+# raise selenium's TimeoutException if it doesn't hold within wait_time_in_seconds.
+
+def wait_for_page_ready(driver, wait_time_in_seconds=30):
+    """
+    Waits for the current page to finish loading (document.readyState is 'complete').
+    """
+    WebDriverWait(driver, wait_time_in_seconds, poll_frequency=DEFAULT_SELENIUM_POLL_SECONDS).until(
+        lambda d: d.execute_script('return document.readyState') == 'complete')
+
+def wait_for_page_to_reload(driver, old_page_element, wait_time_in_seconds=30):
+    """
+    Waits for a page load started by e.g. a click: old_page_element (found before the
+    click, e.g. the <html> element) goes stale, then the new page finishes loading.
+    """
+    WebDriverWait(driver, wait_time_in_seconds, poll_frequency=DEFAULT_SELENIUM_POLL_SECONDS).until(
+        EC.staleness_of(old_page_element))
+    wait_for_page_ready(driver, wait_time_in_seconds)
+
+def wait_for_element_count_to_stabilize(driver, by_object, target_identifier, min_count=1,
+    stable_seconds=DEFAULT_ELEMENT_COUNT_STABLE_SECONDS, wait_time_in_seconds=30):
+    """
+    Waits until at least min_count elements match and the number of them hasn't changed
+    for stable_seconds (e.g., a list that is still being filled in), and returns them.
+    """
+    last_count = None
+    stable_since = None
+
+    def count_is_stable(d):
+        nonlocal last_count, stable_since
+        elements = d.find_elements(by_object, target_identifier)
+        now = time.monotonic()
+
+        if len(elements) != last_count:
+            last_count = len(elements)
+            stable_since = now
+            return False
+
+        if len(elements) >= min_count and now - stable_since >= stable_seconds:
+            return elements
+        return False
+
+    return WebDriverWait(driver, wait_time_in_seconds, poll_frequency=DEFAULT_SELENIUM_POLL_SECONDS).until(
+        count_is_stable)
+
+def wait_for_element_to_be_visible(driver, by_object, target_identifier, wait_time_in_seconds=30):
+    """
+    Waits for an element to be displayed (e.g., a field that appears after an option is
+    chosen), and returns it.
+    """
+    return WebDriverWait(driver, wait_time_in_seconds, poll_frequency=DEFAULT_SELENIUM_POLL_SECONDS).until(
+        EC.visibility_of_element_located((by_object, target_identifier)))
+
+def wait_for_element_to_disappear(driver, by_object, target_identifier, wait_time_in_seconds=30):
+    """
+    Waits until no matching element is visible, e.g. for a loading spinner or overlay to go away.
+    """
+    WebDriverWait(driver, wait_time_in_seconds, poll_frequency=DEFAULT_SELENIUM_POLL_SECONDS).until(
+        EC.invisibility_of_element_located((by_object, target_identifier)))
+
+def wait_for_element_text_to_change(driver, by_object, target_identifier, previous_text, wait_time_in_seconds=30):
+    """
+    Waits until the element's text is different from previous_text, and returns the new
+    text. The element is looked up again on each check, so it may be replaced in the
+    meantime (e.g., by a page reload).
+    """
+    def text_has_changed(d):
+        try:
+            text = d.find_element(by_object, target_identifier).text
+        except (NoSuchElementException, StaleElementReferenceException):
+            return False
+        return text if text != previous_text else False
+
+    return WebDriverWait(driver, wait_time_in_seconds, poll_frequency=DEFAULT_SELENIUM_POLL_SECONDS).until(
+        text_has_changed)
+
+
+### Wait Timing
+
+@contextmanager
+def timed_wait(wait_name: str, replaced_sleep_seconds=None):
+    """
+    Records how long the code in the with block takes under wait_name, so
+    get_wait_time_summary can show where time is spent waiting on pages and, given the
+    fixed sleep a wait replaced, how much time it saved:
+
+        with timed_wait('school search results', replaced_sleep_seconds=1):
+            wait_for_element_count_to_stabilize(driver, By.XPATH, "//ul[@id='school_choices']/li")
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _wait_times_lock:
+            _wait_times.setdefault(wait_name, {'seconds': [], 'replaced_sleep_seconds': replaced_sleep_seconds})
+            _wait_times[wait_name]['seconds'].append(seconds)
+        logging.debug(f'Waited {seconds:.2f} seconds for {wait_name}.')
+
+def get_wait_time_summary():
+    """
+    get_wait_time_summary: -> pandas.DataFrame
+
+    Returns, per wait name recorded with timed_wait, how many times it ran and the
+    total, mean and max seconds it took. saved_seconds is how much less time that was
+    than the fixed sleeps it replaced would have taken (when that is known).
+    """
+    with _wait_times_lock:
+        wait_times = {wait_name: dict(times) for wait_name, times in _wait_times.items()}
+
+    rows = []
+    for wait_name, times in sorted(wait_times.items()):
+        seconds = pd.Series(times['seconds'])
+        replaced_sleep_seconds = times['replaced_sleep_seconds']
+        rows.append({
+            'wait_name': wait_name,
+            'count': len(seconds),
+            'total_seconds': round(seconds.sum(), 2),
+            'mean_seconds': round(seconds.mean(), 2),
+            'max_seconds': round(seconds.max(), 2),
+            'replaced_sleep_seconds': replaced_sleep_seconds,
+            'saved_seconds': None if replaced_sleep_seconds is None
+                else round(replaced_sleep_seconds * len(seconds) - seconds.sum(), 2),
+        })
+
+    return pd.DataFrame(rows, columns=['wait_name', 'count', 'total_seconds', 'mean_seconds', 'max_seconds',
+        'replaced_sleep_seconds', 'saved_seconds'])
+
+def reset_wait_times():
+    """
+    Clears the times recorded with timed_wait.
+    """
+    with _wait_times_lock:
+        _wait_times.clear()
+
+
+### HTTP Requests With the Browser's Login
+
+def create_requests_session_from_driver(driver):
+    """
+    Returns a requests.Session with the WebDriver's cookies and user agent, so pages and
+    files behind the browser's login can be fetched directly over HTTP, without
+    rendering them or going through the browser's download folder.
+
+    Only the cookies of the site the driver is currently on are copied, so call this
+    after logging in, while on that site.
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = driver.execute_script('return navigator.userAgent')
+
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie['name'],
+            cookie['value'],
+            domain=cookie.get('domain'),
+            path=cookie.get('path', '/'),
+            secure=cookie.get('secure', False),
+        )
+
+    return session
+
+def download_file_with_requests_session(session, url, destination_directory_path=None, file_postfix='',
+    chunk_size=1024*1024, rejected_content_types=None):
+    """
+    Downloads url with a requests.Session (e.g., from create_requests_session_from_driver),
+    streaming the response.
+
+    If destination_directory_path is given, the file is written there, named after the
+    response's Content-Disposition header (or the URL) with file_postfix added before
+    the extension, and the path is returned. Otherwise the content is returned as an
+    io.BytesIO.
+
+    Raises requests.HTTPError if the response has an error status code, and ValueError if
+    its Content-Type is one of rejected_content_types (e.g., ['text/html'] for when an
+    error or login page comes back instead of the file).
+    """
+    with session.get(url, stream=True) as r:
+        r.raise_for_status()
+
+        content_type = r.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if rejected_content_types is not None and content_type in rejected_content_types:
+            raise ValueError(f'{url} returned {content_type} (from {r.url}) instead of a file.')
+
+        if destination_directory_path is None:
+            return io.BytesIO(r.content)
+
+        file_name, file_ext = os.path.splitext(_get_response_file_name(r))
+        file_path = os.path.join(destination_directory_path, file_name + file_postfix + file_ext)
+
+        # Write to a temporary name first, so a partial file is never mistaken for a finished one
+        with open(file_path + '.part', 'wb') as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+        os.replace(file_path + '.part', file_path)
+
+    return file_path
+
 
 ### Internal Functions
 
+def _get_response_file_name(response):
+    content_disposition = response.headers.get('Content-Disposition', '')
+
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", content_disposition, re.IGNORECASE)
+    if match:
+        return os.path.basename(unquote(match.group(1).strip('"')))
+
+    match = re.search(r'filename="?([^";]+)"?', content_disposition, re.IGNORECASE)
+    if match:
+        return os.path.basename(match.group(1))
+
+    return os.path.basename(unquote(urlsplit(response.url).path)) or 'download'
+
 def _wait_for_element_to_be_clickable_and_return_it(driver, by_object, target_identifier, wait_time_in_seconds=30):
     elem = WebDriverWait(driver, wait_time_in_seconds).until(EC.element_to_be_clickable((by_object, target_identifier)))
     return elem
@@ -1,5 +1,10 @@
 import os
+import logging
 import pickle
+import tempfile
+import time
+
+from collections import OrderedDict
 
 try:
     from .credentials import google_config
@@ -11,6 +16,37 @@ from pydrive2.drive import GoogleDrive
 
 from oauth2client.service_account import ServiceAccountCredentials
 
+from .config import (
+    DEFAULT_DRIVE_CONTENT_CACHE_MAX_FILES,
+    DEFAULT_DRIVE_FOLDER_INDEX_TTL_SECONDS,
+    DEFAULT_DRIVE_SPOOL_MAX_MEMORY_BYTES,
+)
+
+GOOGLE_SHEETS_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+
+# Only the metadata needed for lookups is requested when listing files
+DRIVE_LOOKUP_FIELDS = 'items(id,title,mimeType,createdDate),nextPageToken'
+
+# Drive permission roles from least to most access
+PERMISSION_ROLE_RANKS = {
+    'reader': 0,
+    'commenter': 1,
+    'writer': 2,
+    'fileOrganizer': 3,
+    'organizer': 4,
+    'owner': 5,
+}
+
+# Drive accepts up to 100 calls in a single batch request
+DRIVE_MAX_BATCH_SIZE = 100
+
+# Downloaded file contents keyed by (file ID, md5Checksum), oldest first
+_drive_content_cache = OrderedDict()
+
+# Folder lookups keyed by (folder ID, mimeType). Each entry holds when the whole
+# folder was last listed (or None) and {title: (time looked up, [file metadata])}
+_drive_folder_index = {}
+
 def get_google_service_account_email():
     """
     Returns the service account email to share Drive files with.
@@ -63,6 +99,306 @@ def create_client(gauth):
     """
     return GoogleDrive(gauth)
 
+def get_drive_file_content(file_id, use_cache=True):
+    """
+    get_drive_file_content: Drive file ID -> file-like object
+
+    Streams a Drive file's content into a spooled buffer and returns it, positioned
+    at the start. Content stays in memory up to DEFAULT_DRIVE_SPOOL_MAX_MEMORY_BYTES
+    and spills to an anonymous temporary file after that, so nothing is written to
+    the current working directory.
+
+    Content is cached by file ID and md5Checksum, so reading an unchanged file again
+    only costs one metadata request. Files without an md5Checksum (e.g., Google Docs
+    formats) are never cached. Callers should not close the returned buffer.
+    """
+    drive_file = GoogleDrive.CreateFile({'id': file_id})
+    drive_file.FetchMetadata(fields='md5Checksum')
+    md5_checksum = drive_file.get('md5Checksum')
+
+    cache_key = (file_id, md5_checksum)
+    if use_cache and md5_checksum is not None and cache_key in _drive_content_cache:
+        buffer = _drive_content_cache[cache_key]
+        if not buffer.closed:
+            _drive_content_cache.move_to_end(cache_key)
+            buffer.seek(0)
+            return buffer
+        del _drive_content_cache[cache_key]
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=DEFAULT_DRIVE_SPOOL_MAX_MEMORY_BYTES)
+    for chunk in drive_file.GetContentIOBuffer():
+        buffer.write(chunk)
+    buffer.seek(0)
+
+    if use_cache and md5_checksum is not None:
+        # Drop cached copies of older versions of this file, then the oldest files
+        for stale_key in [key for key in _drive_content_cache if key[0] == file_id]:
+            _drive_content_cache.pop(stale_key).close()
+        _drive_content_cache[cache_key] = buffer
+        while len(_drive_content_cache) > DEFAULT_DRIVE_CONTENT_CACHE_MAX_FILES:
+            _, evicted_buffer = _drive_content_cache.popitem(last=False)
+            evicted_buffer.close()
+
+    return buffer
+
+def clear_drive_content_cache():
+    """
+    Empties the Drive content cache used by get_drive_file_content.
+    """
+    while len(_drive_content_cache) > 0:
+        _, buffer = _drive_content_cache.popitem()
+        buffer.close()
+
+def get_drive_file_version(file_id, google_drive=None):
+    """
+    get_drive_file_version: Drive file ID -> int
+
+    Returns the file's Drive version number, which increases on every change to the
+    file (including edits made in Google Sheets). Fetches only the version field.
+    """
+    if google_drive is None:
+        google_drive = GoogleDrive
+
+    drive_file = google_drive.CreateFile({'id': file_id})
+    drive_file.FetchMetadata(fields='version')
+
+    return int(drive_file['version'])
+
+def get_drive_file_last_change(file_id, google_drive=None):
+    """
+    get_drive_file_last_change: Drive file ID -> dict
+
+    Returns the file's Drive 'version', when it was last changed ('modifiedDate', Drive's
+    clock) and whether that change was made by the account this code is authenticated as
+    ('changed_by_me', e.g. the service account).
+    """
+    if google_drive is None:
+        google_drive = GoogleDrive
+
+    drive_file = google_drive.CreateFile({'id': file_id})
+    drive_file.FetchMetadata(fields='version,modifiedDate,lastModifyingUser(isAuthenticatedUser)')
+
+    return {
+        'version': int(drive_file['version']),
+        'modifiedDate': drive_file['modifiedDate'],
+        'changed_by_me': drive_file.get('lastModifyingUser', {}).get('isAuthenticatedUser', False) == True,
+    }
+
+def were_all_drive_file_changes_since_made_by_me(file_id, since_modified_date, google_drive=None):
+    """
+    were_all_drive_file_changes_since_made_by_me: Drive file ID, Drive modifiedDate -> bool
+
+    Returns whether every revision of the file saved after since_modified_date (e.g.,
+    the 'modifiedDate' from get_drive_file_last_change) was made by the account this code
+    is authenticated as, i.e., nobody else has changed the file since. Raises if the
+    revisions can't be listed.
+    """
+    if google_drive is None:
+        google_drive = GoogleDrive
+
+    service = google_drive.auth.service
+    http = google_drive.auth.http
+
+    page_token = None
+    while True:
+        response = service.revisions().list(
+            fileId=file_id,
+            fields='items(modifiedDate,lastModifyingUser(isAuthenticatedUser)),nextPageToken',
+            pageToken=page_token,
+        ).execute(http=http)
+
+        for revision in response.get('items', []):
+            # Drive dates are ISO 8601 in UTC, so they compare correctly as text
+            if revision['modifiedDate'] > since_modified_date \
+                and revision.get('lastModifyingUser', {}).get('isAuthenticatedUser', False) != True:
+                return False
+
+        page_token = response.get('nextPageToken')
+        if page_token is None:
+            return True
+
+def find_file_in_folder(folder_id, title, mime_type=None, google_drive=None,
+    ttl_seconds=DEFAULT_DRIVE_FOLDER_INDEX_TTL_SECONDS):
+    """
+    find_file_in_folder: folder ID, title -> file metadata dict or None
+
+    Looks up a non-trashed file by exact title (and optionally mimeType) in a Drive
+    folder. The title and mimeType filters are part of the Drive query, so only
+    matching files are returned instead of the whole folder.
+
+    Results are kept in a local index for ttl_seconds. Lookups in that window, and
+    lookups in a folder listed with index_drive_folder, don't call Drive at all.
+
+    If several files have the same title, the oldest one (by createdDate, then ID)
+    is returned, so the same file is chosen every time.
+
+    The returned dict contains 'id', 'title', 'mimeType' and 'createdDate'.
+    """
+    folder_index = _drive_folder_index.setdefault((folder_id, mime_type), {'listed_at': None, 'titles': {}})
+    now = time.monotonic()
+
+    cached_lookup = folder_index['titles'].get(title)
+    if cached_lookup is not None and now - cached_lookup[0] < ttl_seconds:
+        matching_files = cached_lookup[1]
+    elif folder_index['listed_at'] is not None and now - folder_index['listed_at'] < ttl_seconds:
+        # A complete, fresh listing of the folder didn't have this title
+        matching_files = []
+    else:
+        query = _build_folder_query(folder_id, mime_type) + " and title = '{}'".format(_escape_query_value(title))
+        matching_files = _list_drive_files(query, google_drive)
+        folder_index['titles'][title] = (now, matching_files)
+
+    if len(matching_files) == 0:
+        return None
+
+    matching_files = sorted(matching_files, key=lambda file: (file.get('createdDate', ''), file['id']))
+    if len(matching_files) > 1:
+        logging.warning(f'Found {len(matching_files)} files titled "{title}" in folder {folder_id}. '
+            f'Using the oldest one ({matching_files[0]["id"]}).')
+
+    return matching_files[0]
+
+def index_drive_folder(folder_id, mime_type=None, google_drive=None):
+    """
+    index_drive_folder: folder ID -> {title: [file metadata]}
+
+    Lists the non-trashed files in a folder (optionally only one mimeType) with a
+    single filtered query and stores them in the lookup index. Call this before many
+    find_file_in_folder lookups in the same folder. Returns the files grouped by title.
+    """
+    files_by_title = {}
+    for file in _list_drive_files(_build_folder_query(folder_id, mime_type), google_drive):
+        files_by_title.setdefault(file['title'], []).append(file)
+
+    now = time.monotonic()
+    _drive_folder_index[(folder_id, mime_type)] = {
+        'listed_at': now,
+        'titles': {title: (now, files) for title, files in files_by_title.items()},
+    }
+
+    return files_by_title
+
+def add_file_to_folder_index(folder_id, title, file_id, mime_type=None):
+    """
+    Records a newly created file in the lookup index, so a find_file_in_folder call
+    right after creating it doesn't miss it while the index is still fresh.
+    """
+    folder_index = _drive_folder_index.setdefault((folder_id, mime_type), {'listed_at': None, 'titles': {}})
+    cached_lookup = folder_index['titles'].get(title)
+    existing_files = [] if cached_lookup is None else cached_lookup[1]
+
+    new_file = {'id': file_id, 'title': title, 'mimeType': mime_type,
+        # Sorts after files that already existed, so lookups stay deterministic
+        'createdDate': '9999-12-31T23:59:59.999Z'}
+    folder_index['titles'][title] = (time.monotonic(), existing_files + [new_file])
+
+def clear_drive_folder_index():
+    """
+    Empties the folder lookup index used by find_file_in_folder.
+    """
+    _drive_folder_index.clear()
+
+def sync_file_permissions(file_id, email_addresses, role='writer', perm_type='user',
+    google_drive=None):
+    """
+    sync_file_permissions: file ID, [email address] -> [email address]
+
+    Makes sure every email address has at least `role` access to a Drive file,
+    without emailing anyone. Fetches the current permissions once, and grants only
+    the missing ones through batched Drive requests. If everyone already has access,
+    this makes a single API call.
+
+    Never removes or downgrades access. Returns the email addresses that were granted
+    access, and raises an Exception listing any grants that failed.
+    """
+    if google_drive is None:
+        google_drive = GoogleDrive
+
+    service = google_drive.auth.service
+    http = google_drive.auth.http
+
+    existing_permissions = []
+    page_token = None
+    while True:
+        response = service.permissions().list(
+            fileId=file_id,
+            fields='items(emailAddress,role),nextPageToken',
+            supportsAllDrives=True,
+            pageToken=page_token,
+        ).execute(http=http)
+        existing_permissions.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if page_token is None:
+            break
+
+    required_rank = PERMISSION_ROLE_RANKS[role]
+    emails_with_access = {
+        permission['emailAddress'].lower()
+        for permission in existing_permissions
+        if 'emailAddress' in permission
+            and PERMISSION_ROLE_RANKS.get(permission.get('role'), -1) >= required_rank
+    }
+
+    missing_emails = []
+    for email_address in email_addresses:
+        if email_address.lower() not in emails_with_access and email_address not in missing_emails:
+            missing_emails.append(email_address)
+
+    if len(missing_emails) == 0:
+        logging.info(f'All {len(email_addresses)} requested users already have access.')
+        return []
+
+    failed_grants = {}
+
+    def record_failure(request_id, response, exception):
+        if exception is not None:
+            failed_grants[request_id] = exception
+
+    for batch_start in range(0, len(missing_emails), DRIVE_MAX_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=record_failure)
+        for email_address in missing_emails[batch_start:batch_start + DRIVE_MAX_BATCH_SIZE]:
+            batch.add(
+                service.permissions().insert(
+                    fileId=file_id,
+                    body={'type': perm_type, 'role': role, 'value': email_address},
+                    sendNotificationEmails=False,
+                    supportsAllDrives=True,
+                ),
+                request_id=email_address,
+            )
+        batch.execute(http=http)
+
+    if len(failed_grants) > 0:
+        raise Exception(f'Unable to share file {file_id} with: {failed_grants}')
+
+    logging.info(f'Granted {role} access to {len(missing_emails)} users: {missing_emails}')
+    return missing_emails
+
+def _build_folder_query(folder_id, mime_type):
+    query = "'{}' in parents and trashed = false".format(_escape_query_value(folder_id))
+    if mime_type is not None:
+        query += " and mimeType = '{}'".format(_escape_query_value(mime_type))
+    return query
+
+def _escape_query_value(value):
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+def _list_drive_files(query, google_drive=None):
+    if google_drive is None:
+        google_drive = GoogleDrive
+
+    drive_files = google_drive.ListFile({'q': query, 'fields': DRIVE_LOOKUP_FIELDS}).GetList()
+
+    return [
+        {
+            'id': drive_file['id'],
+            'title': drive_file['title'],
+            'mimeType': drive_file.get('mimeType'),
+            'createdDate': drive_file.get('createdDate', ''),
+        }
+        for drive_file in drive_files
+    ]
+
 # Set up credentials
 gauth = initialize_auth()
 
@@ -1,5 +1,7 @@
 import gspread
+import numpy as np
 import os
+import pandas as pd
 import pickle
 
 try:
@@ -7,8 +9,19 @@ try:
 except ModuleNotFoundError:
     print("No credentials file found in spswarehouse. This could cause issues.")
 
+from gspread.utils import absolute_range_name, rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 
+from .config import (
+    DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST,
+    DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST,
+    DEFAULT_SHEETS_MAX_CELLS_PER_READ,
+    DEFAULT_SHEETS_READ_CHUNK_ROWS,
+)
+
+# Approximate JSON overhead per cell (quotes and separator) when sizing requests
+JSON_BYTES_PER_CELL = 4
+
 def get_google_service_account_email():
     """
     Returns the service account email to share spreadsheets with.
@@ -57,6 +70,318 @@ def create_client(credentials):
     client = gspread.authorize(credentials)
     return client
 
+def write_dataframe_to_worksheet(
+    worksheet,
+    dataframe_or_chunks,
+    start_row=1,
+    start_col=1,
+    total_rows=None,
+    value_input_option='USER_ENTERED',
+    max_bytes_per_request=DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST,
+    max_cells_per_request=DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST,
+):
+    """
+    write_dataframe_to_worksheet: gspread.Worksheet, pandas.DataFrame -> int
+    write_dataframe_to_worksheet: gspread.Worksheet, iterable of pandas.DataFrame -> int
+
+    Writes the values of a DataFrame (without its header) into the worksheet with the
+    top-left cell at (start_row, start_col), and returns the number of rows written.
+
+    Instead of one huge worksheet.update() call, the values are serialized column by
+    column and written in several values.batchUpdate requests, each one bounded by
+    max_bytes_per_request and max_cells_per_request.
+
+    dataframe_or_chunks can also be a generator of DataFrames with the same columns
+    (e.g., a chunked warehouse read), which are written one after the other. The grid
+    is resized once up front when the total number of rows is known (always for a
+    single DataFrame; pass total_rows for a generator, e.g., an estimate). Whenever a
+    chunk doesn't fit, e.g., there was no total or more rows came than it said, the
+    grid grows by doubling. The worksheet is never shrunk.
+    """
+    if isinstance(dataframe_or_chunks, pd.DataFrame):
+        total_rows = len(dataframe_or_chunks)
+        dataframe_or_chunks = [dataframe_or_chunks]
+
+    next_row = start_row
+    grid_checked = False
+
+    for dataframe in dataframe_or_chunks:
+        if dataframe.shape[0] == 0:
+            continue
+
+        values, row_bytes = _serialize_dataframe_for_sheets(dataframe)
+        num_rows, num_cols = values.shape
+        final_col = start_col + num_cols - 1
+
+        if total_rows is not None and not grid_checked:
+            _grow_worksheet_grid(
+                worksheet,
+                max(start_row + total_rows - 1, next_row + num_rows - 1),
+                final_col,
+            )
+            grid_checked = True
+        elif next_row + num_rows - 1 > worksheet.row_count:
+            _grow_worksheet_grid(
+                worksheet,
+                max(next_row + num_rows - 1, 2 * worksheet.row_count),
+                final_col,
+            )
+        else:
+            _grow_worksheet_grid(worksheet, worksheet.row_count, final_col)
+
+        for chunk_start, chunk_stop, _ in _plan_row_chunks(row_bytes, num_cols,
+            max_bytes_per_request, max_cells_per_request):
+            first_row = next_row + chunk_start
+            last_row = next_row + chunk_stop - 1
+            cell_range = '{}:{}'.format(
+                rowcol_to_a1(first_row, start_col),
+                rowcol_to_a1(last_row, final_col),
+            )
+            worksheet.spreadsheet.values_batch_update({
+                'valueInputOption': value_input_option,
+                'data': [{
+                    'range': absolute_range_name(worksheet.title, cell_range),
+                    'values': values[chunk_start:chunk_stop].tolist(),
+                }],
+            })
+
+        next_row += num_rows
+
+    return next_row - start_row
+
+def plan_dataframe_write(
+    dataframe,
+    worksheet_row_count,
+    worksheet_col_count,
+    start_row=1,
+    start_col=1,
+    max_bytes_per_request=DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST,
+    max_cells_per_request=DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST,
+):
+    """
+    plan_dataframe_write: pandas.DataFrame, worksheet size -> dict
+
+    Works out what write_dataframe_to_worksheet would send to write a single DataFrame
+    to a worksheet of worksheet_row_count rows and worksheet_col_count columns, without
+    sending anything. Returns a dict with:
+    - chunks: the [start, stop) row ranges written in each values request
+    - payload_bytes: the approximate JSON size of the values
+    - write_requests: the values requests, plus one if the grid has to grow
+    """
+    num_rows, num_cols = dataframe.shape
+    if num_rows == 0:
+        return {'chunks': [], 'payload_bytes': 0, 'write_requests': 0}
+
+    _, row_bytes = _serialize_dataframe_for_sheets(dataframe)
+    chunks = [(chunk_start, chunk_stop) for chunk_start, chunk_stop, _ in _plan_row_chunks(row_bytes, num_cols,
+        max_bytes_per_request, max_cells_per_request)]
+    grid_grows = (start_row + num_rows - 1 > worksheet_row_count or start_col + num_cols - 1 > worksheet_col_count)
+
+    return {
+        'chunks': chunks,
+        'payload_bytes': int(row_bytes.sum()),
+        'write_requests': len(chunks) + (1 if grid_grows else 0),
+    }
+
+def _serialize_dataframe_for_sheets(dataframe):
+    """
+    _serialize_dataframe_for_sheets: pandas.DataFrame -> (numpy.ndarray, numpy.ndarray)
+
+    Converts a DataFrame into a 2D object array of JSON-safe values, one column at a
+    time, along with the approximate JSON size of each row in bytes.
+
+    Missing values become empty strings, datetimes become 'YYYY-MM-DD HH:MM:SS'
+    strings, and numpy numbers become native Python numbers. Only object columns
+    holding something other than strings fall back to converting value by value.
+    """
+    num_rows, num_cols = dataframe.shape
+    values = np.empty((num_rows, num_cols), dtype=object)
+    row_bytes = np.full(num_rows, JSON_BYTES_PER_CELL * num_cols, dtype=np.int64)
+
+    for col_index in range(num_cols):
+        column = dataframe.iloc[:, col_index]
+        missing = column.isna().to_numpy()
+
+        if pd.api.types.is_datetime64_any_dtype(column):
+            converted = column.dt.strftime('%Y-%m-%d %H:%M:%S')
+        elif pd.api.types.is_bool_dtype(column) or pd.api.types.is_numeric_dtype(column):
+            converted = column.astype(object)
+        elif pd.api.types.infer_dtype(column, skipna=True) in ('string', 'empty'):
+            converted = column
+        else:
+            converted = column.map(_to_json_safe_value, na_action='ignore')
+
+        converted = converted.where(~missing, '')
+        values[:, col_index] = converted.to_numpy(dtype=object)
+        row_bytes += converted.astype(str).str.len().to_numpy(dtype=np.int64)
+
+    return values, row_bytes
+
+def _to_json_safe_value(value):
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    # Decimals, dates, and anything else are written the way they print
+    return str(value)
+
+def _plan_row_chunks(row_bytes, num_cols, max_bytes_per_request, max_cells_per_request):
+    """
+    _plan_row_chunks: row sizes, column count, limits -> [(start, stop, bytes)]
+
+    Splits rows into consecutive [start, stop) chunks so that each chunk stays under
+    both request limits. A single row larger than max_bytes_per_request still gets a
+    chunk of its own.
+    """
+    num_rows = len(row_bytes)
+    max_rows_per_chunk = max(1, max_cells_per_request // max(num_cols, 1))
+    cumulative_bytes = np.cumsum(row_bytes)
+
+    chunks = []
+    start = 0
+    while start < num_rows:
+        bytes_before_start = cumulative_bytes[start - 1] if start > 0 else 0
+        stop_by_bytes = int(np.searchsorted(cumulative_bytes,
+            bytes_before_start + max_bytes_per_request, side='right'))
+        stop = min(num_rows, start + max_rows_per_chunk, max(stop_by_bytes, start + 1))
+        chunks.append((start, stop, int(cumulative_bytes[stop - 1] - bytes_before_start)))
+        start = stop
+
+    return chunks
+
+def _grow_worksheet_grid(worksheet, min_rows, min_cols):
+    """
+    Resizes the worksheet in a single request if it has fewer than min_rows rows or
+    min_cols columns. Never shrinks the worksheet.
+    """
+    new_rows = max(worksheet.row_count, min_rows)
+    new_cols = max(worksheet.col_count, min_cols)
+    if new_rows != worksheet.row_count or new_cols != worksheet.col_count:
+        worksheet.resize(rows=new_rows, cols=new_cols)
+
+def get_worksheets_as_dataframes(
+    worksheets,
+    header_row=1,
+    force_string=False,
+    chunk_size_rows=DEFAULT_SHEETS_READ_CHUNK_ROWS,
+    max_cells_per_request=DEFAULT_SHEETS_MAX_CELLS_PER_READ,
+):
+    """
+    get_worksheets_as_dataframes: [gspread.Worksheet] -> {worksheet title: pandas.DataFrame}
+
+    Reads one or more worksheets from the same spreadsheet into DataFrames using the
+    Sheets values API. This is much faster than get_all_records() for big sheets.
+
+    - All worksheets are fetched together through values.batchGet. Each worksheet is
+      split into row ranges of chunk_size_rows, and a batchGet call is capped at about
+      max_cells_per_request cells.
+    - Values are fetched unformatted, so numbers and booleans come back typed instead
+      of as display strings. Dates are still returned as their formatted strings.
+    - DataFrames are built straight from the row lists (no per-row dicts), and column
+      types are inferred column by column. Blank cells become missing values.
+
+    If force_string is True, formatted values are fetched instead and every column is
+    a string column with blanks as '', matching get_all_values().
+
+    header_row is the 1-based row holding the column names; data starts on the row
+    after it.
+    """
+    if len(worksheets) == 0:
+        return {}
+
+    spreadsheet = worksheets[0].spreadsheet
+
+    # Plan every (worksheet, row range) to read
+    planned_ranges = []
+    for worksheet in worksheets:
+        for first_row in range(1, worksheet.row_count + 1, chunk_size_rows):
+            last_row = min(first_row + chunk_size_rows - 1, worksheet.row_count)
+            planned_ranges.append((
+                worksheet.title,
+                absolute_range_name(worksheet.title, f'{first_row}:{last_row}'),
+                (last_row - first_row + 1) * worksheet.col_count,
+            ))
+
+    params = {
+        'valueRenderOption': 'FORMATTED_VALUE' if force_string else 'UNFORMATTED_VALUE',
+        'dateTimeRenderOption': 'FORMATTED_STRING',
+        'majorDimension': 'ROWS',
+    }
+
+    rows_by_title = {worksheet.title: [] for worksheet in worksheets}
+    for request_ranges in _group_ranges_by_cell_count(planned_ranges, max_cells_per_request):
+        response = spreadsheet.values_batch_get(
+            [range_name for _, range_name, _ in request_ranges],
+            params=params,
+        )
+        for (title, _, _), value_range in zip(request_ranges, response.get('valueRanges', [])):
+            chunk_rows = value_range.get('values', [])
+            if len(chunk_rows) > 0:
+                # Pad the previous chunk back out if the API trimmed its trailing blank rows
+                expected_rows = _first_row_of_range(value_range['range']) - 1
+                rows = rows_by_title[title]
+                rows.extend([[]] * (expected_rows - len(rows)))
+                rows.extend(chunk_rows)
+
+    return {
+        title: _rows_to_dataframe(rows, header_row, force_string)
+        for title, rows in rows_by_title.items()
+    }
+
+def _group_ranges_by_cell_count(planned_ranges, max_cells_per_request):
+    """
+    Splits (title, range name, cell count) tuples into groups whose total cell count
+    stays under max_cells_per_request. A single oversized range gets its own group.
+    """
+    groups = []
+    current_group = []
+    current_cells = 0
+    for planned_range in planned_ranges:
+        num_cells = planned_range[2]
+        if len(current_group) > 0 and current_cells + num_cells > max_cells_per_request:
+            groups.append(current_group)
+            current_group = []
+            current_cells = 0
+        current_group.append(planned_range)
+        current_cells += num_cells
+
+    if len(current_group) > 0:
+        groups.append(current_group)
+
+    return groups
+
+def _first_row_of_range(range_name):
+    """
+    Returns the 1-based first row of a range like "'Sheet 1'!A20001:Z30000".
+    """
+    cells = range_name.rsplit('!', 1)[-1]
+    first_cell = cells.split(':')[0]
+    return int(''.join(char for char in first_cell if char.isdigit()) or 1)
+
+def _rows_to_dataframe(rows, header_row, force_string):
+    """
+    Turns a list of value rows (as returned by the values API, where trailing blank
+    cells are omitted) into a DataFrame using the given 1-based header row.
+    """
+    if len(rows) < header_row:
+        return pd.DataFrame()
+
+    header = [str(name) for name in rows[header_row - 1]]
+    data_rows = rows[header_row:]
+
+    # DataFrame construction pads ragged rows with None in one pass
+    df = pd.DataFrame(data_rows, dtype=object)
+    df = df.reindex(columns=range(len(header)))
+    df.columns = header
+
+    if force_string:
+        return df.fillna('').astype(str)
+
+    df = df.where(df != '', np.nan)
+    return df.infer_objects()
+
 # Set up credentials
 credentials = initialize_credentials()
 
@@ -1,9 +1,38 @@
 import pandas as pd
 import logging
 
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, absolute_range_name
+
 from .warehouse import create_warehouse
-from .googlesheets import create_sheets
-from .googledrive import create_drive
+from .config import (
+    DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST,
+    DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST,
+    DEFAULT_SHEETS_REQUESTS_PER_MINUTE,
+)
+from .googlesheets import (
+    create_sheets,
+    plan_dataframe_write,
+    write_dataframe_to_worksheet,
+)
+from .magic_spreadsheet_matching import reconcile_manual_values
+from .magic_spreadsheet_snapshot import (
+    get_current_snapshot_worksheet_names,
+    manual_values_snapshots_available,
+    read_manual_values_snapshot,
+    record_manual_values_snapshot_version,
+    write_manual_values_snapshot,
+)
+from .googledrive import (
+    create_drive,
+    add_file_to_folder_index,
+    find_file_in_folder,
+    get_drive_file_last_change,
+    get_drive_file_version,
+    sync_file_permissions,
+    were_all_drive_file_changes_since_made_by_me,
+    GOOGLE_SHEETS_MIME_TYPE,
+)
 
 from gspread_formatting import (
     set_data_validation_for_cell_range,
@@ -35,9 +64,13 @@ Typical sequence of calls:
     * Create or fetch the spreadsheets: `spreadsheet_object, spreadsheet_already_exists = create_or_retrieve_magic_spreadsheet_and_add_missing_worksheets(...)`
     * Add the static worksheets: `check_for_static_worksheets_and_add_them_with_protection(...)`
     * Update the spreadsheet with query results: `update_magic_spreadsheet_with_new_query_results(...)`
+      (pass `dry_run=True`, or call `plan_magic_spreadsheet_refresh(...)`, to see what it would cost first)
     * If desired, update specific cells (like the "Last Updated" field): `update_specific_cell(...)`
 """
 
+# Fields mask for the one metadata fetch used to reconcile worksheets, protections and order
+WORKSHEET_STRUCTURE_FIELDS = 'sheets(properties(sheetId,title,index,gridProperties(columnCount)),protectedRanges(description))'
+
 def _run_warehouse_query_for_worksheet(query_list: list):
     """
     Take a list of queries stored as dictionaries. Run each query at the provided
@@ -76,12 +109,37 @@ def _run_warehouse_query_for_worksheet(query_list: list):
 
     return df_combined_query_output
 
-def _add_formulas_to_worksheet(worksheet_object, formulas_list):
+def _sheets_requests_step(description, run, read_requests: int = 0, write_requests: int = 0):
     """
-    Given a list of formulas in the format below, add the formula to the specified row of the
-    column, then copy it down the entire column.
+    One step of refreshing a worksheet: run() makes read_requests and write_requests Sheets API
+    requests, and description (if not None) is logged before it runs. Refreshes run the steps and
+    plan_magic_spreadsheet_refresh adds them up, so the plan counts exactly what a refresh sends.
     """
-    
+    return {
+        'description': description,
+        'run': run,
+        'read_requests': read_requests,
+        'write_requests': write_requests,
+    }
+
+def _run_steps(steps):
+    for step in steps:
+        if step['description'] is not None:
+            logging.info(step['description'])
+        step['run']()
+
+def _count_sheets_requests(sheets_requests, read_requests: int = 0, write_requests: int = 0):
+    # Adds requests that were just made to sheets_requests ({'read_requests', 'write_requests'}), if one is kept
+    if sheets_requests is not None:
+        sheets_requests['read_requests'] += read_requests
+        sheets_requests['write_requests'] += write_requests
+
+def _build_formula_steps(worksheet_object, formulas_list):
+    """
+    Given a list of formulas in the format below, returns the steps (see _sheets_requests_step)
+    that add the formula to the specified row of the column, then copy it down the entire column.
+    """
+    steps = []
     for formula in formulas_list:
         formula_column = formula['column']
         formula_row_start = formula['row_of_first_formula_cell']
@@ -89,17 +147,22 @@ def _add_formulas_to_worksheet(worksheet_object, formulas_list):
         
         # First, add the formula to the specified row of the given column
         source_cell = f'{formula_column}{formula_row_start}'
-        worksheet_object.update(source_cell, formula_text, value_input_option='USER_ENTERED')
+        steps.append(_sheets_requests_step(None, write_requests=1,
+            run=lambda source_cell=source_cell, formula_text=formula_text: worksheet_object.update(
+                source_cell, formula_text, value_input_option='USER_ENTERED')))
         
         # Then, copy that formula down the whole column
         destination_range = f'{formula_column}{formula_row_start}:{formula_column}'
-        
-        worksheet_object.copy_range(source_cell, destination_range, paste_type='PASTE_FORMULA')
+        steps.append(_sheets_requests_step(None, write_requests=1,
+            run=lambda source_cell=source_cell, destination_range=destination_range: worksheet_object.copy_range(
+                source_cell, destination_range, paste_type='PASTE_FORMULA')))
+
+    return steps
 
-def _add_data_validations_to_worksheet(worksheet_object, data_validations_list):
+def _build_data_validation_steps(worksheet_object, data_validations_list):
     """
-    Given a list of data validations in the format below, clears any existing rules in
-    the provided range and adds each rule from the list to the worksheet object. This
+    Given a list of data validations in the format below, returns the steps that clear any
+    existing rules in the provided range and add each rule from the list to the worksheet object. This
     function assumes one validation rule for any given range; otherwise, later rules 
     in the list would overwrite earlier ones.
     
@@ -114,20 +177,29 @@ def _add_data_validations_to_worksheet(worksheet_object, data_validations_list):
             },
         ]
     """
+    steps = []
     for data_validation in data_validations_list:
         validation_range = data_validation['range']
         validation_rule = data_validation['validation_rule']
         
         # Clear any existing validation rules in the range
-        set_data_validation_for_cell_range(worksheet_object, validation_range, None)
+        steps.append(_sheets_requests_step(None, write_requests=1,
+            run=lambda validation_range=validation_range: set_data_validation_for_cell_range(
+                worksheet_object, validation_range, None)))
     
         # Add validation rule from list to the range
-        set_data_validation_for_cell_range(worksheet_object, validation_range, validation_rule)
+        steps.append(_sheets_requests_step(None, write_requests=1,
+            run=lambda validation_range=validation_range, validation_rule=validation_rule: set_data_validation_for_cell_range(
+                worksheet_object, validation_range, validation_rule)))
 
-def _hide_header_rows_and_left_columns_in_worksheet(worksheet_object, num_header_rows_to_hide, num_left_columns_to_hide):
+    return steps
 
-    worksheet_object.hide_rows(0, num_header_rows_to_hide)
-    worksheet_object.hide_columns(0, num_left_columns_to_hide)
+def _build_hide_header_rows_and_left_columns_steps(worksheet_object, num_header_rows_to_hide, num_left_columns_to_hide):
+
+    return [
+        _sheets_requests_step(None, write_requests=1, run=lambda: worksheet_object.hide_rows(0, num_header_rows_to_hide)),
+        _sheets_requests_step(None, write_requests=1, run=lambda: worksheet_object.hide_columns(0, num_left_columns_to_hide)),
+    ]
 
 def _set_basic_filter_on_worksheet(worksheet_object, row_number_for_filter, final_row_number):
     num_columns = worksheet_object.col_count
@@ -176,9 +248,26 @@ def _refresh_conditional_formatting_on_worksheet(worksheet_object, num_header_ro
     # logging.info("Conditional formatting updated.")
 
 def create_or_retrieve_magic_spreadsheet_and_add_missing_worksheets(drive_folder_id: str,
-    spreadsheet_name: str, template_spreadsheet_id: str, worksheet_name_list):
+    spreadsheet_name: str, template_spreadsheet_id: str, worksheet_name_list, copy_template_file: bool = True,
+    template_worksheets_cache: dict = None):
+    """
+    Returns the spreadsheet named spreadsheet_name in the Drive folder, creating it from the template
+    if it doesn't exist, and copying any worksheets in worksheet_name_list it's missing from the template.
+
+    New spreadsheets are made by copying the whole template file and deleting the worksheets that aren't
+    in worksheet_name_list. Set copy_template_file to False to instead create an empty spreadsheet and
+    copy the worksheets into it one at a time (formulas that refer to other worksheets may break that way).
+
+    To fetch the template only once for a run that makes many spreadsheets (e.g., one per school),
+    pass the same template_worksheets_cache (an empty dict at the start of the run) to every call, and
+    to check_for_static_worksheets_and_add_them_with_protection. Otherwise each call fetches it again.
+
+    Returns (spreadsheet_object, spreadsheet_already_exists).
+    """
 
     gs = create_sheets()
+    if template_worksheets_cache is None:
+        template_worksheets_cache = {}
 
     spreadsheet_already_exists, spreadsheet_object = _check_if_spreadsheet_exists_and_retrieve_it(
         drive_folder_id=drive_folder_id,
@@ -193,12 +282,15 @@ def create_or_retrieve_magic_spreadsheet_and_add_missing_worksheets(drive_folder
             template_spreadsheet_id = template_spreadsheet_id, 
             worksheet_name_list = worksheet_name_list,
             gs = gs,
+            copy_template_file = copy_template_file,
+            template_worksheets_cache = template_worksheets_cache,
             )
-    else:
-        template_spreadsheet_object = gs.open_by_key(template_spreadsheet_id)
 
+        add_file_to_folder_index(drive_folder_id, spreadsheet_name, spreadsheet_object.id,
+            mime_type=GOOGLE_SHEETS_MIME_TYPE)
+    else:
         _check_for_missing_worksheets_and_create_them(target_spreadsheet_object = spreadsheet_object, 
-            template_spreadsheet_object = template_spreadsheet_object, 
+            template_worksheets = _get_template_worksheets(template_spreadsheet_id, gs, template_worksheets_cache), 
             worksheet_name_list = worksheet_name_list)
         
     return spreadsheet_object, spreadsheet_already_exists
@@ -207,69 +299,115 @@ def _check_if_spreadsheet_exists_and_retrieve_it(drive_folder_id: str, spreadshe
     
     google_drive = create_drive()
 
-    folder_files = google_drive.ListFile({'q': f"'{drive_folder_id}' in parents"}).GetList()
+    # The title and mimeType filters run in the Drive query, and recent lookups are
+    # answered from a local index, so this doesn't list the whole folder
+    spreadsheet_file = find_file_in_folder(
+        folder_id=drive_folder_id,
+        title=spreadsheet_name,
+        mime_type=GOOGLE_SHEETS_MIME_TYPE,
+        google_drive=google_drive,
+    )
 
-    spreadsheet_already_exists = False
+    if spreadsheet_file is None:
+        return False, None
+    else:
+        return True, gs.open_by_key(spreadsheet_file['id'])
 
-    # Get spreadsheet if it exists
-    for file in folder_files:
-        if file['title'] == spreadsheet_name:
-            spreadsheet_already_exists = True
-            current_spreadsheet = gs.open_by_key(file['id'])
+def _get_template_worksheets(template_spreadsheet_id: str, gs, template_worksheets_cache: dict):
+    """
+    Returns {worksheet title: worksheet object} for the template spreadsheet. The template is
+    only fetched if it isn't in template_worksheets_cache (a dict of them by template spreadsheet
+    ID that lasts one run), and is added to it.
+    """
+    if template_spreadsheet_id not in template_worksheets_cache:
+        template_spreadsheet_object = gs.open_by_key(template_spreadsheet_id)
+        template_worksheets_cache[template_spreadsheet_id] = {
+            worksheet.title: worksheet for worksheet in template_spreadsheet_object.worksheets()
+        }
 
-    if spreadsheet_already_exists == True:
-        return spreadsheet_already_exists, current_spreadsheet
-    else:
-        return spreadsheet_already_exists, None
+    return template_worksheets_cache[template_spreadsheet_id]
 
-def _create_worksheet_from_template_if_does_not_exist(target_spreadsheet_object, template_spreadsheet_object, worksheet_name):
+def _check_that_template_has_worksheets(template_worksheets: dict, worksheet_name_list):
+    for worksheet_name in worksheet_name_list:
+        if worksheet_name not in template_worksheets:
+            raise WorksheetNotFound(f'Worksheet "{worksheet_name}" not found in the template spreadsheet.')
 
-    new_worksheet_created = False
+def _check_for_missing_worksheets_and_create_them(target_spreadsheet_object, template_worksheets: dict, worksheet_name_list):
+    # Get the list of worksheet titles in the target spreadsheet once
+    existing_worksheet_titles = set(worksheet.title for worksheet in target_spreadsheet_object.worksheets())
 
-    # Get the list of worksheet titles in the target spreadsheet
-    worksheet_list = target_spreadsheet_object.worksheets()
+    missing_worksheet_names = [worksheet_name for worksheet_name in worksheet_name_list
+        if worksheet_name not in existing_worksheet_titles]
 
-    # Check if a specific worksheet exists
-    worksheet_exists = any(worksheet.title == worksheet_name for worksheet in worksheet_list)
+    if len(missing_worksheet_names) == 0:
+        return
 
-    if worksheet_exists == False:
-        # Get worksheet in template
-        template_worksheet = template_spreadsheet_object.worksheet(worksheet_name)
-        
-        # Copy worksheet to the target spreadsheet
-        target_worksheet_info_dict = template_worksheet.copy_to(target_spreadsheet_object.id)
-        target_worksheet_object = target_spreadsheet_object.worksheet(target_worksheet_info_dict['title'])
-        
-        # Rename worksheet at destination to remove 'Copy of'
-        target_worksheet_object.update_title(worksheet_name)
+    _check_that_template_has_worksheets(template_worksheets, missing_worksheet_names)
 
-        new_worksheet_created = True
-       
-    return new_worksheet_created
+    # Copy each missing worksheet to the target spreadsheet
+    rename_requests = []
+    for worksheet_name in missing_worksheet_names:
+        logging.info(f'Copy the "{worksheet_name}" worksheet from the template.')
+        target_worksheet_info_dict = template_worksheets[worksheet_name].copy_to(target_spreadsheet_object.id)
 
-def _check_for_missing_worksheets_and_create_them(target_spreadsheet_object, template_spreadsheet_object, worksheet_name_list):
-    for worksheet_name in worksheet_name_list:
-        _create_worksheet_from_template_if_does_not_exist(target_spreadsheet_object = target_spreadsheet_object, 
-            template_spreadsheet_object = template_spreadsheet_object, worksheet_name = worksheet_name)
+        # Rename worksheet at destination to remove 'Copy of'
+        rename_requests.append({
+            'updateSheetProperties': {
+                'properties': {'sheetId': target_worksheet_info_dict['sheetId'], 'title': worksheet_name},
+                'fields': 'title',
+            }
+        })
+
+    # Rename all the copies in one request
+    target_spreadsheet_object.batch_update({'requests': rename_requests})
 
 def _create_spreadsheet_from_template(output_spreadsheet_name: str, output_folder_id: str, 
-    template_spreadsheet_id: str, worksheet_name_list: list, gs):
-    
-    # Create spreadsheet
-    spreadsheet = gs.create(output_spreadsheet_name, folder_id=output_folder_id)
-    
-    # Get the template
-    template_spreadsheet = gs.open_by_key(template_spreadsheet_id)
-    
-    # Copy tabs from template to the spreadsheet
-    _check_for_missing_worksheets_and_create_them(target_spreadsheet_object = spreadsheet, 
-        template_spreadsheet_object = template_spreadsheet, 
-        worksheet_name_list = worksheet_name_list)
-
-    # Delete the default sheet
-    default_worksheet_to_delete = spreadsheet.worksheet("Sheet1")
-    spreadsheet.del_worksheet(default_worksheet_to_delete)
-    
+    template_spreadsheet_id: str, worksheet_name_list: list, gs, copy_template_file: bool = True,
+    template_worksheets_cache: dict = None):
+
+    if template_worksheets_cache is None:
+        template_worksheets_cache = {}
+    template_worksheets = _get_template_worksheets(template_spreadsheet_id, gs, template_worksheets_cache)
+    _check_that_template_has_worksheets(template_worksheets, worksheet_name_list)
+
+    if copy_template_file == False:
+        # Create spreadsheet
+        spreadsheet = gs.create(output_spreadsheet_name, folder_id=output_folder_id)
+
+        # Copy tabs from template to the spreadsheet
+        _check_for_missing_worksheets_and_create_them(target_spreadsheet_object = spreadsheet, 
+            template_worksheets = template_worksheets, 
+            worksheet_name_list = worksheet_name_list)
+
+        # Delete the default sheet
+        default_worksheet_to_delete = spreadsheet.worksheet("Sheet1")
+        spreadsheet.del_worksheet(default_worksheet_to_delete)
+
+        return spreadsheet
+
+    # Copy the whole template file in one Drive request
+    logging.info('Copy the template spreadsheet.')
+    spreadsheet = gs.copy(template_spreadsheet_id, title=output_spreadsheet_name, folder_id=output_folder_id,
+        copy_permissions=False, copy_comments=False)
+
+    # Delete the worksheets that aren't needed and put the rest in the order given, in one request.
+    # A file copy keeps the worksheet IDs of the template.
+    requests = [
+        {'deleteSheet': {'sheetId': worksheet.id}}
+        for worksheet_title, worksheet in template_worksheets.items()
+        if worksheet_title not in worksheet_name_list
+    ]
+    requests += [
+        {
+            'updateSheetProperties': {
+                'properties': {'sheetId': template_worksheets[worksheet_name].id, 'index': worksheet_index},
+                'fields': 'index',
+            }
+        }
+        for worksheet_index, worksheet_name in enumerate(worksheet_name_list)
+    ]
+    spreadsheet.batch_update({'requests': requests})
+
     return spreadsheet
 
 def update_magic_spreadsheet_with_new_query_results(spreadsheet_object, worksheet_information_dict: dict, 
@@ -282,21 +420,55 @@ def update_magic_spreadsheet_with_new_query_results(spreadsheet_object, workshee
         # different_source_worksheet_object = None, 
         # different_source_number_of_header_rows = None, different_source_num_columns_on_left_not_to_keep = None,
         # different_source_columns_to_rename = [],
+        # Optional Parameters: Snapshot of manual values, to skip reading unchanged worksheets
+        # manual_values_snapshot_directory = None,
+        # Optional Parameters: Only plan the refresh (see plan_magic_spreadsheet_refresh) instead of running it
+        # dry_run = False,
     ):
 
+    if kwargs.pop('dry_run', False) == True:
+        return plan_magic_spreadsheet_refresh(
+            spreadsheet_object = spreadsheet_object,
+            worksheet_information_dict = worksheet_information_dict,
+            school_information_dict = school_information_dict,
+            other_query_parameters_dict = other_query_parameters_dict,
+            primary_identifier = primary_identifier,
+            secondary_optional_identifier = secondary_optional_identifier,
+            worksheet_order_name_list = worksheet_order_name_list,
+            **kwargs,
+        )
+
+    # If a snapshot directory is given and the spreadsheet hasn't changed since the last refresh,
+    #   manual values are loaded from the local snapshot instead of being read from the worksheets
+    manual_values_snapshot_directory = kwargs.pop('manual_values_snapshot_directory', None)
+    if manual_values_snapshot_directory is not None and not manual_values_snapshots_available():
+        logging.warning('pyarrow is not installed, so manual values snapshots are disabled.')
+        manual_values_snapshot_directory = None
+
+    current_snapshot_worksheet_names = set()
+    if manual_values_snapshot_directory is not None:
+        last_change_before_refresh = get_drive_file_last_change(spreadsheet_object.id, google_drive=create_drive())
+        current_snapshot_worksheet_names = get_current_snapshot_worksheet_names(
+            manual_values_snapshot_directory, spreadsheet_object.id, last_change_before_refresh['version'])
+
+    # Worksheets whose snapshot was confirmed to match what the refresh wrote
+    confirmed_snapshot_worksheet_names = []
+
     # Update all worksheets with fresh query results
     for worksheet_name in worksheet_information_dict.keys():
         logging.info('='*75)
         logging.info(f'Begin updating "{worksheet_name}" worksheet.')
 
         worksheet_to_update = spreadsheet_object.worksheet(worksheet_name)
-        _update_magic_spreadsheet_worksheet_with_new_query_results(
+        snapshot_confirmed = _update_magic_spreadsheet_worksheet_with_new_query_results(
             worksheet_object = worksheet_to_update,
             single_worksheet_information_dict = worksheet_information_dict[worksheet_name],
             query_parameters_dict = {**school_information_dict, **other_query_parameters_dict},
             colors_dict = colors_dict,
             primary_identifier = primary_identifier,
             secondary_optional_identifier = secondary_optional_identifier,
+            manual_values_snapshot_directory = manual_values_snapshot_directory,
+            manual_values_snapshot_is_current = worksheet_name in current_snapshot_worksheet_names,
             # get_data_from_different_source = get_data_from_different_source, 
             **kwargs,
             # different_source_worksheet_object = different_source_worksheet_object, 
@@ -305,18 +477,140 @@ def update_magic_spreadsheet_with_new_query_results(spreadsheet_object, workshee
             # different_source_columns_to_rename = different_source_columns_to_rename,
         )
 
+        if snapshot_confirmed:
+            confirmed_snapshot_worksheet_names.append(worksheet_name)
+
         logging.info(f'Done updating "{worksheet_name}" worksheet.')
         
     # Reorder worksheets
-    if len(worksheet_order_name_list) > 0:
-        _reorder_worksheets(spreadsheet_object, worksheet_order_name_list)
+    _run_steps(_build_reorder_worksheets_steps(spreadsheet_object, worksheet_order_name_list))
         
     # Re-confirm spreadsheet is shared with all general editors and all school editors
     spreadsheet_editor_list = school_information_dict['spreadsheet_editors']
     full_editor_list = general_editor_list + spreadsheet_editor_list
 
-    for editor in full_editor_list:
-        spreadsheet_object.share(editor, perm_type='user', role='writer', notify=False)
+    # Only editors who don't already have access are added, in one batched request
+    sync_file_permissions(spreadsheet_object.id, full_editor_list, role='writer', perm_type='user',
+        google_drive=create_drive())
+
+    # Mark the snapshots written above as current; any later change to the spreadsheet invalidates them.
+    #   If someone else edited the spreadsheet during the refresh, their edit may be missing from a
+    #   snapshot, so no snapshot is trusted and the next refresh reads the worksheets instead.
+    if manual_values_snapshot_directory is not None:
+        final_version = get_drive_file_version(spreadsheet_object.id, google_drive=create_drive())
+        try:
+            only_changed_by_refresh = were_all_drive_file_changes_since_made_by_me(spreadsheet_object.id,
+                last_change_before_refresh['modifiedDate'], google_drive=create_drive())
+        except Exception as e:
+            logging.warning(f'Could not list the spreadsheet revisions, so manual values snapshots are not trusted: {e!r}')
+            only_changed_by_refresh = False
+
+        if not only_changed_by_refresh:
+            logging.warning('The spreadsheet was edited by someone else during the refresh; the next refresh '
+                'will read manual values from the worksheets.')
+            confirmed_snapshot_worksheet_names = []
+
+        record_manual_values_snapshot_version(manual_values_snapshot_directory, spreadsheet_object.id,
+            final_version, confirmed_snapshot_worksheet_names)
+
+def plan_magic_spreadsheet_refresh(spreadsheet_object, worksheet_information_dict: dict,
+        school_information_dict: dict, other_query_parameters_dict: dict, primary_identifier: str,
+        secondary_optional_identifier: str = '', worksheet_order_name_list = [],
+        requests_per_minute: int = DEFAULT_SHEETS_REQUESTS_PER_MINUTE,
+        max_bytes_per_request: int = DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST,
+        max_cells_per_request: int = DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST,
+        **kwargs,
+    ):
+    """
+    Works out what update_magic_spreadsheet_with_new_query_results would do, without writing
+    anything to the spreadsheet. The warehouse queries are run and the existing worksheets are
+    read (basic filters are left alone), so the row and column counts are the real ones.
+
+    Takes the same parameters as update_magic_spreadsheet_with_new_query_results (and is called
+    by it with dry_run=True), plus the rate limit and the request size limits used for writing.
+
+    Returns a dataframe with one row per worksheet:
+        worksheet_name, rows, columns, cells_written, write_chunks, payload_bytes,
+        warehouse_queries, read_requests, write_requests, estimated_seconds
+    Read and write requests count against separate Sheets quotas, so estimated_seconds is the
+    larger of the two divided by requests_per_minute. Spreadsheet-level requests (reordering
+    worksheets) are added as a final '(spreadsheet)' row. Drive requests for sharing and
+    snapshots aren't included.
+    """
+    manual_values_snapshot_directory = kwargs.pop('manual_values_snapshot_directory', None)
+    current_snapshot_worksheet_names = set()
+    if manual_values_snapshot_directory is not None and manual_values_snapshots_available():
+        current_snapshot_worksheet_names = get_current_snapshot_worksheet_names(
+            manual_values_snapshot_directory, spreadsheet_object.id,
+            get_drive_file_version(spreadsheet_object.id, google_drive=create_drive()))
+
+    plan_rows = []
+
+    for worksheet_name, single_worksheet_information_dict in worksheet_information_dict.items():
+        logging.info(f'Plan the refresh of the "{worksheet_name}" worksheet.')
+
+        # Opening the worksheet is one read request
+        worksheet_object = spreadsheet_object.worksheet(worksheet_name)
+        sheets_requests = {'read_requests': 1, 'write_requests': 0}
+        number_of_header_rows = single_worksheet_information_dict['number_of_header_rows']
+
+        df_combined_matches, _, manual_values_worksheet_object = _build_updated_worksheet_values(
+            worksheet_object = worksheet_object,
+            single_worksheet_information_dict = single_worksheet_information_dict,
+            query_parameters_dict = {**school_information_dict, **other_query_parameters_dict},
+            primary_identifier = primary_identifier,
+            secondary_optional_identifier = secondary_optional_identifier,
+            manual_values_snapshot_directory = manual_values_snapshot_directory,
+            manual_values_snapshot_is_current = worksheet_name in current_snapshot_worksheet_names,
+            sheets_requests = sheets_requests,
+            **kwargs,
+        )
+
+        # The same steps a refresh runs, counted instead of run
+        num_rows, num_columns = df_combined_matches.shape
+        rewrite_steps, write_plan = _build_worksheet_rewrite_steps(worksheet_object, manual_values_worksheet_object,
+            df_combined_matches, number_of_header_rows, max_bytes_per_request, max_cells_per_request)
+        formatting_steps = _build_worksheet_formatting_steps(worksheet_object, single_worksheet_information_dict,
+            number_of_header_rows, num_rows + number_of_header_rows, colors_dict={})
+
+        for step in rewrite_steps + formatting_steps:
+            sheets_requests['read_requests'] += step['read_requests']
+            sheets_requests['write_requests'] += step['write_requests']
+
+        plan_rows.append({
+            'worksheet_name': worksheet_name,
+            'rows': num_rows,
+            'columns': num_columns,
+            'cells_written': num_rows * num_columns,
+            'write_chunks': len(write_plan['chunks']),
+            'payload_bytes': write_plan['payload_bytes'],
+            'warehouse_queries': 1,
+            **sheets_requests,
+        })
+
+    reorder_steps = _build_reorder_worksheets_steps(spreadsheet_object, worksheet_order_name_list)
+    if len(reorder_steps) > 0:
+        plan_rows.append({
+            'worksheet_name': '(spreadsheet)',
+            'rows': 0,
+            'columns': 0,
+            'cells_written': 0,
+            'write_chunks': 0,
+            'payload_bytes': 0,
+            'warehouse_queries': 0,
+            'read_requests': sum(step['read_requests'] for step in reorder_steps),
+            'write_requests': sum(step['write_requests'] for step in reorder_steps),
+        })
+
+    df_plan = pd.DataFrame(plan_rows, columns=['worksheet_name', 'rows', 'columns', 'cells_written', 'write_chunks',
+        'payload_bytes', 'warehouse_queries', 'read_requests', 'write_requests'])
+    df_plan['estimated_seconds'] = df_plan[['read_requests', 'write_requests']].max(axis=1) * 60 / requests_per_minute
+
+    logging.info(f'Planned refresh: {df_plan["cells_written"].sum()} cells, {df_plan["payload_bytes"].sum()} bytes, '
+        f'{df_plan["read_requests"].sum()} read and {df_plan["write_requests"].sum()} write requests, '
+        f'about {max(df_plan["read_requests"].sum(), df_plan["write_requests"].sum()) * 60 / requests_per_minute:.0f} seconds.')
+
+    return df_plan
 
 def col_to_letter(column_int):
     """
@@ -333,37 +627,136 @@ def col_to_letter(column_int):
 
 def check_for_static_worksheets_and_add_them_with_protection(target_spreadsheet_object, 
     template_spreadsheet_id, static_worksheets_list, primary_editor_email = '', 
-    info_team_group_email = '', other_individual_editors_list=[]):
+    info_team_group_email = '', other_individual_editors_list=[], worksheet_order_name_list=[],
+    template_worksheets_cache: dict = None):
+    """
+    Copies any static worksheets the spreadsheet is missing from the template, and protects the
+    ones marked 'protected' if they don't have their sheet-wide protection yet. If
+    worksheet_order_name_list is given, the worksheets are also put in that order.
+    template_worksheets_cache is as in create_or_retrieve_magic_spreadsheet_and_add_missing_worksheets.
+
+    The spreadsheet's worksheets and protected ranges are read with one metadata request, and all
+    renames, protections and reordering are sent in one batchUpdate.
+    """
 
     gs = create_sheets()
 
-    template_spreadsheet_object = gs.open_by_key(template_spreadsheet_id)
+    worksheet_structure = _fetch_worksheet_structure(target_spreadsheet_object)
+
+    static_worksheet_names = [static_worksheet['worksheet_name'] for static_worksheet in static_worksheets_list]
+    missing_worksheet_names = [worksheet_name for worksheet_name in static_worksheet_names
+        if worksheet_name not in worksheet_structure]
+
+    requests = []
+
+    if len(missing_worksheet_names) > 0:
+        template_worksheets = _get_template_worksheets(template_spreadsheet_id, gs,
+            template_worksheets_cache if template_worksheets_cache is not None else {})
+        _check_that_template_has_worksheets(template_worksheets, missing_worksheet_names)
+
+        copied_sheet_ids = {}
+        for worksheet_name in missing_worksheet_names:
+            logging.info(f'Copy the "{worksheet_name}" worksheet from the template.')
+            target_worksheet_info_dict = template_worksheets[worksheet_name].copy_to(target_spreadsheet_object.id)
+            copied_sheet_ids[target_worksheet_info_dict['sheetId']] = worksheet_name
+
+        # Copies can bring protected ranges with them, so read the structure again
+        worksheet_structure = {
+            copied_sheet_ids.get(worksheet_info['sheetId'], worksheet_title): worksheet_info
+            for worksheet_title, worksheet_info in _fetch_worksheet_structure(target_spreadsheet_object).items()
+        }
+
+        # Rename worksheets at destination to remove 'Copy of'
+        requests += [
+            {
+                'updateSheetProperties': {
+                    'properties': {'sheetId': sheet_id, 'title': worksheet_name},
+                    'fields': 'title',
+                }
+            }
+            for sheet_id, worksheet_name in copied_sheet_ids.items()
+        ]
 
     for static_worksheet in static_worksheets_list:
         static_worksheet_name = static_worksheet['worksheet_name']
-        _create_worksheet_from_template_if_does_not_exist(target_spreadsheet_object, template_spreadsheet_object, static_worksheet_name)
 
         if static_worksheet['protected'] == True:
-            static_worksheet_object = target_spreadsheet_object.worksheet(static_worksheet_name)
-            protected_range_list = target_spreadsheet_object.list_protected_ranges(static_worksheet_object.id)
-
+            worksheet_info = worksheet_structure[static_worksheet_name]
             target_description = f'"{static_worksheet_name}" Sheet-wide Protection'
 
-            if any(protected_range["description"] == target_description for protected_range in protected_range_list):
-                logging.info('Protected range already exists.')
+            if target_description in worksheet_info['protected_range_descriptions']:
+                logging.info(f'Protected range already exists on "{static_worksheet_name}".')
             else:
-                logging.info('Protect range not found. Creating new one.')
+                logging.info(f'Protected range not found on "{static_worksheet_name}". Creating new one.')
 
                 individual_editors = [primary_editor_email] + other_individual_editors_list
+                final_column_letter = col_to_letter(worksheet_info['column_count'])
+
+                requests.append({
+                    'addProtectedRange': {
+                        'protectedRange': {
+                            'range': a1_range_to_grid_range(f'A:{final_column_letter}', worksheet_info['sheetId']),
+                            'description': target_description,
+                            'warningOnly': False,
+                            'requestingUserCanEdit': False,
+                            'editors': {
+                                'users': individual_editors,
+                                'groups': [info_team_group_email],
+                            },
+                        }
+                    }
+                })
 
-                num_worksheet_columns = static_worksheet_object.col_count
-                final_column_letter = col_to_letter(num_worksheet_columns)
+    if len(worksheet_order_name_list) > 0:
+        requests += _build_reorder_worksheet_requests(worksheet_structure, worksheet_order_name_list)
 
-                static_worksheet_object.add_protected_range(name=f'A:{final_column_letter}', 
-                    editor_users_emails = individual_editors, 
-                    editor_groups_emails=[info_team_group_email], 
-                    description = target_description
-                )
+    if len(requests) > 0:
+        target_spreadsheet_object.batch_update({'requests': requests})
+
+def _fetch_worksheet_structure(spreadsheet_object):
+    """
+    Returns {worksheet title: {'sheetId', 'index', 'column_count', 'protected_range_descriptions'}}
+    for all worksheets in the spreadsheet, from a single metadata request.
+    """
+    metadata = spreadsheet_object.fetch_sheet_metadata(params={'fields': WORKSHEET_STRUCTURE_FIELDS})
+
+    worksheet_structure = {}
+    for sheet in metadata.get('sheets', []):
+        properties = sheet['properties']
+        worksheet_structure[properties['title']] = {
+            'sheetId': properties['sheetId'],
+            'index': properties.get('index', 0),
+            'column_count': properties.get('gridProperties', {}).get('columnCount', 0),
+            'protected_range_descriptions': set(
+                protected_range.get('description') for protected_range in sheet.get('protectedRanges', [])
+            ),
+        }
+
+    return worksheet_structure
+
+def _build_reorder_worksheet_requests(worksheet_structure: dict, worksheet_order_name_list):
+    """
+    Returns the batchUpdate requests that put the worksheets in worksheet_order_name_list first, in
+    that order, followed by any other worksheets in their current order.
+    """
+    for worksheet_name in worksheet_order_name_list:
+        if worksheet_name not in worksheet_structure:
+            raise WorksheetNotFound(worksheet_name)
+
+    other_worksheet_names = sorted(
+        [worksheet_name for worksheet_name in worksheet_structure if worksheet_name not in worksheet_order_name_list],
+        key=lambda worksheet_name: worksheet_structure[worksheet_name]['index'],
+    )
+
+    return [
+        {
+            'updateSheetProperties': {
+                'properties': {'sheetId': worksheet_structure[worksheet_name]['sheetId'], 'index': worksheet_index},
+                'fields': 'index',
+            }
+        }
+        for worksheet_index, worksheet_name in enumerate(list(worksheet_order_name_list) + other_worksheet_names)
+    ]
 
 def update_specific_cell(spreadsheet_object, worksheet_name, cell_a1_notation, text_string):
     worksheet = spreadsheet_object.worksheet(worksheet_name)
@@ -373,45 +766,61 @@ def update_specific_cell(spreadsheet_object, worksheet_name, cell_a1_notation, t
 
 def _apply_worksheet_formatting(worksheet_object, single_worksheet_information_dict: dict, number_of_header_rows: int, 
     updated_worksheet_row_count: int, colors_dict: dict):
+    _run_steps(_build_worksheet_formatting_steps(worksheet_object, single_worksheet_information_dict,
+        number_of_header_rows, updated_worksheet_row_count, colors_dict))
+
+def _build_worksheet_formatting_steps(worksheet_object, single_worksheet_information_dict: dict, number_of_header_rows: int, 
+    updated_worksheet_row_count: int, colors_dict: dict):
+    """
+    Returns the steps (see _sheets_requests_step) that format a worksheet after its values
+    have been rewritten.
+    """
+    steps = []
+
+    def add_steps(description, new_steps):
+        # Log description once, before the first of the new steps
+        if len(new_steps) > 0:
+            new_steps[0]['description'] = description
+        steps.extend(new_steps)
+
     # Add any validation rules to the worksheet
     if 'data_validations' in single_worksheet_information_dict:
-        logging.info('Add the data validations to the worksheet.')
         data_validations_list = single_worksheet_information_dict['data_validations']
-        _add_data_validations_to_worksheet(worksheet_object, data_validations_list)
+        add_steps('Add the data validations to the worksheet.',
+            _build_data_validation_steps(worksheet_object, data_validations_list))
     
     # Re-add any formulas to the worksheet, since they would have been overwritten by hard-coded existing data
     if 'formulas' in single_worksheet_information_dict:
-        logging.info('Add the formulas to the worksheet.')
         formulas_list = single_worksheet_information_dict['formulas']
-        _add_formulas_to_worksheet(worksheet_object, formulas_list)
+        add_steps('Add the formulas to the worksheet.', _build_formula_steps(worksheet_object, formulas_list))
 
     # Hide rows and columns as specified
     if ('num_header_rows_to_hide' in single_worksheet_information_dict or 'num_left_columns_to_hide' in single_worksheet_information_dict):
-        logging.info('Hide the specified rows and columns.')
-        _hide_header_rows_and_left_columns_in_worksheet(
+        add_steps('Hide the specified rows and columns.', _build_hide_header_rows_and_left_columns_steps(
             worksheet_object = worksheet_object, 
             num_header_rows_to_hide = single_worksheet_information_dict['num_header_rows_to_hide'] if 'num_header_rows_to_hide' in single_worksheet_information_dict else 0,
             num_left_columns_to_hide = single_worksheet_information_dict['num_left_columns_to_hide'] if 'num_left_columns_to_hide' in single_worksheet_information_dict else 0
-        )
+        ))
 
     # Set basic filter
     if 'filter_on_final_header_row' in single_worksheet_information_dict and single_worksheet_information_dict['filter_on_final_header_row'] == True:
-        logging.info('Set the filter on the worksheet.')
-        _set_basic_filter_on_worksheet(
-            worksheet_object = worksheet_object, 
-            row_number_for_filter = number_of_header_rows, 
-            final_row_number = updated_worksheet_row_count
-        )
-
-    # Refresh conditional formatting
+        steps.append(_sheets_requests_step('Set the filter on the worksheet.', write_requests=1,
+            run=lambda: _set_basic_filter_on_worksheet(
+                worksheet_object = worksheet_object, 
+                row_number_for_filter = number_of_header_rows, 
+                final_row_number = updated_worksheet_row_count
+            )))
+
+    # Refresh conditional formatting: the current rules are read, then replaced
     if 'conditional_formatting_rules' in single_worksheet_information_dict:
-        logging.info('Refresh the conditional formatting on the worksheet.')
-        _refresh_conditional_formatting_on_worksheet(
-            worksheet_object = worksheet_object,
-            num_header_rows = number_of_header_rows,
-            conditional_formatting_rules_dict = single_worksheet_information_dict['conditional_formatting_rules'],
-            colors_dict = colors_dict,
-        )
+        steps.append(_sheets_requests_step('Refresh the conditional formatting on the worksheet.',
+            read_requests=1, write_requests=1,
+            run=lambda: _refresh_conditional_formatting_on_worksheet(
+                worksheet_object = worksheet_object,
+                num_header_rows = number_of_header_rows,
+                conditional_formatting_rules_dict = single_worksheet_information_dict['conditional_formatting_rules'],
+                colors_dict = colors_dict,
+            )))
 
     # Get the last column of the query
     query_column_end = col_to_letter(single_worksheet_information_dict['warehouse_query_number_of_columns'])
@@ -425,8 +834,8 @@ def _apply_worksheet_formatting(worksheet_object, single_worksheet_information_d
         backgroundColor = color(245/255, 245/255, 245/255), # Light Gray
         )
 
-    logging.info('Format the warehouse data cells with the background color.')
-    format_cell_range(worksheet_object, background_color_range, background_color_format)
+    steps.append(_sheets_requests_step('Format the warehouse data cells with the background color.', write_requests=1,
+        run=lambda: format_cell_range(worksheet_object, background_color_range, background_color_format)))
 
     # Set cell dividing line on right side of query data
     query_data_border_range = f'{query_column_end}:{query_column_end}'
@@ -447,62 +856,106 @@ def _apply_worksheet_formatting(worksheet_object, single_worksheet_information_d
         }
     )
 
-    logging.info('Set the cell dividing line on the right side of the warehouse data cells.')
-    format_cell_range(worksheet_object, query_data_border_range, borders_format)
+    steps.append(_sheets_requests_step('Set the cell dividing line on the right side of the warehouse data cells.',
+        write_requests=1, run=lambda: format_cell_range(worksheet_object, query_data_border_range, borders_format)))
 
-def _reorder_worksheets(spreadsheet_object, worksheet_order_name_list):
-    worksheet_objects_in_desired_order = []
+    return steps
 
-    for worksheet_name in worksheet_order_name_list:
-        worksheet = spreadsheet_object.worksheet(worksheet_name)
-        worksheet_objects_in_desired_order.append(worksheet)
+def _reorder_worksheets(spreadsheet_object, worksheet_order_name_list):
+    worksheet_structure = _fetch_worksheet_structure(spreadsheet_object)
 
-    spreadsheet_object.reorder_worksheets(worksheet_objects_in_desired_order)
+    spreadsheet_object.batch_update({'requests': _build_reorder_worksheet_requests(worksheet_structure, worksheet_order_name_list)})
 
-def _get_all_manual_values_from_existing_worksheet(data_source_worksheet_object, data_source_number_of_header_rows,
-    primary_identifier, secondary_optional_identifier, num_columns_on_left_not_to_keep, source_columns_to_rename = []):
+def _build_reorder_worksheets_steps(spreadsheet_object, worksheet_order_name_list):
+    if len(worksheet_order_name_list) == 0:
+        return []
 
-    # Clear the filter on the worksheet
-    data_source_worksheet_object.clear_basic_filter()
+    # One metadata read and one batchUpdate
+    return [_sheets_requests_step(None, read_requests=1, write_requests=1,
+        run=lambda: _reorder_worksheets(spreadsheet_object, worksheet_order_name_list))]
 
-    ### Get all data from existing tab
-    all_values = data_source_worksheet_object.get_all_values()
+def _get_all_manual_values_from_existing_worksheet(data_source_worksheet_object, data_source_number_of_header_rows,
+    primary_identifier, secondary_optional_identifier, num_columns_on_left_not_to_keep, source_columns_to_rename = [],
+    sheets_requests: dict = None):
 
-    # Turn all_values into a dataframe
-    # These values are 0-based but number_of_header_rows is 1-based
-    df_all_values = pd.DataFrame(all_values[data_source_number_of_header_rows:], columns=all_values[data_source_number_of_header_rows-1])
+    # Get the header row first, to find the identifier columns
+    header_row_values = data_source_worksheet_object.row_values(data_source_number_of_header_rows)
+    _count_sheets_requests(sheets_requests, read_requests=1)
 
     # Rename columns in the different source if needed
-    for column_tuple in source_columns_to_rename:
-        original_column_name = column_tuple[0]
-        new_column_name = column_tuple[1]
-
-        if original_column_name in df_all_values.columns:
-            # Rename the column
-            df_all_values = df_all_values.rename(columns={original_column_name: new_column_name})
+    columns_to_rename = dict(source_columns_to_rename)
+    header_row_values = [columns_to_rename.get(column_name, column_name) for column_name in header_row_values]
 
     # Keep only the columns from the spreadsheet that are not getting updated by the query + the identifiers
     # Assume that all worksheets need a primary_identifier column; they may or may not have an secondary_optional_identifier column
+    if primary_identifier not in header_row_values:
+        raise Exception(f'Column "{primary_identifier}" not found in header row {data_source_number_of_header_rows} '
+            f'of worksheet "{data_source_worksheet_object.title}".')
+
     identifier_columns_to_keep = [primary_identifier]
 
-    secondary_optional_identifier_used_on_sheet = (secondary_optional_identifier in df_all_values.columns)
+    secondary_optional_identifier_used_on_sheet = (secondary_optional_identifier in header_row_values)
 
     if secondary_optional_identifier_used_on_sheet == True:
         identifier_columns_to_keep.append(secondary_optional_identifier)
 
-    spreadsheet_keep_columns = identifier_columns_to_keep + list(df_all_values.columns[(num_columns_on_left_not_to_keep):])
-    df_spreadsheet_values_to_keep = df_all_values[spreadsheet_keep_columns]
+    ### Get the identifier columns and the manual columns in one request, skipping the query columns
+    first_data_row = data_source_number_of_header_rows + 1
+    worksheet_title = data_source_worksheet_object.title
+    column_ranges = [
+        absolute_range_name(worksheet_title, f'{col_to_letter(column_number)}{first_data_row}:{col_to_letter(column_number)}')
+        # Column numbers are 1-based
+        for column_number in [header_row_values.index(column_name) + 1 for column_name in identifier_columns_to_keep]
+    ]
+
+    first_manual_column = num_columns_on_left_not_to_keep + 1
+    last_worksheet_column = data_source_worksheet_object.col_count
+    if first_manual_column <= last_worksheet_column:
+        column_ranges.append(absolute_range_name(worksheet_title,
+            f'{col_to_letter(first_manual_column)}{first_data_row}:{col_to_letter(last_worksheet_column)}'))
+
+    response = data_source_worksheet_object.spreadsheet.values_batch_get(
+        column_ranges,
+        params={'majorDimension': 'COLUMNS', 'valueRenderOption': 'FORMATTED_VALUE'},
+    )
+    _count_sheets_requests(sheets_requests, read_requests=1)
+    value_ranges = [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+
+    # The values API leaves out trailing blank cells and columns
+    identifier_columns = [value_range[0] if len(value_range) > 0 else [] for value_range in value_ranges[:len(identifier_columns_to_keep)]]
+    manual_columns = value_ranges[len(identifier_columns_to_keep)] if len(value_ranges) > len(identifier_columns_to_keep) else []
+
+    # Keep manual columns up to the last one with a header or any values
+    num_manual_columns = max(len(manual_columns), len(header_row_values) - num_columns_on_left_not_to_keep, 0)
+    manual_column_names = header_row_values[num_columns_on_left_not_to_keep:] + [''] * num_manual_columns
+    manual_column_names = manual_column_names[:num_manual_columns]
+    manual_columns = manual_columns + [[]] * (num_manual_columns - len(manual_columns))
+
+    all_columns = identifier_columns + manual_columns
+    num_rows = max([len(column_values) for column_values in all_columns], default=0)
+
+    df_spreadsheet_values_to_keep = pd.DataFrame(
+        {position: column_values + [''] * (num_rows - len(column_values)) for position, column_values in enumerate(all_columns)},
+        index=range(num_rows),
+    )
+    df_spreadsheet_values_to_keep.columns = identifier_columns_to_keep + manual_column_names
 
     return df_spreadsheet_values_to_keep, secondary_optional_identifier_used_on_sheet
 
-def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object, single_worksheet_information_dict: dict,
-        query_parameters_dict: dict, colors_dict: dict, primary_identifier: str,
-        # Optional Parameters: Secondary Identifier
-        secondary_optional_identifier: str = '', 
-        # Optional Parameters: Getting Data from Different Source
-        **kwargs
+def _build_updated_worksheet_values(worksheet_object, single_worksheet_information_dict: dict,
+        query_parameters_dict: dict, primary_identifier: str, secondary_optional_identifier: str = '',
+        manual_values_snapshot_directory: str = None, manual_values_snapshot_is_current: bool = False,
+        sheets_requests: dict = None, **kwargs
     ):
+    """
+    Runs the worksheet's warehouse query, loads the manual values currently on the worksheet (or from
+    a different source / the snapshot), and attaches them to the query output. Returns the dataframe
+    to write below the header rows, whether the secondary identifier is used on the sheet, and the
+    worksheet the manual values come from (whose basic filter the rewrite clears).
 
+    Nothing is written. If sheets_requests ({'read_requests', 'write_requests'}) is given, the Sheets
+    requests made are added to it.
+    """
     # Add query to query_list and run query
     # TODO: Do we ever need to run multiple queries in one sheet? If not, refactor to run a single query
 
@@ -515,19 +968,25 @@ def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object,
     df_query_output = _run_warehouse_query_for_worksheet(query_list)
 
     # Load key metadata
-
     number_of_header_rows = single_worksheet_information_dict['number_of_header_rows']
     num_columns_in_query = single_worksheet_information_dict['warehouse_query_number_of_columns']
     
     ### Get all data from existing tab
     gs = create_sheets()
 
+    manual_values_snapshot = None
+    if manual_values_snapshot_is_current:
+        manual_values_snapshot = read_manual_values_snapshot(manual_values_snapshot_directory,
+            worksheet_object.spreadsheet_id, worksheet_object.title)
+
     # Check if parameters passed to get data from a different source
     if 'get_data_from_different_source' in kwargs and kwargs['get_data_from_different_source'] == True:
         # Atypical path: Loading data from a different worksheet than will be writing to
         logging.info('Load data from specified external worksheet.')
         different_source_spreadsheet_object = gs.open_by_key(kwargs['different_source_spreadsheet_id'])
         different_source_worksheet_object = different_source_spreadsheet_object.worksheet(kwargs['different_source_worksheet_name'])
+        _count_sheets_requests(sheets_requests, read_requests=2)
+        manual_values_worksheet_object = different_source_worksheet_object
 
         df_spreadsheet_values_to_keep, secondary_optional_identifier_used_on_sheet = _get_all_manual_values_from_existing_worksheet(
             data_source_worksheet_object = different_source_worksheet_object, 
@@ -536,83 +995,41 @@ def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object,
             secondary_optional_identifier = secondary_optional_identifier, 
             num_columns_on_left_not_to_keep = kwargs['different_source_num_columns_on_left_not_to_keep'],
             source_columns_to_rename = kwargs['different_source_columns_to_rename'],
+            sheets_requests = sheets_requests,
         )
+    elif manual_values_snapshot is not None:
+        # Fast path: nothing changed since the last refresh, so the manual values are the ones written then
+        logging.info('Spreadsheet unchanged since last refresh; load data from manual values snapshot.')
+        manual_values_worksheet_object = worksheet_object
+        df_spreadsheet_values_to_keep, secondary_optional_identifier_used_on_sheet = manual_values_snapshot
     else:
         # Standard path: loading data from same worksheet will be writing to
         logging.info('Load data from existing worksheet.')
+        manual_values_worksheet_object = worksheet_object
         df_spreadsheet_values_to_keep, secondary_optional_identifier_used_on_sheet = _get_all_manual_values_from_existing_worksheet(
             data_source_worksheet_object = worksheet_object, 
             data_source_number_of_header_rows = number_of_header_rows,
             primary_identifier = primary_identifier, 
             secondary_optional_identifier = secondary_optional_identifier, 
-            num_columns_on_left_not_to_keep = num_columns_in_query
+            num_columns_on_left_not_to_keep = num_columns_in_query,
+            sheets_requests = sheets_requests,
         )
         
     logging.info('Connect user data from existing worksheet to new query output.')
-    # Blank out the 'Not Assigned Yet' values in the primary_identifier column of the spreadsheet dataframe to avoid an incorrect join
-    df_spreadsheet_values_to_keep[primary_identifier] = df_spreadsheet_values_to_keep[primary_identifier].apply(lambda x: '' if x == 'Not Assigned Yet' else x)
-        
-    ### Connect data from existing tab to query output in a new dataframe
-
-    # Attempt a match on primary_identifier first
-    df_matched_based_on_primary_identifier = df_query_output.merge(df_spreadsheet_values_to_keep, on=primary_identifier, how='left', indicator='primary_identifier_match')
-
-    # Drop duplicate secondary_optional_identifier column
-    df_matched_based_on_primary_identifier = df_matched_based_on_primary_identifier.rename(columns={f'{secondary_optional_identifier}_x': secondary_optional_identifier}).drop(f'{secondary_optional_identifier}_y', axis=1)
-
-    # logging.info('Post primary_identifier_match:', df_matched_based_on_primary_identifier.columns)
-
-    # Create a dataframe of successful matches on primary_identifier
-    df_only_primary_identifier_matches = df_matched_based_on_primary_identifier[df_matched_based_on_primary_identifier['primary_identifier_match'] == 'both']
-    df_only_primary_identifier_matches = df_only_primary_identifier_matches.drop('primary_identifier_match', axis=1)
-    
-    # Create df_only_failed_primary_identifier_matches for further processing
-    df_only_failed_primary_identifier_matches = df_matched_based_on_primary_identifier[df_matched_based_on_primary_identifier['primary_identifier_match'] != 'both']
-    df_only_failed_primary_identifier_matches = df_only_failed_primary_identifier_matches.drop('primary_identifier_match', axis=1)
-
-    # Drop blank columns from first match attempt
-    df_only_failed_primary_identifier_matches = df_only_failed_primary_identifier_matches.iloc[:,:(num_columns_in_query)]  
-
-    # Adjustments based on whether there is a second identifier column
-    if secondary_optional_identifier_used_on_sheet == True:
-
-        # If a row in df_only_failed_primary_identifier_matches contains a number for primary_identifier and 'N/A' for secondary_optional_identifier,
-        #   then they are likely a student newly added to the list. Put them in a dataframe so they can be stacked later.
-        df_newly_added_students_with_no_primary_identifier_match_and_na_secondary_identifier = df_only_failed_primary_identifier_matches[pd.to_numeric(df_only_failed_primary_identifier_matches[primary_identifier], errors='coerce').notnull() & (df_only_failed_primary_identifier_matches[secondary_optional_identifier] == 'N/A')]
-        
-        # And then drop these students from df_only_failed_primary_identifier_matches
-        df_only_failed_primary_identifier_matches = df_only_failed_primary_identifier_matches.drop(df_newly_added_students_with_no_primary_identifier_match_and_na_secondary_identifier.index)
-        
-        # Drop rows from existing spreadsheet data where secondary_optional_identifier is 'N/A' and convert columns for merging to numeric
-        df_spreadsheet_values_to_keep = df_spreadsheet_values_to_keep[df_spreadsheet_values_to_keep[secondary_optional_identifier] != 'N/A']
-        df_spreadsheet_values_to_keep[secondary_optional_identifier] = pd.to_numeric(df_spreadsheet_values_to_keep[secondary_optional_identifier])
-        df_only_failed_primary_identifier_matches[secondary_optional_identifier] = pd.to_numeric(df_only_failed_primary_identifier_matches[secondary_optional_identifier])
-        
-        # Merge on secondary_optional_identifier
-        df_secondary_optional_identifier_matches = df_only_failed_primary_identifier_matches.merge(df_spreadsheet_values_to_keep, on=secondary_optional_identifier, how='left')
-        
-        # Deal with duplicate primary_identifier column
-        df_secondary_optional_identifier_matches = df_secondary_optional_identifier_matches.drop(f'{primary_identifier}_y', axis=1).rename(columns={f'{primary_identifier}_x': primary_identifier})
-    else:
-        # If a row in df_only_failed_primary_identifier_matches contains a number for primary_identifier and there is no secondary_optional_identifier column,
-        #   then they are likely a student newly added to the list. Put them in a dataframe so they can be stacked later.
-        df_newly_added_students_with_no_primary_identifier_match_and_na_secondary_identifier = df_only_failed_primary_identifier_matches[pd.to_numeric(df_only_failed_primary_identifier_matches[primary_identifier], errors='coerce').notnull()]
-        
-    # Successful primary_identifier matches and newly added students with no primary_identifier match are always included
-    dataframes_to_combine = [
-        df_only_primary_identifier_matches, 
-        df_newly_added_students_with_no_primary_identifier_match_and_na_secondary_identifier
-    ]
+    # Match on primary_identifier first, then on secondary_optional_identifier for the rest. Query rows
+    #   with no match are new students, and existing rows with no match are reported as orphans.
+    reconciliation = reconcile_manual_values(
+        df_query_output = df_query_output.drop_duplicates(),
+        df_existing_values = df_spreadsheet_values_to_keep,
+        primary_identifier = primary_identifier,
+        secondary_identifier = secondary_optional_identifier if secondary_optional_identifier_used_on_sheet else None,
+    )
 
-    # If there is an secondary_optional_identifier column, include secondary_optional_identifier matches (including matches that failed both primary_identifier and secondary_optional_identifier merges)
-    if secondary_optional_identifier_used_on_sheet == True:
-        dataframes_to_combine.append(df_secondary_optional_identifier_matches)
-    # If there is no secondary_optional_identifier column, include failed primary_identifier matches
-    else:
-        dataframes_to_combine.append(df_only_failed_primary_identifier_matches)
+    logging.info(f'{len(reconciliation.matched)} rows matched existing data and {len(reconciliation.new)} rows are new.')
+    if len(reconciliation.orphaned) > 0:
+        logging.info(f'{len(reconciliation.orphaned)} existing rows no longer match the query output and will be dropped.')
 
-    # Create single dataframe combining the initial primary_identifier matches, newly added students with no primary_identifier match, failed matches, and if necessary, the secondary_optional_identifier matches
-    df_combined_matches = pd.concat(dataframes_to_combine, axis=0)
+    df_combined_matches = reconciliation.combined
 
     # If sorting lists provided, sort the dataframe
     if 'sorting_column_list' in single_worksheet_information_dict and 'sorting_ascending_list' in single_worksheet_information_dict:
@@ -622,27 +1039,27 @@ def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object,
     # Fill NA's so they don't fail when updating the spreadsheet
     df_combined_matches.fillna('', inplace=True)
 
-    # Drop duplicate rows to prevent duplicate identifiers from adding new rows exponentially
-    df_combined_matches = df_combined_matches.drop_duplicates()
-    
-    ### Update existing tab with data from new dataframe
+    return df_combined_matches, secondary_optional_identifier_used_on_sheet, manual_values_worksheet_object
 
-    # Prepare to clear existing tab
-    existing_num_worksheet_columns = worksheet_object.col_count
-    final_column_letter = col_to_letter(existing_num_worksheet_columns)
-
-    # Check that the df_combined_matches dataframe is not too large for the worksheet before deleting any data
-    new_num_worksheet_columns = df_combined_matches.shape[1]
+def _build_worksheet_rewrite_steps(worksheet_object, manual_values_worksheet_object, df_combined_matches,
+        number_of_header_rows: int, max_bytes_per_request: int = DEFAULT_SHEETS_MAX_BYTES_PER_REQUEST,
+        max_cells_per_request: int = DEFAULT_SHEETS_MAX_CELLS_PER_REQUEST,
+    ):
+    """
+    Returns the steps (see _sheets_requests_step) that replace the worksheet's rows below the
+    header with df_combined_matches, and the plan of the values write (see
+    googlesheets.plan_dataframe_write).
+    """
+    steps = []
 
-    if(new_num_worksheet_columns > existing_num_worksheet_columns):
-        logging.info('existing_num_worksheet_columns:', existing_num_worksheet_columns)
-        logging.info('new_num_worksheet_columns:', new_num_worksheet_columns)
-        logging.info('df_combined_matches columns:', df_combined_matches.columns.to_list())
-        assert False, "Dataframe of updated data has more columns than the existing worksheet. Check for duplicate column names in source worksheet."
+    # Clear the filter on the worksheet the manual values come from
+    steps.append(_sheets_requests_step('Clear the basic filter.', write_requests=1,
+        run=lambda: manual_values_worksheet_object.clear_basic_filter()))
 
     # Clear existing tab
-    logging.info('Clear the existing worksheet.')
-    worksheet_object.batch_clear([f'A{number_of_header_rows+1}:{final_column_letter}'])
+    final_column_letter = col_to_letter(worksheet_object.col_count)
+    steps.append(_sheets_requests_step('Clear the existing worksheet.', write_requests=1,
+        run=lambda: worksheet_object.batch_clear([f'A{number_of_header_rows+1}:{final_column_letter}'])))
 
     # Delete all rows on worksheet after headers + first data row
     num_rows_to_delete = worksheet_object.row_count - number_of_header_rows - 1
@@ -653,15 +1070,76 @@ def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object,
         # Last row to delete; subtract 1 from the number of rows to delete to get the row # of the last row to delete
         # e.g., deleting 1 row means start and end indexes are the same; deleting 2 rows means end index is 1 more than the start index
         delete_end_index = delete_start_index + num_rows_to_delete - 1
-        worksheet_object.delete_rows(delete_start_index, delete_end_index)
+        steps.append(_sheets_requests_step(None, write_requests=1,
+            run=lambda: worksheet_object.delete_rows(delete_start_index, delete_end_index)))
+
+    # Update the destination worksheet in size-bounded chunks
+    write_plan = plan_dataframe_write(df_combined_matches,
+        worksheet_row_count = min(worksheet_object.row_count, number_of_header_rows + 1),
+        worksheet_col_count = worksheet_object.col_count,
+        start_row = number_of_header_rows + 1,
+        max_bytes_per_request = max_bytes_per_request,
+        max_cells_per_request = max_cells_per_request,
+    )
+    steps.append(_sheets_requests_step('Update the existing worksheet with the new combined data.',
+        write_requests=write_plan['write_requests'],
+        run=lambda: write_dataframe_to_worksheet(worksheet_object, df_combined_matches,
+            start_row=number_of_header_rows+1, value_input_option='USER_ENTERED',
+            max_bytes_per_request=max_bytes_per_request, max_cells_per_request=max_cells_per_request)))
+
+    return steps, write_plan
 
-    # Calculate the range for the destination worksheet
+def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object, single_worksheet_information_dict: dict,
+        query_parameters_dict: dict, colors_dict: dict, primary_identifier: str,
+        # Optional Parameters: Secondary Identifier
+        secondary_optional_identifier: str = '', 
+        # Optional Parameters: Snapshot of manual values
+        manual_values_snapshot_directory: str = None,
+        manual_values_snapshot_is_current: bool = False,
+        # Optional Parameters: Getting Data from Different Source
+        **kwargs
+    ):
+
+    # Load key metadata
+    number_of_header_rows = single_worksheet_information_dict['number_of_header_rows']
+    num_columns_in_query = single_worksheet_information_dict['warehouse_query_number_of_columns']
+
+    df_combined_matches, secondary_optional_identifier_used_on_sheet, manual_values_worksheet_object = _build_updated_worksheet_values(
+        worksheet_object = worksheet_object,
+        single_worksheet_information_dict = single_worksheet_information_dict,
+        query_parameters_dict = query_parameters_dict,
+        primary_identifier = primary_identifier,
+        secondary_optional_identifier = secondary_optional_identifier,
+        manual_values_snapshot_directory = manual_values_snapshot_directory,
+        manual_values_snapshot_is_current = manual_values_snapshot_is_current,
+        **kwargs,
+    )
+
+    ### Update existing tab with data from new dataframe
+    existing_num_worksheet_columns = worksheet_object.col_count
+
+    # Check that the df_combined_matches dataframe is not too large for the worksheet before deleting any data
+    new_num_worksheet_columns = df_combined_matches.shape[1]
+
+    if(new_num_worksheet_columns > existing_num_worksheet_columns):
+        logging.info('existing_num_worksheet_columns:', existing_num_worksheet_columns)
+        logging.info('new_num_worksheet_columns:', new_num_worksheet_columns)
+        logging.info('df_combined_matches columns:', df_combined_matches.columns.to_list())
+        assert False, "Dataframe of updated data has more columns than the existing worksheet. Check for duplicate column names in source worksheet."
+
+    # Calculate the final row of the destination worksheet
     updated_worksheet_row_count = df_combined_matches.shape[0] + number_of_header_rows # Number of records + number of header rows
-    destination_range = f'A{number_of_header_rows+1}:{final_column_letter}{updated_worksheet_row_count}'
 
-    # Update the destination worksheet
-    logging.info('Update the existing worksheet with the new combined data.')
-    worksheet_object.update(destination_range, df_combined_matches.values.tolist(), value_input_option='USER_ENTERED')
+    rewrite_steps, _ = _build_worksheet_rewrite_steps(worksheet_object, manual_values_worksheet_object,
+        df_combined_matches, number_of_header_rows)
+    _run_steps(rewrite_steps)
+
+    # Right after the write, confirm it was the last change to the spreadsheet, i.e. nobody edited the
+    #   worksheet in between, before trusting a snapshot of what was written
+    written_values_confirmed = False
+    if manual_values_snapshot_directory is not None:
+        written_values_confirmed = get_drive_file_last_change(worksheet_object.spreadsheet_id,
+            google_drive=create_drive())['changed_by_me']
 
     # Apply worksheet formatting
     _apply_worksheet_formatting(
@@ -670,3 +1148,22 @@ def _update_magic_spreadsheet_worksheet_with_new_query_results(worksheet_object,
         number_of_header_rows = number_of_header_rows, 
         updated_worksheet_row_count = updated_worksheet_row_count, 
         colors_dict = colors_dict)
+
+    # Save what was just written to the identifier and manual columns for the next refresh
+    if manual_values_snapshot_directory is not None and not written_values_confirmed:
+        logging.info('The spreadsheet was last changed by someone else; not saving a manual values snapshot.')
+    elif manual_values_snapshot_directory is not None:
+        identifier_columns_written = [primary_identifier]
+        if secondary_optional_identifier_used_on_sheet == True:
+            identifier_columns_written.append(secondary_optional_identifier)
+
+        combined_column_names = list(df_combined_matches.columns)
+        df_manual_values_written = pd.concat([
+            df_combined_matches.iloc[:, [combined_column_names.index(column_name) for column_name in identifier_columns_written]],
+            df_combined_matches.iloc[:, num_columns_in_query:],
+        ], axis=1)
+        write_manual_values_snapshot(manual_values_snapshot_directory, worksheet_object.spreadsheet_id,
+            worksheet_object.title, df_manual_values_written, secondary_optional_identifier_used_on_sheet)
+
+    # Whether a snapshot of this worksheet can be trusted on the next refresh
+    return written_values_confirmed
@@ -0,0 +1,167 @@
+"""
+Matching of existing Magic Spreadsheet rows to fresh warehouse query output.
+
+A Magic Spreadsheet keeps manual columns (notes, checkboxes, etc.) to the right of
+the query columns. On every refresh, each query row needs the manual values from
+the sheet row for the same student. reconcile_manual_values does that with hash
+lookups on the identifier columns instead of a chain of DataFrame merges:
+
+    1. Match on the primary identifier.
+    2. For query rows that didn't match, match on the secondary identifier against
+       sheet rows that weren't already used.
+    3. Anything else is a new row (blank manual values). Sheet rows that no query
+       row matched are returned as orphans instead of being silently dropped.
+
+If the sheet has the same identifier on more than one row, the first row wins and
+the others are reported as orphans, so rows never multiply.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Identifier values that mean "no identifier yet" and should never be matched on
+UNASSIGNED_PRIMARY_IDENTIFIER_VALUES = ('Not Assigned Yet',)
+UNASSIGNED_SECONDARY_IDENTIFIER_VALUES = ('N/A',)
+
+MATCH_TYPE_PRIMARY = 'primary'
+MATCH_TYPE_SECONDARY = 'secondary'
+MATCH_TYPE_NEW = 'new'
+
+ManualValueReconciliation = namedtuple(
+    'ManualValueReconciliation',
+    [
+        'combined',     # Query output with the manual columns appended, in query order
+        'match_type',   # Series aligned with combined: 'primary', 'secondary' or 'new'
+        'matched',      # Rows of combined that matched an existing sheet row
+        'new',          # Rows of combined with no existing sheet row (blank manual values)
+        'orphaned',     # Existing sheet rows that no query row matched
+    ],
+)
+
+def reconcile_manual_values(df_query_output, df_existing_values, primary_identifier: str,
+    secondary_identifier: str = None,
+    unassigned_primary_values=UNASSIGNED_PRIMARY_IDENTIFIER_VALUES,
+    unassigned_secondary_values=UNASSIGNED_SECONDARY_IDENTIFIER_VALUES):
+    """
+    Attaches the manual columns of an existing worksheet to new query output.
+
+    Parameters:
+    df_query_output: The fresh warehouse query output. Must contain the identifier
+        column(s).
+    df_existing_values: Values from the existing worksheet: the primary identifier
+        column, then the secondary identifier column if secondary_identifier is
+        given, then the manual columns (as returned by
+        magic_spreadsheet._get_all_manual_values_from_existing_worksheet).
+    primary_identifier: Name of the primary identifier column.
+    secondary_identifier: Name of the optional secondary identifier column, or None
+        if the worksheet doesn't have one.
+    unassigned_primary_values / unassigned_secondary_values: Identifier values that
+        are treated as blank and never matched.
+
+    Identifiers are compared as trimmed text, except that numeric-looking values are
+    compared as numbers (so 123, '123' and '123.0' match).
+
+    Returns:
+    ManualValueReconciliation: see the field comments above.
+    """
+    num_identifier_columns = 1 if secondary_identifier is None else 2
+    df_manual_values = df_existing_values.iloc[:, num_identifier_columns:]
+    num_existing_rows = len(df_existing_values)
+
+    query_primary_keys = _normalize_identifier_keys(df_query_output[primary_identifier], unassigned_primary_values)
+    existing_primary_keys = _normalize_identifier_keys(df_existing_values.iloc[:, 0], unassigned_primary_values)
+
+    # Existing row position for each query row; -1 means no match yet
+    existing_row_positions = _lookup_first_positions(
+        query_keys=query_primary_keys,
+        existing_keys=existing_primary_keys,
+        eligible_existing_rows=existing_primary_keys != '',
+    )
+    match_type = np.where(existing_row_positions >= 0, MATCH_TYPE_PRIMARY, MATCH_TYPE_NEW).astype(object)
+
+    if secondary_identifier is not None:
+        query_secondary_keys = _normalize_identifier_keys(df_query_output[secondary_identifier], unassigned_secondary_values)
+        existing_secondary_keys = _normalize_identifier_keys(df_existing_values.iloc[:, 1], unassigned_secondary_values)
+
+        # Sheet rows already claimed by a primary match can't be matched again
+        used_existing_rows = np.zeros(num_existing_rows, dtype=bool)
+        used_existing_rows[existing_row_positions[existing_row_positions >= 0]] = True
+
+        unmatched_query_rows = existing_row_positions < 0
+        secondary_positions = _lookup_first_positions(
+            query_keys=np.where(unmatched_query_rows, query_secondary_keys, ''),
+            existing_keys=existing_secondary_keys,
+            eligible_existing_rows=(existing_secondary_keys != '') & ~used_existing_rows,
+        )
+
+        secondary_matches = secondary_positions >= 0
+        existing_row_positions = np.where(secondary_matches, secondary_positions, existing_row_positions)
+        match_type[secondary_matches] = MATCH_TYPE_SECONDARY
+
+    # Take the manual values for every query row in one go. Unmatched rows point at
+    # an extra blank row appended after the existing values.
+    manual_values = np.vstack([
+        df_manual_values.to_numpy(dtype=object),
+        np.full((1, df_manual_values.shape[1]), '', dtype=object),
+    ])
+    take_positions = np.where(existing_row_positions >= 0, existing_row_positions, num_existing_rows)
+
+    df_combined = pd.concat(
+        [
+            df_query_output.reset_index(drop=True),
+            pd.DataFrame(manual_values[take_positions], columns=df_manual_values.columns),
+        ],
+        axis=1,
+    )
+    match_type = pd.Series(match_type, name='match_type')
+
+    orphaned_rows = np.ones(num_existing_rows, dtype=bool)
+    orphaned_rows[existing_row_positions[existing_row_positions >= 0]] = False
+
+    return ManualValueReconciliation(
+        combined=df_combined,
+        match_type=match_type,
+        matched=df_combined[(match_type != MATCH_TYPE_NEW).to_numpy()],
+        new=df_combined[(match_type == MATCH_TYPE_NEW).to_numpy()],
+        orphaned=df_existing_values[orphaned_rows],
+    )
+
+def _normalize_identifier_keys(identifier_series, unassigned_values):
+    """
+    Returns a numpy array of comparable keys for an identifier column. Blank, missing
+    and unassigned identifiers become ''.
+    """
+    as_text = identifier_series.astype(str).str.strip()
+    blank = identifier_series.isna().to_numpy() | as_text.isin(unassigned_values).to_numpy()
+
+    as_number = pd.to_numeric(as_text, errors='coerce')
+    is_number = as_number.notna().to_numpy() & (as_text != '').to_numpy()
+
+    keys = as_text.to_numpy(dtype=object)
+    keys[is_number] = as_number[is_number].astype('float64').astype(str).to_numpy(dtype=object)
+    keys[blank] = ''
+
+    return keys
+
+def _lookup_first_positions(query_keys, existing_keys, eligible_existing_rows):
+    """
+    For each query key, returns the position of the first eligible existing row with
+    the same key, or -1. Blank query keys never match.
+    """
+    eligible_positions = np.flatnonzero(eligible_existing_rows)
+    eligible_keys = pd.Index(existing_keys[eligible_positions])
+
+    first_occurrence = ~eligible_keys.duplicated(keep='first')
+    unique_keys = eligible_keys[first_occurrence]
+    unique_positions = eligible_positions[first_occurrence]
+
+    if len(unique_keys) == 0:
+        return np.full(len(query_keys), -1, dtype=np.int64)
+
+    indexer = unique_keys.get_indexer(query_keys)
+    positions = np.where(indexer >= 0, unique_positions[np.maximum(indexer, 0)], -1)
+    positions[np.asarray(query_keys, dtype=object) == ''] = -1
+
+    return positions
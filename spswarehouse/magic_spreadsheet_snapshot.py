@@ -0,0 +1,137 @@
+"""
+Local snapshots of the manual values a Magic Spreadsheet refresh last wrote.
+
+After a refresh, the identifier and manual columns written to each worksheet are
+saved as Parquet files, and the spreadsheet's Drive version is recorded once the
+whole refresh is done. On the next refresh, if the Drive version hasn't changed,
+nobody has edited the spreadsheet since, so the manual values are loaded from the
+snapshot instead of being read back from Google Sheets.
+
+A snapshot is only marked current if the refresh can show that nobody else edited
+the spreadsheet while it ran: the last change right after the worksheet was written
+must be the refresh's own, and every Drive revision saved during the refresh must be
+too. Otherwise the next refresh reads the worksheets.
+
+Any change to the spreadsheet (including by another script, or update_specific_cell
+after the refresh) changes the version, and the worksheets are read from Sheets
+again. Snapshots need pyarrow; without it they are skipped.
+
+Layout of the snapshot directory:
+    <snapshot_directory>/<spreadsheet ID>/version.json
+    <snapshot_directory>/<spreadsheet ID>/<worksheet name>.parquet
+    <snapshot_directory>/<spreadsheet ID>/<worksheet name>.json
+"""
+
+import json
+import logging
+import os
+
+from urllib.parse import quote
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ModuleNotFoundError:
+    pyarrow = None
+
+SNAPSHOT_VERSION_FILE_NAME = 'version.json'
+
+def manual_values_snapshots_available():
+    """
+    Returns whether snapshots can be read and written (i.e., pyarrow is installed).
+    """
+    return pyarrow is not None
+
+def get_current_snapshot_worksheet_names(snapshot_directory, spreadsheet_id, drive_version):
+    """
+    Returns the names of the worksheets whose snapshots can be trusted: the ones
+    written during the last refresh, if that refresh was recorded at drive_version
+    (i.e., the spreadsheet hasn't changed since). Otherwise returns an empty set.
+    """
+    version_path = os.path.join(_spreadsheet_snapshot_directory(snapshot_directory, spreadsheet_id),
+        SNAPSHOT_VERSION_FILE_NAME)
+
+    if not os.path.exists(version_path):
+        return set()
+
+    with open(version_path, 'r') as version_file:
+        recorded_snapshot = json.load(version_file)
+
+    if recorded_snapshot.get('version') != drive_version:
+        return set()
+
+    return set(recorded_snapshot.get('worksheets', []))
+
+def read_manual_values_snapshot(snapshot_directory, spreadsheet_id, worksheet_name):
+    """
+    read_manual_values_snapshot: -> (DataFrame, bool) or None
+
+    Returns the snapshot of a worksheet's identifier and manual columns, and whether
+    the secondary identifier is one of them, in the same shape as
+    magic_spreadsheet._get_all_manual_values_from_existing_worksheet. Returns None if
+    there is no snapshot for the worksheet.
+    """
+    parquet_path, metadata_path = _worksheet_snapshot_paths(snapshot_directory, spreadsheet_id, worksheet_name)
+
+    if not (os.path.exists(parquet_path) and os.path.exists(metadata_path)):
+        return None
+
+    with open(metadata_path, 'r') as metadata_file:
+        metadata = json.load(metadata_file)
+
+    df_snapshot = pd.read_parquet(parquet_path)
+    # Columns are stored by position because worksheet headers can repeat or be blank
+    df_snapshot.columns = metadata['columns']
+
+    return df_snapshot, metadata['secondary_identifier_used_on_sheet']
+
+def write_manual_values_snapshot(snapshot_directory, spreadsheet_id, worksheet_name, df_manual_values,
+    secondary_identifier_used_on_sheet):
+    """
+    Saves a worksheet's identifier and manual columns, as written to the worksheet.
+    Values are stored as text, the way they are read back from Sheets.
+
+    The spreadsheet's recorded version is removed, so the snapshot isn't trusted
+    until record_manual_values_snapshot_version is called at the end of the refresh.
+    """
+    spreadsheet_directory = _spreadsheet_snapshot_directory(snapshot_directory, spreadsheet_id)
+    os.makedirs(spreadsheet_directory, exist_ok=True)
+
+    version_path = os.path.join(spreadsheet_directory, SNAPSHOT_VERSION_FILE_NAME)
+    if os.path.exists(version_path):
+        os.remove(version_path)
+
+    parquet_path, metadata_path = _worksheet_snapshot_paths(snapshot_directory, spreadsheet_id, worksheet_name)
+
+    df_to_save = df_manual_values.fillna('').astype(str)
+    df_to_save.columns = [str(position) for position in range(df_to_save.shape[1])]
+    df_to_save.to_parquet(parquet_path, index=False)
+
+    with open(metadata_path, 'w') as metadata_file:
+        json.dump({
+            'columns': [str(column) for column in df_manual_values.columns],
+            'secondary_identifier_used_on_sheet': bool(secondary_identifier_used_on_sheet),
+        }, metadata_file)
+
+def record_manual_values_snapshot_version(snapshot_directory, spreadsheet_id, drive_version, worksheet_names):
+    """
+    Records the Drive version of the spreadsheet after a refresh, which marks the
+    snapshots of the given worksheets (the ones written during the refresh) as current.
+    """
+    spreadsheet_directory = _spreadsheet_snapshot_directory(snapshot_directory, spreadsheet_id)
+    os.makedirs(spreadsheet_directory, exist_ok=True)
+
+    with open(os.path.join(spreadsheet_directory, SNAPSHOT_VERSION_FILE_NAME), 'w') as version_file:
+        json.dump({'version': drive_version, 'worksheets': list(worksheet_names)}, version_file)
+
+    logging.info(f'Recorded manual values snapshot for spreadsheet {spreadsheet_id} at version {drive_version}.')
+
+def _spreadsheet_snapshot_directory(snapshot_directory, spreadsheet_id):
+    return os.path.join(snapshot_directory, quote(spreadsheet_id, safe=''))
+
+def _worksheet_snapshot_paths(snapshot_directory, spreadsheet_id, worksheet_name):
+    worksheet_path = os.path.join(_spreadsheet_snapshot_directory(snapshot_directory, spreadsheet_id),
+        quote(worksheet_name, safe=''))
+
+    return worksheet_path + '.parquet', worksheet_path + '.json'
@@ -4,6 +4,9 @@ import os
 import math
 import pandas as pd
 
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
 try:
     from spswarehouse.credentials import powerschool_config
 except:
@@ -15,13 +18,29 @@ from ducttape.utils import (
     get_most_recent_file_in_dir,
 )
 
+from spswarehouse.config import (
+    DEFAULT_DOWNLOAD_TIMEOUT_SECONDS,
+    DEFAULT_REPORT_QUEUE_SETTLE_SECONDS,
+    DEFAULT_REPORT_QUEUE_SUBMIT_TIMEOUT_SECONDS,
+    DEFAULT_REPORT_QUEUE_TIMEOUT_SECONDS,
+)
+from spswarehouse.general.browser_session import BrowserSessionStore
+from spswarehouse.general.download_watcher import DownloadWatcher, wait_for_new_file_in_folder
+from spswarehouse.general.polling import DurationHistory, PollingTimeoutError, poll_until
 from spswarehouse.general.selenium import (
+    create_requests_session_from_driver,
+    download_file_with_requests_session,
     type_in_element_by_id,
     select_visible_text_in_element_by_id,
     click_element_by_id,
     click_element_by_name,
     click_element_by_partial_link_text,
+    get_wait_time_summary,
+    timed_wait,
     wait_for_element_containing_specific_text,
+    wait_for_element_count_to_stabilize,
+    wait_for_page_ready,
+    wait_for_page_to_reload,
 )
     
 from selenium.webdriver.support.ui import WebDriverWait, Select
@@ -29,7 +48,7 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
 ADMIN_LOGIN_PAGE_PATH = 'admin/pw.html'
 ADMIN_HOME_PAGE_PATH = 'admin/home.html'
@@ -39,6 +58,21 @@ REPORT_QUEUE_REPORTWORKS_PAGE_PATH = 'admin/reportqueue/prhome.html'
 REPORT_QUEUE_SYSTEM_PAGE_PATH = 'admin/reportqueue/home.html'
 DATA_IMPORT_MANAGER_PATH = 'admin/datamgmt/importmanager.action'
 
+# Report queues that reports can be submitted to
+REPORT_QUEUE_SYSTEM = 'system'
+REPORT_QUEUE_REPORTWORKS = 'reportworks'
+
+# Header buttons that open the school and school year pickers; their text shows the current selection
+SCHOOL_PICKER_TOGGLE_BUTTON_ID = 'school_picker_adminSchoolPicker_toggle_btn'
+SCHOOL_YEAR_PICKER_TOGGLE_BUTTON_ID = 'term_picker_adminTermPicker_toggle_btn'
+
+# Status cell text of System report queue jobs that haven't finished yet
+REPORT_QUEUE_SYSTEM_UNFINISHED_STATUSES = ('Running', 'Pending', 'Waiting', 'Queued')
+
+# Words in the headers of the System report queue columns that identify a job (its report name
+# and submitted time). Every row has them, while the View link may only show up once a job is done.
+REPORT_QUEUE_SYSTEM_JOB_KEY_HEADERS = ('name', 'submitted')
+
 class PowerSchool:
     """
     This class is an abstraction for interacting with the PowerSchool Admin user 
@@ -54,7 +88,22 @@ class PowerSchool:
         headless: bool=True, 
         download_location: str='.',
         chrome_option_prefs: dict=None,
+        report_generation_times_path: str=None,
+        use_http_downloads: bool=False,
+        session_cookies_path: str=None,
     ):
+        """
+        report_generation_times_path: Optional JSON file where how long each report takes to
+            generate is kept across runs (see general.polling.DurationHistory). Report queue
+            checks start later for reports that usually take longer.
+        use_http_downloads: If True, the System report queue is checked, and report files are
+            downloaded, over HTTP with the browser's login cookies (see
+            general.selenium.create_requests_session_from_driver) instead of through the
+            browser. Files are streamed straight to their final name.
+        session_cookies_path: Optional file where the login cookies are saved (see
+            general.browser_session.BrowserSessionStore). If the cookies saved there are still
+            logged in, they are reused instead of logging in again.
+        """
         
         if config is None:
             config = powerschool_config
@@ -79,20 +128,60 @@ class PowerSchool:
             download_location=download_location,
             chrome_option_prefs=chrome_option_prefs,
         )
+
+        # Full path of the file downloaded by the most recent download_latest_report_* call
+        self.last_downloaded_file_path = None
+
+        # Set by start_report_queue_pipeline: System report queue jobs submitted but not downloaded yet
+        self._pending_report_queue_jobs = None
+        self._known_report_queue_job_ids = set()
+
+        # How long each report took to generate, to tune how soon the report queue is checked
+        self.report_generation_times = DurationHistory(report_generation_times_path)
+        self._current_report_name = 'Unknown report'
+
+        self.use_http_downloads = use_http_downloads
+        self._http_session = None
+
+        # The school and school year last confirmed in the pickers, with the header text at the
+        # time, so switching to them again can be skipped while the header still shows the same
+        self._selected_school = None
+        self._selected_school_year = None
         
-        self._log_into_powerschool_admin(username, password)
+        if session_cookies_path is None:
+            self._log_into_powerschool_admin(username, password)
+        else:
+            session_store = BrowserSessionStore(session_cookies_path)
+            if not session_store.restore(self.driver, self.host + '/' + ADMIN_HOME_PAGE_PATH,
+                self._is_logged_into_powerschool_admin):
+                self._log_into_powerschool_admin(username, password)
+                session_store.save(self.driver)
 
     def quit(self):
         self.driver.quit()
 
+    def get_navigation_wait_summary(self):
+        """
+        Returns how long the waits for pages and pickers to load have taken, and how
+        much time they saved over the fixed sleeps they replaced. See
+        general.selenium.get_wait_time_summary.
+
+        Parameters:
+        self
+
+        Returns:
+        pandas.DataFrame: One row per wait.
+        """
+        return get_wait_time_summary()
+
     def refresh(self):
         self.driver.refresh()
 
     def ensure_on_desired_path(self, desired_path: str):
         """
-        Checks whether the WebDriver is on the desired path. If not, navigates there.
-        When using this function, consider a WebDriverWait afterwards to confirm the
-        desired page has loaded.
+        Checks whether the WebDriver is on the desired path. If not, navigates there and
+        waits for the page to finish loading. When using this function, consider a
+        WebDriverWait afterwards for the specific element needed.
 
         Parameters:
         self
@@ -111,7 +200,8 @@ class PowerSchool:
         else:
             logging.info(f"This does not match {desired_path}, so going to that path")
             self.driver.get('https://' + self._get_current_domain() + "/" + desired_path)
-            time.sleep(3) # Give new page time to load
+            with timed_wait('ensure_on_desired_path: page ready', replaced_sleep_seconds=3):
+                wait_for_page_ready(self.driver)
             logging.info(f"Moved to {desired_path}.")
 
     def check_whether_desired_school_selected(self, school_name: str) -> bool:
@@ -128,11 +218,16 @@ class PowerSchool:
         bool: True indicates the desired school is selected, and False indicates it is not.
         """
 
+        if self._is_selection_unchanged(self._selected_school, school_name, SCHOOL_PICKER_TOGGLE_BUTTON_ID):
+            logging.info(f"{school_name} is still selected, according to the page header.")
+            return True
+
         elem = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, 
-            'school_picker_adminSchoolPicker_toggle_btn')))
+            SCHOOL_PICKER_TOGGLE_BUTTON_ID)))
 
         elem.click()
-        time.sleep(1)
+        with timed_wait('school picker: list loaded', replaced_sleep_seconds=1):
+            wait_for_element_count_to_stabilize(self.driver, By.CSS_SELECTOR, '.list-item.selectable')
 
         selected_element = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((
             By.CSS_SELECTOR, '.list-item.selectable.selected')))
@@ -151,6 +246,9 @@ class PowerSchool:
         logging.info(f"Pressing escape to leave dropdown selection.")
         actions = ActionChains(self.driver)
         actions.send_keys(Keys.ESCAPE).perform()
+
+        self._selected_school = (school_name, self._get_picker_toggle_text(SCHOOL_PICKER_TOGGLE_BUTTON_ID)) \
+            if outcome else None
         
         return outcome
     
@@ -168,11 +266,17 @@ class PowerSchool:
         bool: True indicates the desired school year is selected, and False indicates it is not.
         """
 
+        if self._is_selection_unchanged(self._selected_school_year, school_year_dropdown,
+            SCHOOL_YEAR_PICKER_TOGGLE_BUTTON_ID):
+            logging.info(f"'{school_year_dropdown}' is still selected, according to the page header.")
+            return True
+
         elem = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, 
-            'term_picker_adminTermPicker_toggle_btn')))
+            SCHOOL_YEAR_PICKER_TOGGLE_BUTTON_ID)))
 
         elem.click()
-        time.sleep(1)
+        with timed_wait('school year picker: list loaded', replaced_sleep_seconds=1):
+            wait_for_element_count_to_stabilize(self.driver, By.CSS_SELECTOR, '.list-item.selectable')
 
         selected_element = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((
             By.CSS_SELECTOR, '.list-item.selectable.selected')))
@@ -191,6 +295,9 @@ class PowerSchool:
         logging.info(f"Pressing escape to leave dropdown selection.")
         actions = ActionChains(self.driver)
         actions.send_keys(Keys.ESCAPE).perform()
+
+        self._selected_school_year = (school_year_dropdown,
+            self._get_picker_toggle_text(SCHOOL_YEAR_PICKER_TOGGLE_BUTTON_ID)) if outcome else None
         
         return outcome
     
@@ -213,32 +320,32 @@ class PowerSchool:
 
             logging.info("Waiting for School Year Picker")
             elem = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, 
-                'term_picker_adminTermPicker_toggle_btn')))
+                SCHOOL_YEAR_PICKER_TOGGLE_BUTTON_ID)))
             logging.info("School Year Picker found. Click it.")
 
             elem.click()
 
-            time.sleep(1)
-
             logging.info("Waiting for School Year Search Field")
-            elem = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((By.ID, 
-                'termText')))
+            with timed_wait('switch_to_school_year: search field ready', replaced_sleep_seconds=1):
+                elem = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((By.ID, 
+                    'termText')))
             logging.info("Found School Year Search Field. Typing in school year text.")
 
             # Only send the XX-YY portion of the dropdown text
             elem.send_keys(school_year_dropdown[:5])
 
-            time.sleep(1)
-
             logging.info("Looking for first school year in list")
-            
-            elem = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.XPATH, 
-                "//ul[@id='term_choices']/li[2]"))) # This is li[2] instead of li[1] because there is read-only school year item displayed
+            with timed_wait('switch_to_school_year: search results', replaced_sleep_seconds=1):
+                # Wait for li[2] instead of li[1] because there is read-only school year item displayed
+                elem = wait_for_element_count_to_stabilize(self.driver, By.XPATH, "//ul[@id='term_choices']/li",
+                    min_count=2)[1]
 
             logging.info("Found first school year in results list. Clicking.")
+            old_page = self.driver.find_element(By.TAG_NAME, 'html')
             elem.click()
             logging.info("Click. Waiting for page to refresh.")
-            time.sleep(1)
+            with timed_wait('switch_to_school_year: page refreshed', replaced_sleep_seconds=1):
+                wait_for_page_to_reload(self.driver, old_page)
             
             assert self.check_whether_desired_school_year_selected(school_year_dropdown), "Failed to select \
                 desired school year."
@@ -265,30 +372,29 @@ class PowerSchool:
 
             logging.info("Waiting for School Picker")
             elem = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, 
-                'school_picker_adminSchoolPicker_toggle_btn')))
+                SCHOOL_PICKER_TOGGLE_BUTTON_ID)))
             logging.info("School Picker found. Click it.")
 
             elem.click()
 
-            time.sleep(1)
-
             logging.info("Waiting for School Search Field")
-            elem = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((By.ID, 
-                'schoolSearchField_value')))
+            with timed_wait('switch_to_school: search field ready', replaced_sleep_seconds=1):
+                elem = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((By.ID, 
+                    'schoolSearchField_value')))
             logging.info("Found School Search Field. Typing in school name.")
 
             elem.send_keys(school_name)
 
-            time.sleep(1)
-
             logging.info("Looking for first school in list")
-            elem = WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.XPATH, 
-                "//ul[@id='school_choices']/li[1]")))
+            with timed_wait('switch_to_school: search results', replaced_sleep_seconds=1):
+                elem = wait_for_element_count_to_stabilize(self.driver, By.XPATH, "//ul[@id='school_choices']/li")[0]
 
             logging.info("Found first school in results list. Clicking.")
+            old_page = self.driver.find_element(By.TAG_NAME, 'html')
             elem.click()
             logging.info("Click. Waiting for page to refresh.")
-            time.sleep(1)
+            with timed_wait('switch_to_school: page refreshed', replaced_sleep_seconds=1):
+                wait_for_page_to_reload(self.driver, old_page)
             
             assert self.check_whether_desired_school_selected(school_name), "Failed to select \
                 desired school."
@@ -327,106 +433,105 @@ class PowerSchool:
 
         click_element_by_partial_link_text(self.driver, report_link_text)
 
+        # Used to keep track of how long this report takes to generate
+        self._current_report_name = report_link_text
+
     def download_latest_report_from_report_queue_reportworks(self, destination_directory_path: str = '.', 
-        file_postfix: str = ''):
+        file_postfix: str = '', timeout_seconds: int = DEFAULT_REPORT_QUEUE_TIMEOUT_SECONDS):
         """
         Navigates to the PowerSchool Report Queue (ReportWorks), confirms the most recent report is 
         done generating, and downloads it.
 
+        The queue is checked often at first and then less and less often (see
+        general.polling.poll_until). How long the report took is recorded in
+        self.report_generation_times.
+
         Parameters:
         self
         destination_directory_path: Where to download the PowerSchool report to.
         file_postfix: Optional postfix to attach to the end of the downloaded file's filename.
+        timeout_seconds: How long to wait for the report to finish generating.
 
         Returns:
-        bool: True once successfully downloads the report. Otherwise, function keeps looping.
+        bool: True once successfully downloads the report. Raises a PollingTimeoutError if the
+            report is still generating after timeout_seconds. The path of the downloaded
+            (renamed) file is stored in self.last_downloaded_file_path.
         """
+        submitted_at = time.monotonic()
         self.ensure_on_desired_path(REPORT_QUEUE_REPORTWORKS_PAGE_PATH)
 
-        # Pause briefly to give the just-submitted report time to get into the queue
-        time.sleep(5)
+        def no_reports_running_or_pending():
+            self._reload_report_queue()
+            return len(self.driver.find_elements(By.XPATH, "//p[contains(text(), 'No reports running or pending!')]")) > 0
 
-        # Confirm that the page has loaded
-        elem = WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.ID, 'prReloadButton')))
-        elem.click()
-        logging.info('Refresh button on report page has loaded. Refreshing.')
-        
-        while True:
-            # TODO: Add a counter so this function can't get stuck in an infinte loop.
-            try:
-                # Confirm no reports are running
-                self.driver.find_element(By.XPATH, "//p[contains(text(), 'No reports running or pending!')]")
-                
-                # TODO: Is the below refresh necessary when we're refreshing upon first hitting this page?
-                # There is occasional flakiness where the "No reports running or pending!" message 
-                #    shows up but the latest report is not in the list for downloading yet, so refresh 
-                #    the page one more time.
-                time.sleep(1)
-                elem = WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.ID, 'prReloadButton')))
-                elem.click()
-                time.sleep(1)
-            except NoSuchElementException: # Because reports ARE running
-                time.sleep(5)
-                elem = WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.ID, 'prReloadButton')))
-                elem.click()
-                logging.info('PowerSchool report is not ready, refreshing and waiting.')
-                time.sleep(3)
-            else:
-                # Download the first report in table
-                queued_reports = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((
-                    By.XPATH, '//*[@id="queuecontent"]/table/tbody/tr[2]/td[8]/a')))
-                download_link = queued_reports.get_attribute('href')
-                original_files_list = os.listdir(destination_directory_path)
-                self.driver.get(download_link) #downloads the file
-                logging.info('PowerSchool report downloaded.')
-                break
+        self._poll_report_queue(no_reports_running_or_pending, timeout_seconds, submitted_at)
+
+        # There is occasional flakiness where the "No reports running or pending!" message 
+        #    shows up but the latest report is not in the list for downloading yet, so refresh 
+        #    the page one more time.
+        self._reload_report_queue()
+
+        # Download the first report in table
+        queued_reports = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((
+            By.XPATH, '//*[@id="queuecontent"]/table/tbody/tr[2]/td[8]/a')))
+        download_link = queued_reports.get_attribute('href')
+
+        if self.use_http_downloads:
+            self.last_downloaded_file_path = self._download_file_over_http(download_link, destination_directory_path,
+                file_postfix)
+            return True
 
-        self._wait_for_new_file_in_folder(destination_directory_path, original_files_list)
-        self._rename_recent_file_in_dir(destination_directory_path, file_postfix)
-        logging.info('Successfully renamed the downloaded file.')
+        download_watcher = DownloadWatcher(destination_directory_path)
+        self.driver.get(download_link) #downloads the file
+        logging.info('Downloading PowerSchool report.')
+
+        downloaded_file_path = download_watcher.wait_for_download()
+        self.last_downloaded_file_path = self._rename_downloaded_file(downloaded_file_path, file_postfix)
+        logging.info(f'Successfully renamed the downloaded file to {self.last_downloaded_file_path}.')
 
         return True
 
     def download_latest_report_from_report_queue_system(self, destination_directory_path: str = '.', 
-        file_postfix: str = ''):
+        file_postfix: str = '', timeout_seconds: int = DEFAULT_REPORT_QUEUE_TIMEOUT_SECONDS):
         """
         Navigates to the PowerSchool Report Queue (System), confirms the most recent report is done 
         generating, and downloads it.
 
+        The queue is checked often at first and then less and less often (see
+        general.polling.poll_until). How long the report took is recorded in
+        self.report_generation_times.
+
         Parameters:
         driver: A Selenium WebDriver
         destination_directory_path: Where to download the PowerSchool report to.
         file_postfix: Optional postfix to attach to the end of the downloaded file's filename.
+        timeout_seconds: How long to wait for the report to finish generating.
 
         Returns:
         bool: True if successfully downloads a report, or False if it cannot, either because the 
             report generated no results from the previously-submitted parameters or the report
-            download page is in a format this function does not handle.
+            download page is in a format this function does not handle. Raises a
+            PollingTimeoutError if reports are still running after timeout_seconds. The path of
+            the downloaded (renamed) file is stored in self.last_downloaded_file_path.
         """
-        self.ensure_on_desired_path(REPORT_QUEUE_SYSTEM_PAGE_PATH)
+        submitted_at = time.monotonic()
 
-        # Pause briefly to give the just-submitted report time to get into the queue
-        time.sleep(5)
+        def no_reports_running():
+            queue_rows, _ = self._get_report_queue_system_rows()
+            return not any('Running' in cells for cells, links in queue_rows)
 
-        # Confirm that the page has loaded
-        elem = WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.ID, 'prReloadButton')))
-        elem.click()
-        logging.info('Refresh button on report page has loaded. Refreshing.')
+        self._poll_report_queue(no_reports_running, timeout_seconds, submitted_at)
+        logging.info('No currently running reports. Downloading the most recently completed report.')
 
-        while True:
-            try:
-                # Try to find a running report
-                self.driver.find_element(By.XPATH, "//td[text()='Running']")
-
-                # If yes, keep going here
-                time.sleep(5)
-                elem = WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.ID, 'prReloadButton')))
-                elem.click()
-                logging.info('PowerSchool report is not ready, refreshing and waiting.')
-                time.sleep(3)
-            except NoSuchElementException: # Because all reports are done running
-                logging.info('No currently running reports. Downloading the most recently completed report.')
-                break
+        if self.use_http_downloads:
+            queue_rows, page_url = self._get_report_queue_system_rows()
+            view_urls = [_get_report_queue_view_url(links, page_url) for cells, links in queue_rows]
+            view_urls = [view_url for view_url in view_urls if view_url is not None]
+            if len(view_urls) == 0:
+                logging.info('No completed report found in the report queue.')
+                return False
+
+            return self._download_report_queue_system_job(view_urls[0], destination_directory_path, file_postfix)
 
         top_completed_report_view_link = WebDriverWait(self.driver, 30).until(EC.element_to_be_clickable((By.XPATH,
             "//*[@id='content-main']/div[3]/table/tbody/tr[1]/td[a[text()='View']][1]/a"))) 
@@ -435,18 +540,315 @@ class PowerSchool:
             # The above XPATH tries to dynamically determine which column the link is in to be robust to these changes.
         top_completed_report_view_link.click()
 
+        return self._download_report_queue_system_result(destination_directory_path, file_postfix)
+
+    def start_report_queue_pipeline(self):
+        """
+        Switches to pipelined mode: instead of waiting for each report, the report download
+        functions (e.g., in PowerSchoolCALPADS) submit their report to the System report queue,
+        record its job ID and return it right away, so PowerSchool generates the reports in
+        parallel. Call harvest_report_queue_pipeline afterwards to download them all.
+
+        Reports that go to the ReportWorks queue are still downloaded one at a time.
+
+        Parameters:
+        self
+
+        Returns:
+        n/a
+        """
+        self._known_report_queue_job_ids = {row['job_id'] for row in self._get_report_queue_system_jobs()}
+        self._pending_report_queue_jobs = []
+
+    def harvest_report_queue_pipeline(self, timeout_seconds: int=DEFAULT_REPORT_QUEUE_TIMEOUT_SECONDS):
+        """
+        Waits for the System report queue jobs submitted since start_report_queue_pipeline, and
+        downloads each one as soon as it has finished, by its job ID. Then leaves pipelined mode.
+
+        Parameters:
+        self
+        timeout_seconds: How long to wait for all the jobs to finish.
+
+        Returns:
+        pandas.DataFrame: One row per submitted job, with its job_id, destination_directory_path,
+            file_postfix, status ('downloaded', 'no_file', 'not_finished') and file_path.
+        """
+        if self._pending_report_queue_jobs is None:
+            raise Exception('No report queue pipeline was started. Call start_report_queue_pipeline first.')
+
+        jobs = self._pending_report_queue_jobs
+        for job in jobs:
+            job.update({'status': 'not_finished', 'file_path': None})
+
+        unfinished_jobs = list(jobs)
+
+        def download_finished_jobs():
+            queue_rows = {row['job_id']: row for row in self._get_report_queue_system_jobs()}
+
+            # A job can only be downloaded once its View link is there
+            finished_jobs = [job for job in unfinished_jobs if job['job_id'] in queue_rows
+                and queue_rows[job['job_id']]['finished'] and queue_rows[job['job_id']]['view_url'] is not None]
+
+            for job in finished_jobs:
+                logging.info(f"Report queue job {job['job_id']} has finished. Downloading it.")
+                self.report_generation_times.record(job['report_name'], time.monotonic() - job['submitted_at'])
+                self.last_downloaded_file_path = None
+
+                if self._download_report_queue_system_job(queue_rows[job['job_id']]['view_url'],
+                    job['destination_directory_path'], job['file_postfix']):
+                    job.update({'status': 'downloaded', 'file_path': self.last_downloaded_file_path})
+                else:
+                    job['status'] = 'no_file'
+
+                unfinished_jobs.remove(job)
+
+            return len(unfinished_jobs) == 0
+
+        try:
+            poll_until(download_finished_jobs, timeout_seconds, description='the submitted report queue jobs')
+        except PollingTimeoutError:
+            logging.warning(f'{len(unfinished_jobs)} report queue jobs did not finish within {timeout_seconds} '
+                f"seconds: {[job['job_id'] for job in unfinished_jobs]}")
+
+        self._pending_report_queue_jobs = None
+
+        return pd.DataFrame(jobs, columns=['job_id', 'destination_directory_path', 'file_postfix', 'status',
+            'file_path'])
+
+    def _download_or_defer_report(self, report_queue: str, destination_directory_path: str, file_postfix: str):
+        """
+        Called right after a report has been submitted. Downloads it from report_queue
+        (REPORT_QUEUE_SYSTEM or REPORT_QUEUE_REPORTWORKS) and returns whether it did, like
+        the download_latest_report_from_report_queue_* functions. In pipelined mode (see
+        start_report_queue_pipeline), System report queue jobs are recorded for
+        harvest_report_queue_pipeline instead, and their job ID is returned.
+        """
+        if report_queue == REPORT_QUEUE_SYSTEM:
+            if self._pending_report_queue_jobs is not None:
+                submitted_at = time.monotonic()
+                job_id = self._wait_for_new_report_queue_system_job()
+                self._pending_report_queue_jobs.append({
+                    'job_id': job_id,
+                    'destination_directory_path': destination_directory_path,
+                    'file_postfix': file_postfix,
+                    'report_name': self._current_report_name,
+                    'submitted_at': submitted_at,
+                })
+                logging.info(f'Submitted report queue job {job_id}; it will be downloaded when harvested.')
+                return job_id
+
+            return self.download_latest_report_from_report_queue_system(destination_directory_path, file_postfix)
+        elif report_queue == REPORT_QUEUE_REPORTWORKS:
+            if self._pending_report_queue_jobs is not None:
+                logging.info('ReportWorks reports cannot be pipelined. Waiting for this one to download.')
+
+            return self.download_latest_report_from_report_queue_reportworks(destination_directory_path, file_postfix)
+        else:
+            raise KeyError(f'{report_queue} is not a report queue')
+
+    def _wait_for_new_report_queue_system_job(self, timeout_seconds: int=DEFAULT_REPORT_QUEUE_SUBMIT_TIMEOUT_SECONDS):
+        """
+        Waits for a job that hasn't been seen before to show up in the System report queue,
+        and returns its job ID (see _get_report_queue_system_jobs). The job doesn't need to
+        have a View link yet.
+        """
+        def find_new_job_id():
+            # The queue lists the newest jobs first
+            new_job_ids = [row['job_id'] for row in self._get_report_queue_system_jobs()
+                if row['job_id'] not in self._known_report_queue_job_ids]
+            return new_job_ids[0] if len(new_job_ids) > 0 else None
+
+        job_id = poll_until(find_new_job_id, timeout_seconds, description='the submitted report to show up in the report queue')
+        self._known_report_queue_job_ids.add(job_id)
+
+        return job_id
+
+    def _poll_report_queue(self, report_queue_done, timeout_seconds, submitted_at):
+        """
+        Polls the report queue page until report_queue_done() returns True, then records
+        how long the current report took. The first check waits long enough for a just-
+        submitted report to get into the queue, or longer if this report usually takes longer.
+        """
+        report_name = self._current_report_name
+        initial_delay_seconds = self.report_generation_times.suggested_initial_delay(report_name,
+            minimum_seconds=DEFAULT_REPORT_QUEUE_SETTLE_SECONDS)
+
+        poll_until(report_queue_done, timeout_seconds, description=f'PowerSchool report "{report_name}" to finish',
+            initial_delay_seconds=initial_delay_seconds)
+
+        self.report_generation_times.record(report_name, time.monotonic() - submitted_at)
+
+    def _get_report_queue_system_rows(self, include_headers: bool=False):
+        """
+        Loads (or reloads) the System report queue page and reads its table rows, either in
+        the browser or, with use_http_downloads, over HTTP without rendering the page.
+
+        Returns:
+        tuple: A list of (cell texts, [(link text, href)]) for each row, and the page URL the
+            hrefs are relative to. With include_headers, also the texts of the table's header
+            cells.
+        """
+        if self.use_http_downloads:
+            r = self._http_get(ADMIN_URL_SCHEME + self._get_current_domain() + '/' + REPORT_QUEUE_SYSTEM_PAGE_PATH)
+            page_source, page_url = r.text, r.url
+        else:
+            self.ensure_on_desired_path(REPORT_QUEUE_SYSTEM_PAGE_PATH)
+            self._reload_report_queue()
+            page_source, page_url = self.driver.page_source, self.driver.current_url
+
+        parser = _ReportQueueTableParser()
+        parser.feed(page_source)
+
+        if include_headers:
+            return parser.rows, page_url, parser.headers
+        return parser.rows, page_url
+
+    def _get_report_queue_system_jobs(self):
+        """
+        Reads the jobs on the System report queue page (see _get_report_queue_system_rows).
+
+        Returns:
+        list: A dict for each job, newest first: job_id (its report name and submitted time,
+            from the columns headed by REPORT_QUEUE_SYSTEM_JOB_KEY_HEADERS, numbered if several
+            jobs have the same ones), view_url (the absolute URL of its View link, or None until
+            it has one) and finished (whether its status is not one of
+            REPORT_QUEUE_SYSTEM_UNFINISHED_STATUSES).
+        """
+        queue_rows, page_url, headers = self._get_report_queue_system_rows(include_headers=True)
+
+        key_columns = []
+        for key_header in REPORT_QUEUE_SYSTEM_JOB_KEY_HEADERS:
+            matching_columns = [i for i, header in enumerate(headers) if key_header in header.lower()]
+            if len(matching_columns) == 0:
+                raise Exception(f'Could not find the "{key_header}" column of the System report queue to '
+                    f'identify jobs by. Its headers are {headers}.')
+            key_columns.append(matching_columns[0])
+
+        jobs = []
+        for cells, links in queue_rows:
+            if len(cells) <= max(key_columns):
+                # Not a job, e.g., a "no reports" message
+                continue
+
+            jobs.append({
+                'job_id': ' | '.join(cells[i] for i in key_columns),
+                'view_url': _get_report_queue_view_url(links, page_url),
+                'finished': not any(cell in REPORT_QUEUE_SYSTEM_UNFINISHED_STATUSES for cell in cells),
+            })
+
+        # Number jobs with the same report name and submitted time from the oldest, so their
+        #   IDs don't change as newer jobs are added to the top of the queue
+        job_id_counts = {}
+        for job in reversed(jobs):
+            job_id_counts[job['job_id']] = job_id_counts.get(job['job_id'], 0) + 1
+            if job_id_counts[job['job_id']] > 1:
+                job['job_id'] += f" ({job_id_counts[job['job_id']]})"
+
+        return jobs
+
+    def _reload_report_queue(self):
+        elem = WebDriverWait(self.driver, 5).until(EC.element_to_be_clickable((By.ID, 'prReloadButton')))
+        elem.click()
+
+        # Wait for the page to reload, if the button reloads the whole page
+        try:
+            WebDriverWait(self.driver, 5).until(EC.staleness_of(elem))
+        except TimeoutException:
+            pass
+        WebDriverWait(self.driver, 30).until(EC.presence_of_element_located((By.ID, 'prReloadButton')))
+
+    def _download_report_queue_system_job(self, view_url: str, destination_directory_path: str, file_postfix: str):
+        """
+        Opens a System report queue job's View page and downloads its result file, in the
+        browser or, with use_http_downloads, over HTTP. Returns the same as
+        _download_report_queue_system_result.
+        """
+        if not self.use_http_downloads:
+            self.driver.get(view_url)
+            return self._download_report_queue_system_result(destination_directory_path, file_postfix)
+
+        r = self._http_get(view_url)
+        parser = _ReportQueueTableParser()
+        parser.feed(r.text)
+
+        result_file_links = [href for text, href in parser.links if text == 'Click to Download Result File']
+        if len(result_file_links) > 0:
+            self.last_downloaded_file_path = self._download_file_over_http(urljoin(r.url, result_file_links[0]),
+                destination_directory_path, file_postfix)
+            return True
+        elif 'No records found' in r.text:
+            logging.info('PowerSchool reports "No records found"')
+            return False
+        else:
+            logging.info(f"Unable to confirm results. Please check manually for postfix {file_postfix}.")
+            return False
+
+    def _http_get(self, url: str):
+        """
+        GETs a PowerSchool page over HTTP with the browser's login cookies. If the cookies
+        have changed since they were copied (i.e., the request was sent to the login page),
+        they are copied again once.
+
+        Returns:
+        requests.Response
+        """
+        for attempt in range(2):
+            if self._http_session is None or attempt > 0:
+                self._http_session = create_requests_session_from_driver(self.driver)
+
+            r = self._http_session.get(url)
+            r.raise_for_status()
+
+            if ADMIN_LOGIN_PAGE_PATH not in r.url:
+                return r
+
+        raise Exception(f'Could not fetch {url} over HTTP: PowerSchool sent the request to the login page.')
+
+    def _download_file_over_http(self, url: str, destination_directory_path: str, file_postfix: str):
+        """
+        Streams a file from PowerSchool to destination_directory_path, with file_postfix added
+        to its name, and returns its path. Like _http_get, if PowerSchool sends a page (e.g., the
+        login page, because the cookies have changed since they were copied) instead of the
+        file, the cookies are copied again once. Nothing is saved unless a file comes back.
+        """
+        for attempt in range(2):
+            if self._http_session is None or attempt > 0:
+                self._http_session = create_requests_session_from_driver(self.driver)
+
+            logging.info('Downloading PowerSchool report over HTTP.')
+            try:
+                file_path = download_file_with_requests_session(self._http_session, url, destination_directory_path,
+                    file_postfix, rejected_content_types=['text/html'])
+            except ValueError as e:
+                logging.info(f'PowerSchool sent a page instead of the report: {e}')
+                continue
+
+            logging.info(f'Downloaded the report to {file_path}.')
+            return file_path
+
+        raise Exception(f'Could not download {url} over HTTP: PowerSchool sent a page (probably the login page) '
+            'instead of the file.')
+
+    def _download_report_queue_system_result(self, destination_directory_path: str, file_postfix: str):
+        """
+        Downloads the result file of a System report queue job whose View page is loaded.
+
+        Returns:
+        bool: True if the file was downloaded, or False if the report generated no results or
+            the page is in a format this function does not handle.
+        """
         try:
             # Look for a result file link
             logging.info('Looking for the result file link.')
             download_link = WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((
                 By.LINK_TEXT, 'Click to Download Result File')))
-            original_files_list = os.listdir(destination_directory_path)
+            download_watcher = DownloadWatcher(destination_directory_path)
             download_link.click()
             logging.info('Downloading PowerSchool report.')
 
-            self._wait_for_new_file_in_folder(destination_directory_path, original_files_list)
-            self._rename_recent_file_in_dir(destination_directory_path, file_postfix)
-            logging.info('Successfully renamed the downloaded file.')
+            downloaded_file_path = download_watcher.wait_for_download()
+            self.last_downloaded_file_path = self._rename_downloaded_file(downloaded_file_path, file_postfix)
+            logging.info(f'Successfully renamed the downloaded file to {self.last_downloaded_file_path}.')
 
             return True
         except:
@@ -687,6 +1089,42 @@ class PowerSchool:
             raise Exception("Unable to confirm successful login to PowerSchool. Please check your \
                 credentials.")
 
+    def _is_logged_into_powerschool_admin(self):
+        """
+        Checks whether the page that was just loaded is a logged-in PowerSchool Admin page.
+
+        Parameters:
+        self
+
+        Returns:
+        bool: True if the 'Start Page' heading shows up, False if on the login page or it doesn't
+        """
+        if ADMIN_LOGIN_PAGE_PATH in self.driver.current_url:
+            return False
+
+        try:
+            WebDriverWait(self.driver, 10).until(EC.visibility_of_element_located((By.XPATH, 
+                "//h1[text()='Start Page']")))
+            return True
+        except TimeoutException:
+            return False
+
+    def _get_picker_toggle_text(self, toggle_button_id):
+        # Text of a picker button in the page header, or None if it isn't on the page
+        try:
+            return self.driver.find_element(By.ID, toggle_button_id).text
+        except NoSuchElementException:
+            return None
+
+    def _is_selection_unchanged(self, selection, desired_value, toggle_button_id):
+        # Whether the school or school year confirmed earlier is desired_value, and the
+        # picker button in the header still shows what it did then (so nothing has
+        # changed it since, e.g. in another tab or by the login expiring)
+        if selection is None or selection[0] != desired_value:
+            return False
+
+        return selection[1] is not None and self._get_picker_toggle_text(toggle_button_id) == selection[1]
+
     def _get_current_domain(self):
         """
         Retrieves the current domain.
@@ -713,37 +1151,43 @@ class PowerSchool:
 
         return self.driver.current_url[8:].split("/",1)[1:][0]
 
-    def _wait_for_new_file_in_folder(self, folder_path, original_files, max_attempts=20000):
+    def _wait_for_new_file_in_folder(self, folder_path, original_files, timeout_seconds=DEFAULT_DOWNLOAD_TIMEOUT_SECONDS):
         """
-        Waits until a new file shows up in a folder. Loops until that is true or max_attempts is 
-        reached.
+        Waits until a new file has finished downloading into a folder, i.e., it is not a
+        temporary (e.g., .crdownload) file and its size has stopped changing. Raises
+        TimeoutError if that doesn't happen within timeout_seconds.
 
         Parameters:
         self
         folder_path: The folder being monitored.
         original_files: The list of files originally in the folder, before the new one is added.
-        max_attmepts: Optional parameter that sets how many loops the function will do.
+        timeout_seconds: Optional parameter that sets how long to wait for the download.
 
         Returns:
-        n/a
+        str: The path of the downloaded file
+        """
+        return wait_for_new_file_in_folder(folder_path, original_files, timeout_seconds)
+
+    def _rename_downloaded_file(self, file_path, append_text):
+        """
+        Appends text to a downloaded file's filename.
+
+        Parameters:
+        self
+        file_path: The path of the downloaded file
+        append_text: The text to appended to the filename before the extension.
+
+        Returns:
+        str: The new path of the file
         """
-        file_added = False
-        attempts = 0
-        while True and attempts < max_attempts:
-            for root, folders, files in os.walk(folder_path):
-                # break 'for' loop if files found
-                if len(files) > len(original_files):
-                    file_added = True
-                    break
-                else:
-                    continue
-            # break 'while' loop if files found
-            if file_added:
-                # wait for download to complete fully after it's been added - hopefully 3 seconds 
-                #    is enough.
-                time.sleep(3)
-                break
-            attempts +=1
+
+        file_path = file_path.replace('\\', '/')
+        new_file, file_ext = os.path.splitext(file_path)
+        new_file += append_text
+        new_file += file_ext
+        os.rename(file_path, new_file)
+
+        return new_file
 
     def _rename_recent_file_in_dir(self, folder, append_text):
         """
@@ -755,12 +1199,63 @@ class PowerSchool:
         append_text: The text to appended to the filename before the extension.
 
         Returns:
-        n/a
+        str: The new path of the file
         """
 
-        recent_file = get_most_recent_file_in_dir(folder)
-        recent_file = recent_file.replace('\\', '/')
-        new_file, file_ext = os.path.splitext(recent_file)
-        new_file += append_text
-        new_file += file_ext
-        os.rename(recent_file, new_file)
+        return self._rename_downloaded_file(get_most_recent_file_in_dir(folder), append_text)
+
+def _get_report_queue_view_url(links, page_url):
+    # The absolute URL of a report queue row's View link, or None if it has none
+    view_links = [href for text, href in links if text == 'View']
+    return urljoin(page_url, view_links[0]) if len(view_links) > 0 else None
+
+class _ReportQueueTableParser(HTMLParser):
+    """
+    Collects the rows of the tables in a report queue page: for each <tr> with <td> cells,
+    the text of each cell and the (text, href) of each link. The texts of the first row of
+    <th> cells are collected in headers, and all the page's links in links.
+    """
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.headers = []
+        self.links = []
+        self._header_cells = None
+        self._cells = None
+        self._links = None
+        self._cell_text = None
+        self._link = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._cells, self._links, self._header_cells = [], [], []
+        elif tag in ('td', 'th') and self._cells is not None:
+            self._cell_text = []
+        elif tag == 'a':
+            self._link = ['', dict(attrs).get('href')]
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            if self._link[1] is not None:
+                self.links.append((self._link[0].strip(), self._link[1]))
+                if self._links is not None:
+                    self._links.append((self._link[0].strip(), self._link[1]))
+            self._link = None
+        elif tag == 'td' and self._cell_text is not None:
+            self._cells.append(''.join(self._cell_text).strip())
+            self._cell_text = None
+        elif tag == 'th' and self._cell_text is not None:
+            self._header_cells.append(''.join(self._cell_text).strip())
+            self._cell_text = None
+        elif tag == 'tr' and self._cells is not None:
+            if len(self._cells) > 0:
+                self.rows.append((self._cells, self._links))
+            if len(self._header_cells) > 0 and len(self.headers) == 0:
+                self.headers = self._header_cells
+            self._cells, self._links, self._header_cells = None, None, None
+
+    def handle_data(self, data):
+        if self._cell_text is not None:
+            self._cell_text.append(data)
+        if self._link is not None:
+            self._link[0] += data
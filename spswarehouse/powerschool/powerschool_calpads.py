@@ -1,8 +1,21 @@
+from contextlib import nullcontext
 from datetime import datetime, date
+import logging
+import threading
 import time
 import pandas as pd
 
-from .powerschool import PowerSchool
+from .powerschool import (
+    PowerSchool,
+    REPORT_QUEUE_REPORTWORKS,
+    REPORT_QUEUE_SYSTEM,
+)
+
+from spswarehouse.config import (
+    DEFAULT_BROWSER_POOL_MAX_ATTEMPTS,
+    DEFAULT_BROWSER_POOL_SESSIONS,
+)
+from spswarehouse.general.browser_pool import BrowserPool
 
 from spswarehouse.general.selenium import (
     type_in_element_by_name,
@@ -16,8 +29,16 @@ from spswarehouse.general.selenium import (
     type_in_element_by_name,
     select_visible_text_in_element_by_name,
     click_element_by_id,
+    timed_wait,
+    wait_for_element_to_be_visible,
 )
 
+from selenium.webdriver.common.by import By
+
+# Reports that are run from the District Office instead of the school (see
+# download_calpads_report_for_school)
+DISTRICT_OFFICE_REPORT_TYPES = ['SCSC', 'SCSE']
+
 # Used for making the standard modifications to the Student English Language Acquistion (SELA) upload file; column #'s from the CALPADS file specifications
 SELA_COLUMN_NAMES = [
     'Record Type Code', # 12.01
@@ -53,8 +74,12 @@ class PowerSchoolCALPADS(PowerSchool):
         headless: bool=True,
         download_location: str='.',
         chrome_option_prefs: dict=None,
+        report_generation_times_path: str=None,
+        use_http_downloads: bool=False,
+        session_cookies_path: str=None,
     ):
-        super().__init__(config, username, password, host, headless, download_location, chrome_option_prefs)    
+        super().__init__(config, username, password, host, headless, download_location, chrome_option_prefs,
+            report_generation_times_path, use_http_downloads, session_cookies_path)
         
     def download_calpads_report_for_school(self, school_full_name: str, submission_window: str, 
         calpads_report_abbreviation: str, ps_school_subdistrict_name: str, file_postfix: str, 
@@ -65,6 +90,9 @@ class PowerSchoolCALPADS(PowerSchool):
         report for the specified submission window. Note: This function currently only supports EOY 
         reports and some All Year reports. Fall 1 and Fall 2 reports should not use this function until 
         it is expanded.
+
+        Returns whether the report was downloaded or, in pipelined mode (see
+        start_report_queue_pipeline), the report queue job ID of System report queue reports.
         """
 
         if calpads_report_abbreviation not in self.CALPADS_REPORT_TYPES:
@@ -85,7 +113,7 @@ class PowerSchoolCALPADS(PowerSchool):
         # The SCSC/SCSE reports need to be run from the District Office level in order to properly generate 
         #   LEA IDs without dropping leading zeros
         #   SCSC also requires an additional parameter
-        if calpads_report_abbreviation in ["SCSC", "SCSE"]:
+        if calpads_report_abbreviation in DISTRICT_OFFICE_REPORT_TYPES:
             self.switch_to_school('District Office')
             report_kwargs['ps_school_subdistrict_name'] = ps_school_subdistrict_name
         else:
@@ -96,6 +124,65 @@ class PowerSchoolCALPADS(PowerSchool):
         # dictionary are not (and cannot be) defined as `self.function`, thus requiring that self
         # be passed explicitly instead
         return self.CALPADS_REPORT_TYPES[calpads_report_abbreviation]['function'](self, **report_kwargs)
+
+    def download_calpads_reports_pipelined(self, report_jobs: list, destination_directory_path: str,
+        submit_lock=None):
+        """
+        Submits all the reports first and then downloads them as they finish, so PowerSchool
+        generates them in parallel instead of one at a time. Reports that go to the ReportWorks
+        queue are still downloaded as they are submitted. If every job gives its
+        ps_school_year_dropdown, reports are submitted grouped by school year and school (see
+        get_report_job_school), so each is switched to only once. Otherwise they are submitted
+        in the order given, because a job without a school year runs in whichever year the jobs
+        before it selected.
+
+        Parameters:
+        report_jobs: A list of dicts with the arguments of download_calpads_report_for_school,
+            except destination_directory_path. Each job should have a distinct file_postfix.
+        destination_directory_path: Where to download the reports to.
+        submit_lock: Optional lock (e.g., a threading.Lock) held while the reports are submitted
+            and their jobs are found in the report queue, and while ReportWorks reports are
+            downloaded. Sessions logged in with the same account see the same report queues, so
+            sharing a lock between them keeps each one from taking another's job as its own.
+
+        Returns:
+        pandas.DataFrame: One row per job, in the order given: the job's arguments, status
+            ('downloaded', 'no_file' or 'not_finished') and file_path.
+        """
+        # Indexed like report_jobs, so the jobs are returned in the order given
+        submitted_jobs = [None] * len(report_jobs)
+        with submit_lock or nullcontext():
+            self.start_report_queue_pipeline()
+            try:
+                submission_order = list(range(len(report_jobs)))
+                if _can_reorder_report_jobs(report_jobs):
+                    submission_order.sort(key=lambda job_index: _get_report_job_navigation_key(report_jobs[job_index]))
+                for job_index in submission_order:
+                    report_job = report_jobs[job_index]
+                    self.last_downloaded_file_path = None
+                    outcome = self.download_calpads_report_for_school(
+                        destination_directory_path=destination_directory_path, **report_job)
+
+                    if isinstance(outcome, str):
+                        submitted_jobs[job_index] = {**report_job, 'job_id': outcome}
+                    else:
+                        # Downloaded right away (ReportWorks)
+                        submitted_jobs[job_index] = {**report_job, 'job_id': None,
+                            'status': 'downloaded' if outcome else 'no_file',
+                            'file_path': self.last_downloaded_file_path if outcome else None}
+            except:
+                # Leave pipelined mode, so later calls download reports as usual
+                self._pending_report_queue_jobs = None
+                raise
+
+        df_harvested = self.harvest_report_queue_pipeline()
+
+        harvested_jobs = df_harvested.set_index('job_id')[['status', 'file_path']].to_dict('index')
+        for job in submitted_jobs:
+            if job['job_id'] is not None:
+                job.update(harvested_jobs[job['job_id']])
+
+        return pd.DataFrame(submitted_jobs)
     
     # All Year Reports #################
 
@@ -124,7 +211,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
     
     def _download_all_year_report_for_student_english_language_acquisition_records_sela(self, file_postfix: str, 
@@ -195,7 +282,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
 
     def _download_all_year_report_for_student_information_records_sinf(self, file_postfix: str, 
@@ -263,7 +350,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
 
 
@@ -283,7 +370,8 @@ class PowerSchoolCALPADS(PowerSchool):
         ensure_checkbox_is_checked_by_name(self.driver, 'SubmissionType')
         
         # Date field needs time to appear
-        time.sleep(1) 
+        with timed_wait('CALPADS report: date field visible', replaced_sleep_seconds=1):
+            wait_for_element_to_be_visible(self.driver, By.NAME, 'CensusDate')
         type_in_element_by_name(self.driver, 'CensusDate', report_parameters['census_date'])
         
         select_visible_text_in_element_by_name(self.driver, 'deltaOff', 'Non-submission mode (all records)')
@@ -296,7 +384,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
 
     def _download_fall_2_report_for_staff_assignment_records_sass(self, file_postfix: str, 
@@ -318,7 +406,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
 
     # TODO: Refactor CRSC/CRSE to be a shared function rather than two totally separate ones
@@ -335,7 +423,8 @@ class PowerSchoolCALPADS(PowerSchool):
             report_parameters['submission_type'])
 
         # Date fields need time to appear
-        time.sleep(1) 
+        with timed_wait('CALPADS report: date field visible', replaced_sleep_seconds=1):
+            wait_for_element_to_be_visible(self.driver, By.ID, 'censusDate')
         select_visible_text_in_element_by_id(self.driver, 'useTracks', 
             report_parameters['use_tracks'])
         type_in_element_by_id(self.driver, 'censusDate', 
@@ -349,7 +438,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'submitReportSDKRuntimeParams')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_reportworks(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_REPORTWORKS, destination_directory_path, 
             file_postfix)
 
     # TODO: Make SCSC and SCSE a shared function
@@ -382,7 +471,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
     
     # EOY Reports ######################
@@ -410,7 +499,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'submitReportSDKRuntimeParams')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_reportworks(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_REPORTWORKS, destination_directory_path, 
             file_postfix)
 
     def _download_eoy_report_for_student_incident_results_records_sirs_or_student_offense_records_soff(
@@ -434,7 +523,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'submitReportSDKRuntimeParams')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_reportworks(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_REPORTWORKS, destination_directory_path, 
             file_postfix)
 
     def _download_eoy_report_for_student_absence_summary_stas(self, file_postfix: str, 
@@ -462,7 +551,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
 
     def _download_student_program_records_sprg(self, file_postfix: str, 
@@ -497,7 +586,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
 
     def _download_eoy_report_for_student_program_records_sprg(self, **kwargs):
@@ -519,7 +608,8 @@ class PowerSchoolCALPADS(PowerSchool):
             report_parameters['submission_type'])
 
         # Date fields need time to appear
-        time.sleep(1) 
+        with timed_wait('CALPADS report: date field visible', replaced_sleep_seconds=1):
+            wait_for_element_to_be_visible(self.driver, By.ID, 'startDate')
         type_in_element_by_id(self.driver, 'startDate', 
             report_parameters['report_start_date'])
         type_in_element_by_id(self.driver, 'endDate', 
@@ -533,7 +623,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'submitReportSDKRuntimeParams')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_reportworks(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_REPORTWORKS, destination_directory_path, 
             file_postfix)
     
     # TODO: Make SCSC and SCSE a shared function
@@ -571,7 +661,7 @@ class PowerSchoolCALPADS(PowerSchool):
         click_element_by_id(self.driver, 'btnSubmit')
 
         # Download report zipfile
-        return self.download_latest_report_from_report_queue_system(destination_directory_path, 
+        return self._download_or_defer_report(REPORT_QUEUE_SYSTEM, destination_directory_path, 
             file_postfix)
     
     CALPADS_REPORT_TYPES = {
@@ -632,6 +722,93 @@ class PowerSchoolCALPADS(PowerSchool):
             'function': _download_eoy_report_for_student_absence_summary_stas,
         },
     }
+
+# Downloading Many Reports #################
+
+def download_calpads_reports_for_schools(report_jobs: list, destination_directory_path: str,
+    config=None, num_sessions: int=DEFAULT_BROWSER_POOL_SESSIONS, max_attempts: int=DEFAULT_BROWSER_POOL_MAX_ATTEMPTS,
+    headless: bool=True, chrome_option_prefs: dict=None, manifest_path: str=None):
+    """
+    Downloads many CALPADS reports (e.g., every report type for every school) using several
+    logged-in PowerSchoolCALPADS sessions at once, and returns a manifest DataFrame with
+    one row per job: the job's arguments, status ('downloaded', 'no_file' if PowerSchool
+    generated no file, or 'failed'), file_path, attempts, seconds and error.
+
+    Parameters:
+    report_jobs: A list of dicts with the arguments of download_calpads_report_for_school,
+        except destination_directory_path. Each job should have a distinct file_postfix,
+        and should give ps_school_year_dropdown: jobs run on whichever session is free, so
+        a job without one runs in whichever year its session selected last. If every job
+        gives one, each session keeps to one school year and school for as long as it can.
+    destination_directory_path: Where the renamed files are collected. Each session
+        downloads into its own session_<index> subfolder first.
+    config: A PowerSchool config dict (see PowerSchool), or a list of them to log each
+        session in with a different account. Defaults to the credentials file. Each job
+        downloads its own report by its report queue job ID, but sessions logged in with the
+        same account take turns submitting reports (see download_calpads_reports_pipelined),
+        so more accounts means less waiting.
+    num_sessions: How many browser sessions run at once. Ignored if config is a list.
+    max_attempts: How many times a job is tried, on a fresh session after a failure.
+    manifest_path: Optional path to also save the manifest to as a CSV.
+
+    Returns:
+    pandas.DataFrame: The manifest
+    """
+    report_jobs = list(report_jobs)
+    configs = config if isinstance(config, list) else [config] * num_sessions
+
+    # The report queue pages show the reports of the logged-in account, so sessions logged in
+    #   with the same account share a lock around submitting reports and finding their jobs
+    account_submit_locks = {repr(account_config): threading.Lock() for account_config in configs}
+    # Keyed by session download directory, which run_job is given
+    session_submit_locks = {}
+
+    def create_session(session_index, download_directory):
+        session_submit_locks[download_directory] = account_submit_locks[repr(configs[session_index])]
+        return PowerSchoolCALPADS(config=configs[session_index], headless=headless,
+            download_location=download_directory, chrome_option_prefs=chrome_option_prefs)
+
+    def run_job(session, report_job, download_directory):
+        # Each job is a pipeline of one, so the session waits for its own job ID, not the top of the queue
+        df_job = session.download_calpads_reports_pipelined([report_job], download_directory,
+            submit_lock=session_submit_locks[download_directory])
+        job = df_job.iloc[0]
+
+        if job['status'] == 'not_finished':
+            raise Exception(f"Report queue job {job['job_id']} did not finish in time.")
+
+        return job['file_path'] if job['status'] == 'downloaded' else None
+
+    pool = BrowserPool(create_session, len(configs), destination_directory_path, max_attempts)
+
+    # Keep each session on one school year and school for as long as there are jobs for it
+    group_by = _get_report_job_navigation_key if _can_reorder_report_jobs(report_jobs) else None
+
+    return pool.run(report_jobs, run_job, manifest_path, group_by=group_by)
+
+def get_report_job_school(report_job: dict) -> str:
+    """
+    Returns the school that PowerSchool needs to be switched to for a report job (a dict
+    with the arguments of download_calpads_report_for_school): 'District Office' for
+    reports that are run at the district level, and the job's school otherwise.
+    """
+    if report_job['calpads_report_abbreviation'] in DISTRICT_OFFICE_REPORT_TYPES:
+        return 'District Office'
+    return report_job['school_full_name']
+
+def _can_reorder_report_jobs(report_jobs):
+    # A job without a school year runs in whichever year is selected when it starts, so moving it
+    #   past a job that switches the year would change which year its report is for
+    if all(report_job.get('ps_school_year_dropdown') is not None for report_job in report_jobs):
+        return True
+
+    logging.info('Not all report jobs give ps_school_year_dropdown, so they are run in the order given '
+        'instead of grouped by school year and school.')
+    return False
+
+def _get_report_job_navigation_key(report_job):
+    # Jobs with the same key run without switching school year or school in between
+    return (report_job['ps_school_year_dropdown'], get_report_job_school(report_job))
     
 # Helper Functions #################
 
@@ -2,13 +2,10 @@ import pandas as pd
 from pandas.api.extensions import no_default
 
 import numpy as np
-import os
-import random
 import re
-import string
 
-from .config import DEFAULT_ENCODING
-from .googledrive import GoogleDrive
+from .config import DEFAULT_CSV_READ_CHUNK_ROWS, DEFAULT_ENCODING
+from .googledrive import get_drive_file_content
 
 # Copied from https://stackoverflow.com/questions/40774787/renaming-columns-in-a-pandas-dataframe-with-duplicate-column-names
 # guess_col_types will break if you have duplicate column names
@@ -106,19 +103,7 @@ def create_table_stmt(
         else:
             df = pd.read_csv(csv_filename, encoding=encoding, sep=sep)
     elif google_drive_id is not None:
-        letters = string.ascii_letters
-        filename = ''.join(random.choice(letters) for i in range(10)) + '.csv'
-        tempFile = GoogleDrive.CreateFile({'id': google_drive_id})
-        tempFile.GetContentFile(filename)
-        try:
-            if force_string:
-                df = pd.read_csv(filename, encoding=encoding, dtype=str, sep=sep)
-            else:
-                df = pd.read_csv(filename, encoding=encoding, sep=sep)
-        except Exception as error:
-            raise error
-        finally:
-            os.remove(filename)
+        df = read_google_drive_csv(google_drive_id, encoding=encoding, force_string=force_string, sep=sep)
     else:
         raise
 
@@ -132,6 +117,52 @@ def create_table_stmt(
         comment,
     )
 
+def read_google_drive_csv(google_drive_id, encoding=DEFAULT_ENCODING, force_string=False,
+    sep=no_default, chunksize=None, dtype=None):
+    """
+    read_google_drive_csv: Drive file ID -> pandas.DataFrame
+    read_google_drive_csv: Drive file ID, chunksize -> iterator of pandas.DataFrame
+
+    Reads a CSV stored in Google Drive without writing it to disk. The content comes
+    from googledrive.get_drive_file_content, so reading the same unchanged file again
+    (e.g., in create_table_stmt and then an upload) only downloads it once.
+
+    If chunksize is given, returns pandas' chunked reader instead of a DataFrame. pandas
+    guesses column types separately for each chunk, so pass dtype (e.g., from
+    guess_google_drive_csv_dtypes) to read every chunk with the same types.
+    """
+    buffer = get_drive_file_content(google_drive_id)
+
+    if force_string:
+        return pd.read_csv(buffer, encoding=encoding, dtype=str, sep=sep, chunksize=chunksize)
+    else:
+        return pd.read_csv(buffer, encoding=encoding, sep=sep, chunksize=chunksize, dtype=dtype)
+
+def guess_google_drive_csv_dtypes(google_drive_id, encoding=DEFAULT_ENCODING, sep=no_default,
+    chunksize=DEFAULT_CSV_READ_CHUNK_ROWS):
+    """
+    guess_google_drive_csv_dtypes: Drive file ID -> {column name: numpy dtype}
+
+    Returns the column types pandas would guess reading the whole CSV at once, worked
+    out chunk by chunk so the file is never fully loaded into one DataFrame: a column
+    is int64 or float64 only if it is numeric in every chunk (float64 if any chunk has
+    decimals or blanks), and bool only if it is bool in every chunk. Anything else is
+    read as text (object).
+    """
+    dtypes = {}
+    for df in read_google_drive_csv(google_drive_id, encoding=encoding, sep=sep, chunksize=chunksize):
+        for column_name, chunk_dtype in df.dtypes.items():
+            dtypes[column_name] = _combine_dtypes(dtypes.get(column_name, chunk_dtype), chunk_dtype)
+
+    return dtypes
+
+def _combine_dtypes(dtype_a, dtype_b):
+    if dtype_a == dtype_b:
+        return dtype_a
+    if {dtype_a, dtype_b} == {np.dtype('int64'), np.dtype('float64')}:
+        return np.dtype('float64')
+    return np.dtype('O')
+
 def _create_table_stmt(table_name, schema, col_types, comment):
     return "CREATE TABLE {schema}.{table_name} ({cols}) COMMENT = '{comment}'".format(
         schema=schema,
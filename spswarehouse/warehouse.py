@@ -1,7 +1,6 @@
 import os
 import pandas
-import random
-import string
+import uuid
 
 try:
     from .credentials import snowflake_config
@@ -15,9 +14,16 @@ from snowflake.sqlalchemy import VARIANT
 
 from datetime import date
 
-from .config import DEFAULT_BATCH_SIZE, DEFAULT_ENCODING
-from .googledrive import GoogleDrive
-from .table_utils import renamer, sanitize_columns_for_upload
+from .config import DEFAULT_BATCH_SIZE, DEFAULT_CSV_READ_CHUNK_ROWS, DEFAULT_ENCODING
+from .googlesheets import get_worksheets_as_dataframes
+from .table_utils import (
+    guess_col_types,
+    guess_google_drive_csv_dtypes,
+    read_google_drive_csv,
+    renamer,
+    sanitize_columns_for_upload,
+    sanitize_string,
+)
 
 def describe(table):
     for c in table.columns:
@@ -126,6 +132,7 @@ class Warehouse:
         end_index=None,
         batch_size=DEFAULT_BATCH_SIZE,
         force_string=False,
+        verbose=True,
     ):
 
         if force_string:
@@ -137,12 +144,14 @@ class Warehouse:
         dataframe = sanitize_columns_for_upload(dataframe)
         dataframe = dataframe.rename(columns=renamer())
     
-        print(str(end_index - start_index) + ' rows to insert')
+        if verbose:
+            print(str(end_index - start_index) + ' rows to insert')
     
         current_index = start_index
         while current_index < end_index:
             stop_index = min(current_index + batch_size, end_index)
-            print(f'loading records {current_index} to {stop_index-1}')
+            if verbose:
+                print(f'loading records {current_index} to {stop_index-1}')
             dataframe[current_index:stop_index].to_sql(
                 name=table,
                 con=self.engine,
@@ -153,8 +162,84 @@ class Warehouse:
             )
             current_index = stop_index
 
-        print(f"Data inserted to {schema}.{table} successfully")
-    
+        if verbose:
+            print(f"Data inserted to {schema}.{table} successfully")
+
+    def upsert_df(
+        self,
+        table,
+        schema,
+        dataframe,
+        key_columns,
+        batch_size=DEFAULT_BATCH_SIZE,
+        force_string=False,
+    ):
+        """
+        upsert_df: table name, schema name, pandas.DataFrame, [key column names] -> None
+
+        Updates the rows of schema.table whose key columns match a row of the dataframe,
+        and inserts the rest. If a key appears more than once in the dataframe, its last
+        row is used. If the table doesn't exist yet, it is created by upload_df.
+
+        Columns of the dataframe that the table doesn't have yet (e.g., a new field in an
+        API response) are added to the table first, with types guessed by
+        table_utils.guess_col_types.
+
+        The dataframe is uploaded to a transient staging table (schema.<table>__staging_<random
+        suffix>, so concurrent upserts into the same table don't collide; dropped afterwards)
+        and applied with a single Snowflake MERGE. Column names are sanitized the same way
+        upload_df does it, including the key column names.
+        """
+        if force_string:
+            dataframe = dataframe.astype(str)
+
+        dataframe = sanitize_columns_for_upload(dataframe.copy())
+        dataframe = dataframe.rename(columns=renamer())
+        key_columns = [sanitize_string(column) for column in key_columns]
+
+        missing_key_columns = [column for column in key_columns if column not in dataframe.columns]
+        if len(missing_key_columns) > 0:
+            raise Exception(f'Key columns {missing_key_columns} are not in the dataframe.')
+
+        dataframe = dataframe.drop_duplicates(subset=key_columns, keep='last').reset_index(drop=True)
+
+        if not self.insp.has_table(table, schema=schema):
+            self.upload_df(table, schema, dataframe, batch_size=batch_size)
+            return
+
+        # Unquoted column names aren't case sensitive, so compare them in lowercase
+        table_columns = {column.lower() for column in self.read_sql(f'SELECT * FROM {schema}.{table} LIMIT 0').columns}
+        new_column_types = {column: column_type for column, column_type in guess_col_types(dataframe).items()
+            if column.lower() not in table_columns}
+        for column, column_type in new_column_types.items():
+            column_type = 'VARCHAR' if column_type == 'unknown' else column_type
+            print(f'Adding column {column} {column_type} to {schema}.{table}')
+            self.execute(f'ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS {column} {column_type}')
+
+        staging_table = f'{table}__staging_{uuid.uuid4().hex[:12]}'
+        self.execute(f'CREATE TRANSIENT TABLE {schema}.{staging_table} LIKE {schema}.{table}')
+
+        try:
+            self.upload_df(staging_table, schema, dataframe, batch_size=batch_size)
+
+            columns = list(dataframe.columns)
+            join_condition = ' AND '.join(f'target.{column} = staging.{column}' for column in key_columns)
+            update_columns = [column for column in columns if column not in key_columns]
+
+            merge_sql = f'MERGE INTO {schema}.{table} AS target USING {schema}.{staging_table} AS staging ON {join_condition}'
+            if len(update_columns) > 0:
+                merge_sql += ' WHEN MATCHED THEN UPDATE SET ' + ', '.join(f'target.{column} = staging.{column}' for column in update_columns)
+            merge_sql += (
+                f' WHEN NOT MATCHED THEN INSERT ({", ".join(columns)})'
+                f' VALUES ({", ".join(f"staging.{column}" for column in columns)})'
+            )
+
+            self.execute(merge_sql)
+        finally:
+            self.execute(f'DROP TABLE IF EXISTS {schema}.{staging_table}')
+
+        print(f"Data upserted to {schema}.{table} successfully")
+
     def upload_google_drive_csv(
         self,
         table,
@@ -167,21 +252,49 @@ class Warehouse:
         force_string=False,
         sep=",",
     ):
-        letters = string.ascii_letters
-        filename = ''.join(random.choice(letters) for i in range(10)) + '.csv'
-        tempFile = GoogleDrive.CreateFile({'id': google_drive_id})
-        tempFile.GetContentFile(filename)
-        try:
-            if force_string:
-                df = pandas.read_csv(filename, encoding=encoding, dtype=str, sep=sep)
-            else:
-                df = pandas.read_csv(filename, encoding=encoding, sep=sep)
-            os.remove(filename)
-        except Exception as error:
-            raise error
+        """
+        Uploads a CSV stored in Google Drive to schema.table.
 
-        #  Pass force_string=False, since we've already handled force_string here
-        self.upload_df(table, schema, df, start_index, end_index, batch_size, force_string=False)
+        The file is streamed from Drive into memory (no temp file) and read in chunks,
+        so large files are never fully loaded into a single DataFrame. start_index and
+        end_index refer to rows of the whole file.
+
+        Column types are worked out over the whole file first (see
+        table_utils.guess_google_drive_csv_dtypes), the same as create_table_stmt and a
+        non-chunked read would guess them, and every chunk is read with those types.
+        """
+        chunksize = max(batch_size, DEFAULT_CSV_READ_CHUNK_ROWS)
+
+        dtypes = None
+        if not force_string:
+            dtypes = guess_google_drive_csv_dtypes(google_drive_id, encoding=encoding, sep=sep, chunksize=chunksize)
+
+        csv_chunks = read_google_drive_csv(
+            google_drive_id,
+            encoding=encoding,
+            force_string=force_string,
+            sep=sep,
+            chunksize=chunksize,
+            dtype=dtypes,
+        )
+
+        rows_read = 0
+        rows_inserted = 0
+        for df in csv_chunks:
+            chunk_start_index = max(start_index - rows_read, 0)
+            chunk_end_index = len(df) if end_index is None else min(end_index - rows_read, len(df))
+
+            if chunk_start_index < chunk_end_index:
+                #  Pass force_string=False, since we've already handled force_string here
+                self.upload_df(table, schema, df, chunk_start_index, chunk_end_index, batch_size, force_string=False,
+                    verbose=False)
+                rows_inserted += chunk_end_index - chunk_start_index
+
+            rows_read += len(df)
+            if end_index is not None and rows_read >= end_index:
+                break
+
+        print(f"{rows_inserted} rows inserted to {schema}.{table} successfully")
 
     
     def upload_google_sheet(
@@ -194,8 +307,19 @@ class Warehouse:
         batch_size=DEFAULT_BATCH_SIZE,
         encoding=DEFAULT_ENCODING,
         force_string=False,
+        use_values_api=False,
     ):
-        if force_string:
+        """
+        Uploads the contents of a gspread Worksheet to schema.table.
+
+        With use_values_api=True, the worksheet is read with
+        googlesheets.get_worksheets_as_dataframes, which fetches typed values in
+        row-range chunks and is much faster for large sheets. Note that blank cells
+        are then uploaded as NULL instead of ''.
+        """
+        if use_values_api:
+            df = get_worksheets_as_dataframes([google_sheet], force_string=force_string)[google_sheet.title]
+        elif force_string:
             google_sheet_values = google_sheet.get_all_values()
             df = pandas.DataFrame(google_sheet_values[1:], columns=google_sheet_values[0])
         else: